@@ -100,8 +100,13 @@ if __name__ == "__main__":
     from tornado.wsgi import WSGIContainer
     from tornado.httpserver import HTTPServer
     from tornado.ioloop import IOLoop
+    from tornado.web import Application, FallbackHandler
 
-    server = HTTPServer(WSGIContainer(app))
+    from routes.stats_stream import build_stream_stats
+
+    # Streaming routes are served by Tornado, everything else by Flask
+    server = HTTPServer(Application(build_stream_stats(app) +
+                                    [(r'.*', FallbackHandler, {'fallback': WSGIContainer(app)})]))
     server.bind(address='0.0.0.0', port=int(app.config['PORT']))
     server.start(0)  # Forks multiple sub-processes
     IOLoop.current().start()
@@ -1,12 +1,19 @@
 import logging
+import os
 import pickle
 import random
-from gevent import Greenlet, sleep
-from threading import Lock
+import socket
+from datetime import datetime, timedelta
+from gevent import Greenlet, sleep, spawn
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.select import select
+from sqlalchemy import func
 
 from app import create_app
 from dota_bot import DotaBot
-from models import db, DynamicConfiguration, Game, GameStatus, GameVIP
+from models import db, BotCredentialLease, Game, GameStatus, GameVIP
+from helpers.dynamic_config import dynamic_config, get_dynamic_config
 from helpers.general import divide_vip_list_per_type
 
 # Log
@@ -32,6 +39,109 @@ class Credential:
         self.password = password
 
 
+class PollingWakeup:
+    """Wake up the manager by polling the database, with an adaptive interval.
+
+    The interval starts at its minimum, doubles each time the manager finds nothing to do,
+    and goes back to the minimum as soon as there is work.
+    A local signal can wake the manager before the end of the interval.
+
+    Attributes:
+        min_interval: Seconds to wait when there is work.
+        max_interval: Maximum seconds to wait when idle.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.signal = Event()
+
+    def wake(self):
+        """Wake the manager up immediately, from the same process."""
+        self.signal.set()
+
+    def wait(self, busy):
+        """Wait until the manager should check the database again.
+
+        Args:
+            busy: True if the manager found work during its last check.
+        Returns:
+            Set of table names that changed, None if unknown and everything must be reloaded.
+        """
+        self.interval = self.min_interval if busy else min(self.interval * 2, self.max_interval)
+        self.signal.wait(self.interval)
+        self.signal.clear()
+        return None
+
+
+class PostgresWakeup(PollingWakeup):
+    """Wake up the manager on the Postgres notifications sent by the database triggers.
+
+    The LISTEN connection is dedicated and outside of the SQLAlchemy pool.
+    Falls back to a full reload if no notification arrives before the maximum interval.
+
+    Attributes:
+        engine: SQLAlchemy engine of the database.
+        channel: Notification channel of the triggers.
+    """
+
+    def __init__(self, engine, channel, min_interval, max_interval):
+        PollingWakeup.__init__(self, min_interval, max_interval)
+        self.engine = engine
+        self.channel = channel
+        self.connection = None
+
+    def listen(self):
+        """Open the LISTEN connection if not already opened."""
+        if self.connection is not None:
+            return
+        raw = self.engine.raw_connection()
+        raw.detach()
+        connection = raw.connection
+        connection.autocommit = True
+        connection.cursor().execute('LISTEN {0};'.format(self.channel))
+        self.connection = connection
+
+    def wait(self, busy):
+        """Wait for a notification, a local signal, or the maximum interval.
+
+        Args:
+            busy: True if the manager found work during its last check.
+        Returns:
+            Set of table names that changed, None if unknown and everything must be reloaded.
+        """
+        if busy:
+            sleep(self.min_interval)
+        try:
+            self.listen()
+            waited = 0
+            while waited < self.max_interval and not self.signal.is_set():
+                readable, _, _ = select([self.connection], [], [], self.min_interval)
+                if len(readable) > 0:
+                    self.connection.poll()
+                    if len(self.connection.notifies) > 0:
+                        tables = set(notify.payload for notify in self.connection.notifies)
+                        del self.connection.notifies[:]
+                        return tables
+                waited += self.min_interval
+        except Exception as e:
+            logging.error('Bot manager LISTEN connection failed: {0}'.format(e))
+            self.close()
+            sleep(self.min_interval)
+        self.signal.clear()
+        return None
+
+    def close(self):
+        """Close the LISTEN connection."""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
 class WorkerManager(Greenlet):
     """Master class starting Dota bots to process jobs.
 
@@ -39,9 +149,18 @@ class WorkerManager(Greenlet):
     It is a thread pooling jobs from the database, starting new Dota bots when a new job is available.
     After a job process, the Dota bot informs that the credentials are available again.
 
+    In sharded mode, several managers share the credentials and the games through database row locks.
+    A credential is leased by a manager with an expiration renewed by a heartbeat. When a lease expires,
+    the manager is considered dead and the games of its bots are given back to the other managers.
+
     Attributes:
         app: The flask application the manager is linked to, containing configuration objects and database access.
         working_bots: A dictionary of all currently working Dota bots, indexed by bot login.
+        wakeup: `PollingWakeup` or `PostgresWakeup` deciding when the database is checked again.
+        admins, casters, bot_pause: Cached VIPs and pause status, reloaded only when their tables change.
+        sharded: True if the credentials and games are leased in the database with other managers.
+        worker_id: Unique identifier of the manager in sharded mode.
+        lease_ttl: Seconds a credential lease is valid without heartbeat.
     """
 
     def __init__(self):
@@ -52,7 +171,7 @@ class WorkerManager(Greenlet):
         self.app = create_app()
         self.working_bots = {}
         self.credentials = []
-        self.mutex = Lock()
+        self.mutex = Semaphore()
 
         # Parse credentials from config
         bot_credentials_string = self.app.config['STEAM_BOTS']
@@ -65,41 +184,255 @@ class WorkerManager(Greenlet):
             self.credentials.append(Credential(login, password))
             i = i + 2
 
+        # Wakeup mechanism
+        self.admins = None
+        self.casters = None
+        self.bot_pause = None
+        self.wakeup = self._create_wakeup()
+
+        # Sharding
+        self.sharded = self.app.config.get('BOT_SHARDED', False)
+        self.worker_id = self.app.config.get('BOT_WORKER_ID', None) or '{0}-{1}'.format(socket.gethostname(),
+                                                                                       os.getpid())
+        self.lease_ttl = self.app.config.get('BOT_LEASE_TTL', 30)
+        if self.sharded:
+            with self.app.app_context():
+                if db.engine.dialect.name != 'postgresql':
+                    logging.warning('BOT_SHARDED requires Postgres row locks to be safe.')
+                BotCredentialLease.register([credential.login for credential in self.credentials])
+                # Leases left by a previous run with the same worker id are not used by any bot anymore
+                db.session().query(BotCredentialLease)\
+                            .filter(BotCredentialLease.worker == self.worker_id)\
+                            .update({BotCredentialLease.expiration: datetime.utcnow()},
+                                    synchronize_session=False)
+                db.session().commit()
+                self._reclaim_expired_leases()
+
+    def _create_wakeup(self):
+        """Choose the wakeup mechanism from the config and the database dialect.
+
+        Returns:
+            `PostgresWakeup` if BOT_WAKEUP allows it with a Postgres database, `PollingWakeup` otherwise.
+        """
+        mode = self.app.config.get('BOT_WAKEUP', 'auto')
+        min_interval = self.app.config.get('BOT_POLL_MIN_INTERVAL', 1)
+        max_interval = self.app.config.get('BOT_POLL_MAX_INTERVAL', 60)
+        with self.app.app_context():
+            dialect = db.engine.dialect.name
+            if mode in ['auto', 'notify'] and dialect == 'postgresql':
+                return PostgresWakeup(db.engine, 'bot_manager', min_interval, max_interval)
+        if mode == 'notify':
+            logging.warning('BOT_WAKEUP notify requires Postgres, falling back to polling.')
+        return PollingWakeup(min_interval, max_interval)
+
     def _run(self):
         """Start the main loop of the thread, creating Dota bots to process available jobs."""
+        if self.sharded:
+            spawn(self._heartbeat)
+        changed = None
         while True:
+            busy = False
             with self.app.app_context():
-                admins, casters = divide_vip_list_per_type(GameVIP.get_all_vips())
-                bot_pause = DynamicConfiguration.get('bot_pause', 'False')
-                for game in db.session().query(Game)\
-                                        .filter(Game.status==GameStatus.WAITING_FOR_BOT)\
-                                        .order_by(Game.id).all():
-                    if len(self.credentials) == 0 or bot_pause == 'True':
-                        continue
-
-                    # Start a Dota bot to process the game
+                if changed is None or 'game_vip' in changed or self.admins is None:
+                    self.admins, self.casters = divide_vip_list_per_type(GameVIP.get_all_vips())
+                if changed is None or 'dynamic_configuration' in changed or self.bot_pause is None:
+                    dynamic_config.invalidate()
+                    self.bot_pause = get_dynamic_config().get('bot_pause', 'False')
+
+                if len(self.credentials) > 0 and self.bot_pause != 'True':
+                    if self.sharded:
+                        busy = self._dispatch_sharded()
+                    else:
+                        busy = self._dispatch()
+            changed = self.wakeup.wait(busy)
+
+    def _dispatch(self):
+        """Start Dota bots with the free credentials for the games waiting for a bot.
+
+        Returns:
+            True if at least one bot was started.
+        """
+        busy = False
+        for game in db.session().query(Game)\
+                                .filter(Game.status==GameStatus.WAITING_FOR_BOT)\
+                                .order_by(Game.id).all():
+            if len(self.credentials) == 0:
+                break
+
+            # Start a Dota bot to process the game
+            self.mutex.acquire()
+            credential = self.credentials.pop(random.randint(0, len(self.credentials) - 1))
+            game.status = GameStatus.CREATION_IN_PROGRESS
+            game.bot = credential.login
+            db.session().commit()
+            self._start_bot(credential, game)
+            self.mutex.release()
+            busy = True
+        return busy
+
+    def _dispatch_sharded(self):
+        """Lease a free credential and a waiting game together, and start a Dota bot on them.
+
+        Both rows are locked with SKIP LOCKED, so concurrent managers never wait for each other
+        and never take the same credential or game.
+
+        Returns:
+            True if at least one bot was started.
+        """
+        busy = False
+        while len(self.credentials) > 0:
+            self.mutex.acquire()
+            try:
+                logins = [credential.login for credential in self.credentials]
+                lease = db.session().query(BotCredentialLease)\
+                                    .filter(BotCredentialLease.login.in_(logins),
+                                            BotCredentialLease.worker.is_(None))\
+                                    .order_by(func.random())\
+                                    .with_for_update(skip_locked=True)\
+                                    .first()
+                game = None
+                if lease is not None:
+                    game = db.session().query(Game)\
+                                       .filter(Game.status==GameStatus.WAITING_FOR_BOT)\
+                                       .order_by(Game.id)\
+                                       .with_for_update(skip_locked=True)\
+                                       .first()
+                if game is None:
+                    db.session().rollback()
+                    return busy
+
+                # Start a Dota bot to process the game
+                credential = next(x for x in self.credentials if x.login == lease.login)
+                self.credentials.remove(credential)
+                lease.worker = self.worker_id
+                lease.expiration = datetime.utcnow() + timedelta(seconds=self.lease_ttl)
+                game.status = GameStatus.CREATION_IN_PROGRESS
+                game.bot = credential.login
+                db.session().commit()
+                self._start_bot(credential, game)
+                busy = True
+            finally:
+                self.mutex.release()
+        return busy
+
+    def _start_bot(self, credential, game):
+        """Start a Dota bot to process a game.
+
+        Args:
+            credential: `Credential` of the bot.
+            game: `Game` to process.
+        """
+        g = DotaBot(self, credential, self.admins, self.casters, game.id, game.name, game.password,
+                    game.team1, game.team2, game.team1_ids, game.team2_ids, game.team_choosing_first)
+        self.working_bots[credential.login] = g
+        g.start()
+
+    def _heartbeat(self):
+        """Renew the leases of the manager and reclaim the expired leases of the others, in sharded mode.
+
+        Bots whose lease is not owned by the manager anymore, reclaimed by another manager after missed
+        heartbeats, are stopped.
+        """
+        while True:
+            try:
+                with self.app.app_context():
                     self.mutex.acquire()
-                    credential = self.credentials.pop(random.randint(0, len(self.credentials) - 1))
-                    g = DotaBot(self, credential, admins, casters, game.id, game.name, game.password,
-                                game.team1, game.team2, game.team1_ids, game.team2_ids, game.team_choosing_first)
-                    self.working_bots[credential.login] = g
-                    game.status = GameStatus.CREATION_IN_PROGRESS
-                    game.bot = credential.login
-                    db.session().commit()
-                    g.start()
-                    self.mutex.release()
-            sleep(60)
+                    try:
+                        db.session().query(BotCredentialLease)\
+                                    .filter(BotCredentialLease.worker == self.worker_id)\
+                                    .update({BotCredentialLease.expiration: datetime.utcnow() +
+                                                                            timedelta(seconds=self.lease_ttl)},
+                                            synchronize_session=False)
+                        owned = set(login for login, in db.session().query(BotCredentialLease.login)
+                                                                    .filter(BotCredentialLease.worker ==
+                                                                            self.worker_id))
+                        db.session().commit()
+                        for login in [login for login in self.working_bots if login not in owned]:
+                            self._stop_lost_bot(login)
+                    finally:
+                        self.mutex.release()
+                    if self._reclaim_expired_leases():
+                        self.wakeup.wake()
+            except Exception as e:
+                logging.error('Bot manager heartbeat failed: {0}'.format(e))
+            sleep(self.lease_ttl / 3)
+
+    def _stop_lost_bot(self, login):
+        """Stop a bot whose lease was reclaimed, its credential is free to lease again. Needs the mutex.
+
+        Args:
+            login: Login of the bot credential.
+        """
+        bot = self.working_bots.pop(login)
+        logging.warning('Lease of {0} lost by {1}, bot stopped.'.format(login, self.worker_id))
+        bot.lease_lost()
+        self.credentials.append(bot.credential)
+
+    def _reclaim_expired_leases(self):
+        """Free the credentials of dead managers, and give their games back to the other managers.
+
+        Games not started yet wait for a new bot. Games already in progress can't be followed by a new bot, they
+        are cancelled, so no active game references the credential when it is leased again.
+
+        Returns:
+            True if at least one game is waiting for a bot again.
+        """
+        reclaimed = False
+        for lease in db.session().query(BotCredentialLease)\
+                                 .filter(BotCredentialLease.worker.isnot(None),
+                                         BotCredentialLease.expiration < datetime.utcnow())\
+                                 .with_for_update(skip_locked=True)\
+                                 .all():
+            for game in db.session().query(Game)\
+                                    .filter(Game.bot == lease.login,
+                                            Game.status.in_([GameStatus.CREATION_IN_PROGRESS,
+                                                             GameStatus.WAITING_FOR_PLAYERS,
+                                                             GameStatus.GAME_IN_PROGRESS]))\
+                                    .all():
+                if game.status == GameStatus.GAME_IN_PROGRESS:
+                    logging.warning('Game {0} lost its bot {1} while in progress, cancelled.'.format(game.id,
+                                                                                                     lease.login))
+                    game.status = GameStatus.CANCELLED
+                    continue
+                game.status = GameStatus.WAITING_FOR_BOT
+                game.bot = None
+                reclaimed = True
+            logging.info('Lease of {0} by {1} expired, reclaimed.'.format(lease.login, lease.worker))
+            lease.worker = None
+            lease.expiration = None
+        db.session().commit()
+        return reclaimed
 
     def bot_end(self, credential):
         """Signal that a bot has finished it work and the credential is free to use again.
 
+        In sharded mode the lease is only freed if still owned by the manager. A lost lease is not freed, the
+        credential is given back to the manager but can only be used again through a free lease.
+
         Args:
             credential: `Credential` of the bot.
         """
         self.mutex.acquire()
-        self.working_bots.pop(credential.login)
-        self.credentials.append(credential)
-        self.mutex.release()
+        try:
+            if self.working_bots.pop(credential.login, None) is None:
+                # Already stopped by the heartbeat after losing its lease
+                return
+            if self.sharded:
+                with self.app.app_context():
+                    freed = db.session().query(BotCredentialLease)\
+                                        .filter(BotCredentialLease.login == credential.login,
+                                                BotCredentialLease.worker == self.worker_id)\
+                                        .update({BotCredentialLease.worker: None,
+                                                 BotCredentialLease.expiration: None},
+                                                synchronize_session=False)
+                    db.session().commit()
+                if freed == 0:
+                    logging.warning('Lease of {0} lost by {1} before the end of its bot.'.format(credential.login,
+                                                                                               self.worker_id))
+            self.credentials.append(credential)
+        finally:
+            self.mutex.release()
+        self.wakeup.wake()
 
 
 # Start a Manager if this file is the main script.
@@ -11,6 +11,12 @@ class Config(object):
         SQLALCHEMY_TRACK_MODIFICATIONS: Flask SQLalchmey track modifications 
         option.
         DATABASE_URI: Url to the database used in Flask.
+        AUTH_TOKEN_CACHE_SIZE: Number of verified auth tokens cached by each process.
+        AUTH_CLIENT_CACHE_TTL: Seconds the refresh token and scopes of a client are cached by each process. A change
+            of a client clears the caches of the other processes within a check of the dynamic configuration.
+        API_KEY_HASH_SCHEME: Hash of the API Keys, 'hmac-sha256', 'blake2b' or legacy 'sha1'.
+        API_KEY_VERIFIED_TTL: Seconds a verified API Key and its refresh token are reused by login, a removed key
+            is still accepted by the other processes for up to this time.
     """
     DEBUG = True
     TESTING = True
@@ -25,14 +31,43 @@ class Config(object):
     STEAM_KEY='XXX'
     FRONTEND_LOGIN_REDIRECT='http://127.0.0.1:9999/api/auth/token_test'
     API_KEY_SALT = 'XXX'
+    AUTH_TOKEN_CACHE_SIZE = 1024
+    AUTH_CLIENT_CACHE_TTL = 10
+    API_KEY_HASH_SCHEME = 'hmac-sha256'
+    API_KEY_VERIFIED_TTL = 10
 
     VOD_PATH='/tmp'
     IMG_GENERATE_PATH='/tmp'
+    IMG_ASSET_CACHE_BYTES=256*1024*1024
+    IMG_RENDER_WORKERS=2
+    IMG_RENDER_JOB_TIMEOUT=300
+    IMG_RENDER_JOBS_PATH=None # IMG_GENERATE_PATH/render_jobs if None
+    IMG_RENDER_VERSION='1' # Change it to regenerate all the cached images, after an update of the assets
+    IMG_RENDER_CACHE_PATH=None # IMG_GENERATE_PATH/render_cache if None
+    IMG_RENDER_CACHE_SIZE=2048
+    IMG_ENCODING='png' # 'png', 'png-optimized', 'png-palette', 'png-fast', 'webp' or 'webp-lossless'
+    IMG_ENCODINGS={} # Encoding per image key, overrides IMG_ENCODING
+    IMG_GRAPH_SUPERSAMPLING=1 # Scale of the anti-aliasing of the post game graph lines, 1 to disable
+    IMG_CACHE_CONTROL='no-cache' # Cache-Control of the generated images, revalidated with their ETag
+    IMG_DEFAULT_CACHE_CONTROL='public, max-age=60' # Cache-Control of the default image of missing ones
+    IMG_SENDFILE=None # None to send the images from Flask, 'x-accel-redirect' (nginx) or 'x-sendfile'
+    IMG_SENDFILE_PREFIX='/generated_img/' # Internal nginx location of IMG_GENERATE_PATH for X-Accel-Redirect
     JSON_CACHE_PATH='/tmp'
+    CSV_KEY_COLUMNS={'preti8_teams': 'teamid', 'preti8_players': 'playerid', 'ti8_groups': 'teamid'} # Default key column per CSV key
+    OPENDOTA_MATCH_CACHE_SIZE=32 # Parsed OpenDota matches kept in memory per process
+    STATS_SCENE_POLL_INTERVAL=1 # Seconds between two checks of the stat scene changes, per process
+    STATS_SCENE_RELOAD_INTERVAL=60 # Seconds between two full reloads of the stat scene with Postgres notifications
+    STATS_SCENE_KEEPALIVE=15 # Seconds between two keepalive comments of the stat scene stream
 
     STEAM_BOTS = 'login1@pass1@login2@pass2'
     DOTA_LOBBY_CHEATS = False
     DOTA_LOBBY_TICKET = 0 # FTV 1 CUP is 4947 - FTV 2 LEAGUE is 9674
+    BOT_WAKEUP = 'auto' # 'auto', 'notify' (Postgres LISTEN/NOTIFY) or 'poll'
+    BOT_POLL_MIN_INTERVAL = 1
+    BOT_POLL_MAX_INTERVAL = 60
+    BOT_SHARDED = False # Lease credentials and games in database, to run several bot managers
+    BOT_WORKER_ID = None # Unique name of the bot manager, hostname-pid if None
+    BOT_LEASE_TTL = 30
 
 def load_config(config):
     """Load a configuration for the Flask application from a specific file.
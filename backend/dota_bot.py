@@ -25,6 +25,14 @@ class DotaBotState(enum.Enum):
 
     FINISHED = 100
 
+class DotaBotRole(enum.Enum):
+    TEAM1 = 1
+    TEAM2 = 2
+    ADMIN = 3
+    CASTER = 4
+
+VIP_ROLES = frozenset([DotaBotRole.ADMIN, DotaBotRole.CASTER])
+
 
 class DotaBot(Greenlet):
     """A worker thread, connecting to steam to process a unique job.
@@ -32,6 +40,8 @@ class DotaBot(Greenlet):
     Attributes:
         worker_manager: `WorkerManager` this bot is linked to.
         credential: `Credential` used to connect to steam.
+        roles: Index of the authorized members, steam id (64bits) -> frozenset of `DotaBotRole`.
+        kicks: Kicks already sent to members still inside the lobby, steam id -> set of slots (None for the lobby).
     """
 
     def __init__(self, worker_manager, credential, admins, casters, id, name, password, team1, team2, team1_ids, team2_ids,
@@ -58,10 +68,16 @@ class DotaBot(Greenlet):
         self.password = password
         self.team1 = team1
         self.team2 = team2
-        self.team1_ids = team1_ids
-        self.team2_ids = team2_ids
-        self.admins = admins
-        self.casters = casters
+        self.team1_ids = list(team1_ids)
+        self.team2_ids = list(team2_ids)
+        self.admins = list(admins)
+        self.casters = list(casters)
+        self.roles = {}
+        for steam_ids, role in [(self.team1_ids, DotaBotRole.TEAM1), (self.team2_ids, DotaBotRole.TEAM2),
+                                (self.admins, DotaBotRole.ADMIN), (self.casters, DotaBotRole.CASTER)]:
+            for steam_id in steam_ids:
+                self.add_role(steam_id, role)
+        self.kicks = {}
         self.lobby_options = {
             'game_name': self.name,
             'pass_key': self.password,
@@ -249,7 +265,7 @@ class DotaBot(Greenlet):
         for member in self.lobby_status.members:
             if member.id == self.dota.steam_id:
                 continue
-            if member.team == DOTA_GC_TEAM.PLAYER_POOL and not (member.id in self.casters or member.id in self.admins):
+            if member.team == DOTA_GC_TEAM.PLAYER_POOL and not self.has_role(member.id, VIP_ROLES):
                 self.dota.practice_lobby_kick(SteamID(member.id).as_32)
 
         # Start
@@ -308,7 +324,58 @@ class DotaBot(Greenlet):
         self.worker_manager.bot_end(self.credential)
         self.kill()
 
+    def lease_lost(self):
+        """Stop the bot from the manager, another manager reclaimed its credential and its game.
+
+        The game is not updated, it belongs to the other manager now.
+        """
+        self.print_error('Lease of the credential lost, bot stopped.')
+        self.machine_state = DotaBotState.FINISHED
+        try:
+            self.dota.destroy_lobby()
+            self.client.disconnect()
+        except Exception as e:
+            self.print_error('Disconnection failed: {0}'.format(e))
+        self.kill(block=False)
+
     # Helpers
+    def add_role(self, steam_id, role):
+        """Authorize a member with a new role, and forget the kicks sent before.
+
+        Args:
+            steam_id: Steam id (64bits) of the member.
+            role: `DotaBotRole` to add.
+        """
+        self.roles[steam_id] = self.roles.get(steam_id, frozenset()) | frozenset([role])
+        self.kicks.pop(steam_id, None)
+
+    def has_role(self, steam_id, roles):
+        """Check if a member has at least one of the roles.
+
+        Args:
+            steam_id: Steam id (64bits) of the member.
+            roles: Iterable of `DotaBotRole`.
+        Returns:
+            True if the member has one of the roles.
+        """
+        return not self.roles.get(steam_id, frozenset()).isdisjoint(roles)
+
+    def kick(self, steam_id, team):
+        """Kick a member from the lobby, or from a team slot, once while the member stays in the lobby.
+
+        Args:
+            steam_id: Steam id (64bits) of the member.
+            team: `DOTA_GC_TEAM` slot to kick the member from, None to kick from the lobby.
+        """
+        kicks = self.kicks.setdefault(steam_id, set())
+        if team in kicks:
+            return
+        kicks.add(team)
+        if team is None:
+            self.dota.practice_lobby_kick(SteamID(steam_id).as_32)
+        else:
+            self.dota.practice_lobby_kick_from_team(SteamID(steam_id).as_32)
+
 
     def print_info(self, trace):
         """Wrapper of `logging.info` with bot name prefix.
@@ -378,7 +445,7 @@ class DotaBot(Greenlet):
         elif command[0] == 'philaeux':
             self.dota.channels.lobby.send('Respectez mon créateur ou je vous def lose.')
         elif command[0] == 'cocaster':
-            if message_steam_id not in self.admins and message_steam_id not in self.casters:
+            if not self.has_role(message_steam_id, VIP_ROLES):
                 self.dota.channels.lobby.send('Seuls les casters et admins peuvent ajouter un cocaster.')
                 return
             if len(command) != 2:
@@ -388,9 +455,10 @@ class DotaBot(Greenlet):
                 self.dota.channels.lobby.send('SteamID (64bits) invalide dans la commande !cocaster.')
             else:
                 self.casters.append(int(command[1]))
+                self.add_role(int(command[1]), DotaBotRole.CASTER)
                 self.dota.channels.lobby.send('Cocaster {0} ajouté.'.format(command[1]))
         elif command[0] == 'standin':
-            if message_steam_id not in self.admins:
+            if not self.has_role(message_steam_id, [DotaBotRole.ADMIN]):
                 self.dota.channels.lobby.send('Seuls les admins peuvent ajouter un standin.')
                 return
             if len(command) != 3:
@@ -404,11 +472,13 @@ class DotaBot(Greenlet):
             else:
                 if command[2] == '1':
                     self.team1_ids.append(int(command[1]))
+                    self.add_role(int(command[1]), DotaBotRole.TEAM1)
                 else:
                     self.team2_ids.append(int(command[1]))
+                    self.add_role(int(command[1]), DotaBotRole.TEAM2)
                 self.dota.channels.lobby.send("Standin {0} ajouté à l'équipe {1}.".format(command[1], command[2]))
         elif command[0] == 'destroy':
-            if message_steam_id not in self.admins:
+            if not self.has_role(message_steam_id, [DotaBotRole.ADMIN]):
                 self.dota.channels.lobby.send('Seuls les admins peuvent détruirent le lobby.')
             else:
                 self.dota.channels.lobby.send('Lobby annulé par un admin.')
@@ -423,8 +493,8 @@ class DotaBot(Greenlet):
         elif command[0] == 'fp' or command[0] == 'sp' or command[0] == 'radiant' or command[0] == 'dire':
             if '!{0}'.format(command[0]) in self.team_choices_possibilities:
                 if self.machine_state == DotaBotState.PICKING_SIDE_ORDER:
-                    compare = self.team1_ids if self.team_choosing_now == 1 else self.team2_ids
-                    if message_steam_id in compare:
+                    compare = DotaBotRole.TEAM1 if self.team_choosing_now == 1 else DotaBotRole.TEAM2
+                    if self.has_role(message_steam_id, [compare]):
                         self.team_choices[self.team_choosing_now-1] = command[0]
 
     # Hosting events
@@ -455,26 +525,31 @@ class DotaBot(Greenlet):
                     self.machine_state = DotaBotState.GAME_IN_PROGRESS
 
         # Kick players not authorized
+        if self.team_inverted:
+            allowed_roles = {DOTA_GC_TEAM.GOOD_GUYS: DotaBotRole.TEAM2, DOTA_GC_TEAM.BAD_GUYS: DotaBotRole.TEAM1}
+        else:
+            allowed_roles = {DOTA_GC_TEAM.GOOD_GUYS: DotaBotRole.TEAM1, DOTA_GC_TEAM.BAD_GUYS: DotaBotRole.TEAM2}
+        present = set()
         for member in message.members:
             if member.id == self.dota.steam_id:
                 continue
-            if (member.id not in self.team1_ids and
-                member.id not in self.team2_ids and
-                member.id not in self.admins and
-                member.id not in self.casters):
-                self.dota.practice_lobby_kick(SteamID(member.id).as_32)
+            present.add(member.id)
+            # A kick from a team slot is sent again if the member comes back to it after moving
+            if member.id in self.kicks:
+                self.kicks[member.id] &= {None, member.team}
+            roles = self.roles.get(member.id, None)
+            if roles is None:
+                self.kick(member.id, None)
+                roles = frozenset()
             if ((member.team == DOTA_GC_TEAM.SPECTATOR) or
-                (member.team == DOTA_GC_TEAM.BROADCASTER and not (member.id in self.admins or member.id in self.casters))):
-                self.dota.practice_lobby_kick_from_team(SteamID(member.id).as_32)
-            else:
-                if self.team_inverted:
-                    if ((member.team == DOTA_GC_TEAM.BAD_GUYS and member.id not in self.team1_ids) or
-                        (member.team == DOTA_GC_TEAM.GOOD_GUYS and member.id not in self.team2_ids)):
-                        self.dota.practice_lobby_kick_from_team(SteamID(member.id).as_32)
-                else:
-                    if ((member.team == DOTA_GC_TEAM.GOOD_GUYS and member.id not in self.team1_ids) or
-                        (member.team == DOTA_GC_TEAM.BAD_GUYS and member.id not in self.team2_ids)):
-                        self.dota.practice_lobby_kick_from_team(SteamID(member.id).as_32)
+                (member.team == DOTA_GC_TEAM.BROADCASTER and roles.isdisjoint(VIP_ROLES))):
+                self.kick(member.id, member.team)
+            elif member.team in allowed_roles and allowed_roles[member.team] not in roles:
+                self.kick(member.id, member.team)
+
+        # Members who left can be kicked again if they come back
+        for steam_id in [x for x in self.kicks if x not in present]:
+            del self.kicks[steam_id]
 
     def initialize_lobby(self):
         """Setup the game lobby with the good options, and change status in database."""
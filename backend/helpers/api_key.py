@@ -0,0 +1,160 @@
+import hashlib
+import hmac
+import logging
+
+from sqlalchemy.exc import IntegrityError
+
+from helpers.cache import TTLCache
+from models import db, APIKey, APIKeyScope
+
+LEGACY_SCHEME = 'sha1'
+HASH_SCHEMES = ['hmac-sha256', 'blake2b', LEGACY_SCHEME]
+
+
+def hash_api_key(key, salt, scheme):
+    """Hash an API Key with a scheme.
+
+    Hashes are prefixed by their scheme, except the legacy sha1 ones already stored in the database.
+
+    Args:
+        key: API Key value.
+        salt: Secret salt of the application.
+        scheme: One of `HASH_SCHEMES`.
+    Returns:
+        Hash of the key, as stored in `APIKey.key_hash`.
+    """
+    if scheme == 'hmac-sha256':
+        digest = hmac.new(salt.encode('utf-8'), key.encode('utf-8'), hashlib.sha256).hexdigest()
+    elif scheme == 'blake2b':
+        digest = hashlib.blake2b(key.encode('utf-8'),
+                                 key=salt.encode('utf-8')[:hashlib.blake2b.MAX_KEY_SIZE],
+                                 digest_size=32).hexdigest()
+    elif scheme == LEGACY_SCHEME:
+        return hashlib.sha1((key + salt).encode('utf-8')).hexdigest()
+    else:
+        raise ValueError('Unknown API Key hash scheme {0}.'.format(scheme))
+    return '{0}${1}'.format(scheme, digest)
+
+
+class APIKeyHasher:
+    """Hash API Keys and find them in the database.
+
+    Keys still stored with the legacy sha1 hash are rehashed with the configured scheme
+    the first time they are found. Keys recently verified are kept in memory with their refresh token,
+    by hash so the key values are never kept.
+
+    The verified keys are per process: removing a key only forgets it in the process handling the removal,
+    the other processes keep accepting it until their entry expires, at most `verified_ttl` seconds.
+
+    Attributes:
+        salt: Secret salt of the application.
+        scheme: Scheme used to hash the keys, one of `HASH_SCHEMES`.
+        verified: `TTLCache` of verified keys, key hash -> refresh token.
+    """
+
+    def __init__(self, salt, scheme='hmac-sha256', verified_ttl=10):
+        if scheme not in HASH_SCHEMES:
+            raise ValueError('Unknown API Key hash scheme {0}.'.format(scheme))
+        self.salt = salt
+        self.scheme = scheme
+        self.verified = TTLCache(verified_ttl)
+
+    def hash(self, key):
+        """Hash a key with the configured scheme.
+
+        Args:
+            key: API Key value.
+        Returns:
+            Hash of the key.
+        """
+        return hash_api_key(key, self.salt, self.scheme)
+
+    def find(self, key):
+        """Find the APIKey of a key value, migrating a legacy hash to the configured scheme.
+
+        Args:
+            key: API Key value.
+        Returns:
+            APIKey object if it exists, None otherwise.
+        """
+        api_key = APIKey.get(self.hash(key))
+        if api_key is not None or self.scheme == LEGACY_SCHEME:
+            return api_key
+
+        legacy_key = APIKey.get(hash_api_key(key, self.salt, LEGACY_SCHEME))
+        if legacy_key is None:
+            return None
+        return self.rehash(legacy_key, self.hash(key))
+
+    def rehash(self, legacy_key, key_hash):
+        """Move an APIKey and its scopes to a new hash.
+
+        The refresh token of the old hash is dropped, the client must login again. If another request migrated
+        the same key concurrently, its APIKey is returned.
+
+        Args:
+            legacy_key: APIKey object to migrate.
+            key_hash: New hash of the key.
+        Returns:
+            The new APIKey object.
+        """
+        legacy_hash = legacy_key.key_hash
+        api_key = APIKey(key_hash, legacy_key.description)
+        try:
+            db.session.add(api_key)
+            db.session.flush()
+            db.session.query(APIKeyScope)\
+                      .filter(APIKeyScope.key_hash == legacy_hash)\
+                      .update({APIKeyScope.key_hash: key_hash}, synchronize_session=False)
+            db.session.delete(legacy_key)
+            db.session.commit()
+        except IntegrityError:
+            # Concurrent first logins with the same key, the other one migrated it
+            db.session.rollback()
+            return db.session.query(APIKey).filter(APIKey.key_hash == key_hash).one()
+        logging.info('APIKey {0} rehashed with {1}.'.format(legacy_hash, self.scheme))
+        return api_key
+
+    def get_verified(self, key_hash):
+        """Get the refresh token of a recently verified key.
+
+        Args:
+            key_hash: Hash of the key with the configured scheme.
+        Returns:
+            Refresh token, None if the key was not verified recently.
+        """
+        return self.verified.get(key_hash)
+
+    def set_verified(self, key_hash, refresh_token):
+        """Remember a verified key and the refresh token delivered for it.
+
+        Args:
+            key_hash: Hash of the key with the configured scheme.
+            refresh_token: Refresh token delivered to the key.
+        """
+        self.verified.set(key_hash, refresh_token)
+
+    def invalidate(self, key_hash):
+        """Forget a verified key in this process, when it is removed.
+
+        Args:
+            key_hash: Hash of the key.
+        """
+        self.verified.invalidate(key_hash)
+
+
+def get_api_key_hasher(app):
+    """Get the APIKey hasher of the Flask app, created on first use.
+
+    Args:
+        app: Flask app to access config where the API_KEY_SALT is stored.
+    Returns:
+        `APIKeyHasher` of the app.
+    """
+    hasher = app.extensions.get('api_key_hasher', None)
+    if hasher is None:
+        hasher = APIKeyHasher(app.config['API_KEY_SALT'],
+                              app.config.get('API_KEY_HASH_SCHEME', 'hmac-sha256'),
+                              app.config.get('API_KEY_VERIFIED_TTL', 10))
+        app.extensions['api_key_hasher'] = hasher
+    return hasher
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache:
+    """Bounded in-process cache where entries expire after a fixed time to live.
+
+    Each process of the server has its own entries, so the time to live bounds how long a change
+    made by another process stays unseen.
+
+    Attributes:
+        ttl: Seconds an entry stays valid after being set.
+        size: Maximum number of entries, the least recently used are dropped first.
+    """
+
+    def __init__(self, ttl, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get a valid entry.
+
+        Args:
+            key: Key of the entry.
+            default: Value returned if there is no valid entry.
+        Returns:
+            Value of the entry, default if missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return default
+            expiration, value = entry
+            if expiration <= time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Set an entry, valid for the time to live of the cache.
+
+        Args:
+            key: Key of the entry.
+            value: Value of the entry.
+            ttl: Seconds the entry stays valid, None for the time to live of the cache.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove an entry if present.
+
+        Args:
+            key: Key of the entry.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.entries.clear()
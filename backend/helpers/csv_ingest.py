@@ -0,0 +1,210 @@
+import csv
+from io import StringIO
+
+from sqlalchemy import func
+
+from models import db, CSVData, CSVRow
+
+
+class CSVIngestError(Exception):
+    """CSV rejected by the ingestion.
+
+    Attributes:
+        error: API error code of the rejection.
+    """
+
+    def __init__(self, error, message):
+        Exception.__init__(self, message)
+        self.error = error
+
+
+def text_lines(stream, encoding='utf-8'):
+    """Decode the lines of a binary stream lazily, without a leading byte order mark.
+
+    Args:
+        stream: Binary file-like object, like an upload or the request body.
+        encoding: Encoding of the stream.
+    Returns:
+        Generator of text lines.
+    """
+    first = True
+    for line in stream:
+        line = line.decode(encoding)
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+
+def ingest_csv(key, lines, key_column=None, chunk_size=500):
+    """Parse a CSV and replace the rows of a key, in one transaction.
+
+    Rows are validated and inserted by chunks while the lines are read, the whole CSV is never in memory.
+    Nothing is changed if the CSV is rejected.
+
+    Args:
+        key: CSV key to replace.
+        lines: Iterable of text lines of the CSV, header first.
+        key_column: Column identifying the rows, the first one if None.
+        chunk_size: Number of rows inserted at once.
+    Returns:
+        Tuple (number of rows stored, new version of the CSV).
+    Raises:
+        CSVIngestError: ValueCSVInvalid if the CSV can't be parsed or its rows have different lengths,
+            KeyColumnInvalid if the key column is not in the header, ValueRowKeyDuplicate if two rows have the
+            same key.
+    """
+    reader = csv.reader(lines, delimiter=',')
+    try:
+        header = next(reader, None)
+        if header is None or len(header) == 0:
+            raise CSVIngestError('ValueCSVInvalid', 'CSV has no header.')
+        if key_column is None:
+            key_column = header[0]
+        if key_column not in header:
+            raise CSVIngestError('KeyColumnInvalid', 'Column {0} is not in the header.'.format(key_column))
+        key_index = header.index(key_column)
+
+        csv_data = db.session.query(CSVData).filter(CSVData.key==key).with_for_update().one_or_none()
+        if csv_data is None:
+            csv_data = CSVData(key)
+            db.session.add(csv_data)
+        csv_data.header = header
+        csv_data.key_column = key_column
+        csv_data.version += 1
+        db.session.query(CSVRow).filter(CSVRow.key==key).delete(synchronize_session=False)
+        db.session.flush()
+
+        row_keys = set()
+        chunk = []
+        position = 0
+        for row in reader:
+            if len(row) == 0:
+                continue
+            if len(row) != len(header):
+                raise CSVIngestError('ValueCSVInvalid', 'Line {0} has {1} columns instead of {2}.'.format(
+                    reader.line_num, len(row), len(header)))
+            row_key = row[key_index] if len(row[key_index]) > 0 else '#{0}'.format(position)
+            if row_key in row_keys:
+                raise CSVIngestError('ValueRowKeyDuplicate', 'Line {0} has a duplicate {1}: {2}.'.format(
+                    reader.line_num, key_column, row_key))
+            row_keys.add(row_key)
+            chunk.append({'key': key, 'row_key': row_key, 'position': position, 'values': row})
+            position += 1
+            if len(chunk) >= chunk_size:
+                db.session.bulk_insert_mappings(CSVRow, chunk)
+                chunk = []
+        if len(chunk) > 0:
+            db.session.bulk_insert_mappings(CSVRow, chunk)
+        version = csv_data.version
+        db.session.commit()
+    except (csv.Error, UnicodeDecodeError) as e:
+        db.session.rollback()
+        raise CSVIngestError('ValueCSVInvalid', str(e))
+    except Exception:
+        db.session.rollback()
+        raise
+    return position, version
+
+
+def patch_csv(key, upsert=None, delete=None, version=None):
+    """Upsert and delete rows of a CSV by their key, in one transaction.
+
+    Deletions are applied before the upserts. Upserted rows are identified by the value of their key column,
+    their missing columns keep their current value, or are empty for a new row appended to the CSV.
+
+    Args:
+        key: CSV key to patch.
+        upsert: List of dicts column -> value.
+        delete: List of row keys to delete, unknown ones are ignored.
+        version: Version the patch is based on, None to patch whatever the current version.
+    Returns:
+        Tuple (new version of the CSV, list of upserted row keys, list of deleted row keys).
+    Raises:
+        CSVIngestError: KeyDataDoesntExist if there is no CSV for the key, VersionConflict if the CSV changed
+            since the version, RowInvalid if an upserted row has unknown columns or values that are not strings
+            or numbers, RowKeyInvalid if an upserted row has no value in the key column or a deleted key is not a
+            string.
+    """
+    upsert = upsert or []
+    delete = delete or []
+    try:
+        csv_data = db.session.query(CSVData).filter(CSVData.key==key).with_for_update().one_or_none()
+        if csv_data is None:
+            raise CSVIngestError('KeyDataDoesntExist', 'There is no CSV for {0}.'.format(key))
+        if version is not None and version != csv_data.version:
+            raise CSVIngestError('VersionConflict', 'CSV {0} is at version {1}, not {2}.'.format(
+                key, csv_data.version, version))
+
+        index = {column: i for i, column in enumerate(csv_data.header)}
+        for row_key in delete:
+            if not isinstance(row_key, str):
+                raise CSVIngestError('RowKeyInvalid', 'Deleted row key {0} is not a string.'.format(row_key))
+        for values in upsert:
+            if not isinstance(values, dict) or any(column not in index for column in values) or \
+                    any(not isinstance(value, (str, int, float)) or isinstance(value, bool)
+                        for value in values.values()):
+                raise CSVIngestError('RowInvalid', 'Row {0} is not valid.'.format(values))
+            row_key = values.get(csv_data.key_column, None)
+            if row_key is None or len(str(row_key)) == 0:
+                raise CSVIngestError('RowKeyInvalid', 'Row {0} has no {1}.'.format(values, csv_data.key_column))
+
+        row_keys = set(delete) | set(str(values[csv_data.key_column]) for values in upsert)
+        rows = {row.row_key: row for row in db.session.query(CSVRow).filter(CSVRow.key==key,
+                                                                            CSVRow.row_key.in_(list(row_keys)))}
+        deleted = []
+        for row_key in delete:
+            row = rows.pop(row_key, None)
+            if row is not None:
+                db.session.delete(row)
+                deleted.append(row_key)
+        db.session.flush()
+
+        upserted = []
+        position = None
+        for values in upsert:
+            row_key = str(values[csv_data.key_column])
+            row = rows.get(row_key, None)
+            if row is None:
+                if position is None:
+                    position = db.session.query(func.max(CSVRow.position)).filter(CSVRow.key==key).scalar()
+                    position = -1 if position is None else position
+                position += 1
+                row = CSVRow(key, row_key, position, [''] * len(csv_data.header))
+                db.session.add(row)
+                rows[row_key] = row
+            row_values = list(row.values)
+            for column, value in values.items():
+                row_values[index[column]] = str(value)
+            # Assigned again, in place changes of JSON values are not detected
+            row.values = row_values
+            if row_key not in upserted:
+                upserted.append(row_key)
+
+        csv_data.version += 1
+        version = csv_data.version
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return version, upserted, deleted
+
+
+def export_csv(key):
+    """Write the rows of a key back to a CSV.
+
+    Args:
+        key: CSV key to export.
+    Returns:
+        Tuple (CSV string, version of the CSV), None if there is no CSV for the key.
+    """
+    csv_data = db.session.query(CSVData).filter(CSVData.key==key).one_or_none()
+    if csv_data is None:
+        return None
+
+    output = StringIO()
+    writer = csv.writer(output, delimiter=',', lineterminator='\n')
+    writer.writerow(csv_data.header)
+    for values, in db.session.query(CSVRow.values).filter(CSVRow.key==key).order_by(CSVRow.position):
+        writer.writerow(values)
+    return output.getvalue(), csv_data.version
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from models import db, DynamicConfiguration, DYNAMIC_CONFIGURATION_VERSION
+
+
+class DynamicConfigStore:
+    """Dynamic configuration kept in memory, loaded once per process with a single query.
+
+    Writes go through the database and the memory of the writing process. Each write increments the
+    dynamic configuration version in the same transaction, the other processes reload all the keys when
+    they see a new version. The version is checked at most every `check_interval` seconds, or on the next
+    access after `invalidate`, called when the database notifies a change.
+
+    Attributes:
+        values: Dict key -> string value.
+        version: Dynamic configuration version of the values, None if not loaded.
+        check_interval: Minimum seconds between two checks of the version.
+    """
+
+    def __init__(self, check_interval=1):
+        self.values = {}
+        self.version = None
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Load the keys if they changed since the last load. Needs an application context."""
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return self
+            self.checked_at = now
+            if self.version is not None and \
+                    DynamicConfiguration.get(DYNAMIC_CONFIGURATION_VERSION, '0') == self.version:
+                return self
+
+            self.values = {dc.key: dc.value for dc in db.session.query(DynamicConfiguration)}
+            self.version = self.values.get(DYNAMIC_CONFIGURATION_VERSION, '0')
+            return self
+
+    def invalidate(self):
+        """Check the version on the next access."""
+        with self.lock:
+            self.checked_at = None
+
+    def get(self, key, default=None):
+        """Get the string value of a key, default if not present."""
+        return self.values.get(key, default)
+
+    def get_bool(self, key, default=False):
+        """Get a boolean key, stored as 'True' or 'False'."""
+        value = self.values.get(key, None)
+        if value is None:
+            return default
+        return value == 'True'
+
+    def get_int(self, key, default=0):
+        """Get an integer key, default if not present or invalid."""
+        try:
+            return int(self.values[key])
+        except (KeyError, ValueError):
+            return default
+
+    def set(self, key, value):
+        """Write a key to the database and commit. Needs an application context.
+
+        Args:
+            key: Key of the configuration.
+            value: New value, booleans are stored as 'True' or 'False' and other values as strings.
+        Returns:
+            The stored string value.
+        """
+        value = str(value)
+        dc = db.session().query(DynamicConfiguration).filter(DynamicConfiguration.key==key).one_or_none()
+        if dc is None:
+            dc = DynamicConfiguration(key, value)
+            db.session().add(dc)
+        dc.value = value
+        version = DynamicConfiguration.increment(DYNAMIC_CONFIGURATION_VERSION)
+        db.session().commit()
+
+        with self.lock:
+            self.values[key] = value
+            # Changes of the other processes in between are loaded with the next check.
+            if self.version is not None and int(self.version) + 1 == version:
+                self.version = str(version)
+                self.values[DYNAMIC_CONFIGURATION_VERSION] = self.version
+            else:
+                self.checked_at = None
+        return value
+
+
+dynamic_config = DynamicConfigStore()
+
+
+def get_dynamic_config():
+    """Get the up to date dynamic configuration of the process. Needs an application context."""
+    return dynamic_config.refresh()
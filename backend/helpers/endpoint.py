@@ -1,15 +1,62 @@
 from functools import wraps
 import jwt
 import logging
+import time
 
 from flask import request, jsonify
 
+from helpers.cache import TTLCache
+
+
+class AuthTokenCache(TTLCache):
+    """`TTLCache` of the auth tokens already verified by the process.
+
+    Entries are keyed by the raw token, and hold the decoded claims with the scopes as a frozenset.
+    An entry expires with its token, an expired token is then decoded again and rejected.
+    """
+
+    def __init__(self, size, ttl=15 * 60):
+        TTLCache.__init__(self, ttl, size)
+
+    def add(self, raw_token, claims):
+        """Add verified claims of a token to the cache.
+
+        Args:
+            raw_token: Token string from the Authorization header.
+            claims: Decoded claims of the token.
+        Returns:
+            Tuple (claims, scopes) as they are cached.
+        """
+        scopes = frozenset(claims['client'].get('scopes', []))
+        ttl = self.ttl
+        if claims.get('exp', None) is not None:
+            ttl = min(ttl, claims['exp'] - time.time())
+        self.set(raw_token, (claims, scopes), ttl)
+        return claims, scopes
+
+
+def get_auth_token_cache(app):
+    """Get the auth token cache of the Flask app, created on first use.
+
+    Args:
+        app: Flask app to access config where the AUTH_TOKEN_CACHE_SIZE is stored.
+    Returns:
+        `AuthTokenCache` of the app.
+    """
+    cache = app.extensions.get('auth_token_cache', None)
+    if cache is None:
+        cache = AuthTokenCache(app.config.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+        app.extensions['auth_token_cache'] = cache
+    return cache
+
+
 def secure(app, type, scopes):
     """Decorator to turn a endpoint into a secure endpoint where a AuthToken is necessary, and scopes too.
 
     May raise AuthorizationHeaderInvalid, AuthTokenExpired, AuthTokenInvalid, ClientAccessImpossible,
     or ClientAccessRefused instead of calling the decorated function.
     Decorated function will be called with the auth token as a first argument.
+    Verified tokens are kept in the `AuthTokenCache` of the app until they expire.
 
     Args:
         app: Flask app to access config where the API_KEY is stored.
@@ -18,6 +65,9 @@ def secure(app, type, scopes):
     Returns:
         Decorated function.
     """
+    accepted_types = frozenset(type)
+    required_scopes = frozenset(scopes)
+
     def secured(f):
         @wraps(f)
         def wrap(*args, **kwargs):
@@ -31,10 +81,14 @@ def secure(app, type, scopes):
                                 'payload': {}
                                 }), 200
             raw_token = header_token[7:]
+            cache = get_auth_token_cache(app)
             try:
-                auth_token = jwt.decode(raw_token,
-                                        app.config['SECRET_KEY'],
-                                        audience='auth')
+                cached = cache.get(raw_token)
+                if cached is None:
+                    cached = cache.add(raw_token, jwt.decode(raw_token,
+                                                             app.config['SECRET_KEY'],
+                                                             audience='auth'))
+                auth_token, token_scopes = cached
             except jwt.ExpiredSignatureError:
                 return jsonify({'success': 'no',
                                 'error': 'AuthTokenExpired',
@@ -46,17 +100,16 @@ def secure(app, type, scopes):
                                 'error': 'AuthTokenInvalid',
                                 'payload': {}
                                 }), 401
-            if auth_token['client']['type'] not in type:
+            if auth_token['client']['type'] not in accepted_types:
                 return jsonify({'success': 'no',
                                 'error': 'ClientAccessImpossible',
                                 'payload': {}
                                 }), 200
-            for scope in scopes:
-                if scope not in auth_token['client']['scopes']:
-                    return jsonify({'success': 'no',
-                                    'error': 'ClientAccessRefused',
-                                    'payload': {}
-                                    }), 200
+            if not required_scopes <= token_scopes:
+                return jsonify({'success': 'no',
+                                'error': 'ClientAccessRefused',
+                                'payload': {}
+                                }), 200
 
             return f(auth_token, *args, **kwargs)
 
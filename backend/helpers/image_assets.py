@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+from PIL import Image, ImageFont
+
+RESSOURCES_PATH = os.path.join(os.path.dirname(__file__), '..', 'ressources')
+
+
+class AssetCache:
+    """Process wide cache of the decoded images, resized images and fonts used to generate images.
+
+    Images are decoded once in RGBA and shared by all the generations, they must never be modified:
+    copy them before drawing on them. Memory is bounded, the least recently used images are dropped first.
+
+    Attributes:
+        max_bytes: Maximum memory used by the decoded and resized images.
+        max_fonts: Maximum number of (font file, size) kept loaded.
+        hits: Number of cache hits, per kind of asset.
+        misses: Number of cache misses, per kind of asset.
+    """
+
+    def __init__(self, max_bytes, max_fonts=64):
+        self.max_bytes = max_bytes
+        self.max_fonts = max_fonts
+        self.images = OrderedDict()
+        self.fonts = OrderedDict()
+        self.keys = {}
+        self.size = 0
+        self.hits = {'image': 0, 'resized': 0, 'font': 0}
+        self.misses = {'image': 0, 'resized': 0, 'font': 0}
+        self.lock = threading.RLock()
+
+    def image(self, parts):
+        """Get a decoded RGBA image of the ressources.
+
+        Args:
+            parts: Tuple of the path components of the image, relative to the ressources directory.
+        Returns:
+            Shared RGBA `Image`, must not be modified.
+        """
+        key = ('image', tuple(parts))
+        with self.lock:
+            image = self._get(key)
+            if image is not None:
+                return image
+            image = Image.open(os.path.join(RESSOURCES_PATH, *parts)).convert('RGBA')
+            self._add(key, image)
+            return image
+
+    def resize(self, image, size, resample=Image.LANCZOS):
+        """Resize an image, caching the result if the image comes from the cache.
+
+        Args:
+            image: `Image` to resize.
+            size: Target [width, height].
+            resample: PIL resampling filter.
+        Returns:
+            Resized `Image`, shared and must not be modified if the source is a cached image.
+        """
+        size = (int(size[0]), int(size[1]))
+        with self.lock:
+            source_key = self.keys.get(id(image), None)
+            if source_key is None or self.images.get(source_key, None) is not image:
+                return image.resize(size, resample)
+            key = ('resized', source_key[1], size, resample)
+            resized = self._get(key)
+            if resized is not None:
+                return resized
+            resized = image.resize(size, resample)
+            self._add(key, resized)
+            return resized
+
+    def font(self, parts, size):
+        """Get a loaded font of the ressources.
+
+        Args:
+            parts: Tuple of the path components of the font file, relative to the ressources directory.
+            size: Font size.
+        Returns:
+            Shared `FreeTypeFont`.
+        """
+        key = (tuple(parts), size)
+        with self.lock:
+            font = self.fonts.get(key, None)
+            if font is not None:
+                self.fonts.move_to_end(key)
+                self.hits['font'] += 1
+                return font
+            self.misses['font'] += 1
+            font = ImageFont.truetype(os.path.join(RESSOURCES_PATH, *parts), size)
+            self.fonts[key] = font
+            while len(self.fonts) > self.max_fonts:
+                self.fonts.popitem(last=False)
+            return font
+
+    def warm_up(self, images, fonts):
+        """Load assets in advance, ignoring the missing ones.
+
+        Args:
+            images: List of image path components tuples.
+            fonts: List of tuples (font path components, size).
+        """
+        for parts in images:
+            try:
+                self.image(parts)
+            except (IOError, OSError) as e:
+                logging.warning('Impossible to warm up image {0}: {1}'.format(parts, e))
+        for parts, size in fonts:
+            try:
+                self.font(parts, size)
+            except (IOError, OSError) as e:
+                logging.warning('Impossible to warm up font {0}: {1}'.format(parts, e))
+
+    def stats(self):
+        """Get the usage of the cache.
+
+        Returns:
+            Dict with the hits and misses per kind, the number of entries and the memory used.
+        """
+        with self.lock:
+            return {'hits': dict(self.hits),
+                    'misses': dict(self.misses),
+                    'images': len(self.images),
+                    'fonts': len(self.fonts),
+                    'bytes': self.size}
+
+    def _get(self, key):
+        image = self.images.get(key, None)
+        if image is None:
+            self.misses[key[0]] += 1
+            return None
+        self.images.move_to_end(key)
+        self.hits[key[0]] += 1
+        return image
+
+    def _add(self, key, image):
+        self.images[key] = image
+        self.keys[id(image)] = key
+        self.size += self._bytes(image)
+        while self.size > self.max_bytes and len(self.images) > 1:
+            _, dropped = self.images.popitem(last=False)
+            self.keys.pop(id(dropped), None)
+            self.size -= self._bytes(dropped)
+
+    @staticmethod
+    def _bytes(image):
+        return image.size[0] * image.size[1] * len(image.getbands())
+
+
+asset_cache = AssetCache(256 * 1024 * 1024)
@@ -0,0 +1,91 @@
+from PIL import Image
+
+
+def masked_layer(sprite, alpha=None):
+    """Build the layer of a sprite as it is blended on a composition.
+
+    The sprite is pasted on a transparent layer with itself as a mask, and optionally faded.
+
+    Args:
+        sprite: RGBA `Image` to blend.
+        alpha: Optional opacity between 0 and 1 applied to the whole sprite.
+    Returns:
+        RGBA `Image` of the sprite size.
+    """
+    layer = Image.new('RGBA', sprite.size)
+    layer.paste(sprite, box=(0, 0), mask=sprite)
+    if alpha is not None:
+        layer = Image.blend(Image.new('RGBA', sprite.size), layer, alpha)
+    return layer
+
+
+def alpha_composite_at(composition, layer, position):
+    """Blend a layer into a composition, in place and only inside the layer bounding box.
+
+    Parts of the layer outside the composition are clipped.
+
+    Args:
+        composition: RGBA `Image` to draw on.
+        layer: RGBA `Image` to blend.
+        position: [x, y] of the top left corner of the layer inside the composition.
+    Returns:
+        The composition.
+    """
+    left = max(0, -position[0])
+    top = max(0, -position[1])
+    right = min(layer.size[0], composition.size[0] - position[0])
+    bottom = min(layer.size[1], composition.size[1] - position[1])
+    if right <= left or bottom <= top:
+        return composition
+    composition.alpha_composite(layer,
+                                dest=(position[0] + left, position[1] + top),
+                                source=(left, top, right, bottom))
+    return composition
+
+
+class Compositor:
+    """Collect sprites to blend on a composition, and blend them in a single pass.
+
+    Each sprite is blended only inside its own bounding box, in the order they were added.
+
+    Attributes:
+        composition: RGBA `Image` to draw on.
+        layers: List of (layer, position) waiting for the render.
+    """
+
+    def __init__(self, composition):
+        self.composition = composition
+        self.layers = []
+
+    def add(self, sprite, position, alpha=None):
+        """Add a sprite to blend.
+
+        Args:
+            sprite: RGBA `Image` to blend.
+            position: [x, y] of the top left corner of the sprite.
+            alpha: Optional opacity between 0 and 1 applied to the whole sprite.
+        """
+        self.layers.append((masked_layer(sprite, alpha), position))
+
+    def add_centered(self, sprite, position, alpha=None):
+        """Add a sprite to blend, centered on a position.
+
+        Args:
+            sprite: RGBA `Image` to blend.
+            position: [x, y] of the center of the sprite.
+            alpha: Optional opacity between 0 and 1 applied to the whole sprite.
+        """
+        self.add(sprite,
+                 [position[0] - int(sprite.size[0] / 2), position[1] - int(sprite.size[1] / 2)],
+                 alpha)
+
+    def render(self):
+        """Blend all the collected sprites on the composition.
+
+        Returns:
+            The composition.
+        """
+        for layer, position in self.layers:
+            alpha_composite_at(self.composition, layer, position)
+        self.layers = []
+        return self.composition
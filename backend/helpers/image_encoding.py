@@ -0,0 +1,71 @@
+import os
+
+# Output presets of the generated images. The published file is always a PNG, used by OBS and the stat scene.
+# WebP presets also publish a WebP variant next to it, served to the clients accepting it.
+ENCODINGS = {
+    'png': {'format': 'PNG', 'params': {}},
+    'png-optimized': {'format': 'PNG', 'params': {'optimize': True}},
+    'png-palette': {'format': 'PNG', 'params': {'optimize': True}, 'palette': True},
+    'png-fast': {'format': 'PNG', 'params': {'compress_level': 1}},
+    'webp': {'format': 'WEBP', 'params': {'quality': 90, 'method': 4}},
+    'webp-lossless': {'format': 'WEBP', 'params': {'lossless': True, 'quality': 20, 'method': 1}},
+}
+DEFAULT_ENCODING = 'png'
+EXTENSIONS = {'PNG': '.png', 'WEBP': '.webp'}
+MIMETYPES = {'.png': 'image/png', '.webp': 'image/webp'}
+
+
+def is_encoding(name):
+    return isinstance(name, str) and name in ENCODINGS
+
+
+def save_image(image, path, format='PNG', **params):
+    """Save an image atomically, readers never see a partially written file.
+
+    Args:
+        image: `Image` to save.
+        path: Destination of the image.
+        format: PIL format of the file.
+        params: Extra PIL save parameters.
+    """
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        image.save(temp_path, format=format, **params)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def encode_images(image, path, encoding=DEFAULT_ENCODING):
+    """Save atomically the files of an image with an encoding, see `encoded_paths`."""
+    for encoded_path, preset in encoded_paths(path, encoding):
+        encode_image(image, encoded_path, preset)
+
+
+def encoded_paths(path, encoding):
+    """Files written for an image with an encoding.
+
+    Args:
+        path: Path of the PNG image.
+        encoding: Name of the preset, one of `ENCODINGS`.
+    Returns:
+        List of tuples (path, preset name) to write, the PNG first.
+    """
+    if ENCODINGS[encoding]['format'] == 'PNG':
+        return [(path, encoding)]
+    return [(path, 'png-fast'), (os.path.splitext(path)[0] + EXTENSIONS[ENCODINGS[encoding]['format']], encoding)]
+
+
+def encode_image(image, path, encoding=DEFAULT_ENCODING):
+    """Save an image atomically with a preset.
+
+    Args:
+        image: RGBA `Image` to save.
+        path: Destination of the image.
+        encoding: Name of the preset, one of `ENCODINGS`.
+    """
+    preset = ENCODINGS[encoding]
+    if preset.get('palette', False):
+        image = image.convert('RGB').quantize(colors=256)
+    save_image(image, path, format=preset['format'], **preset['params'])
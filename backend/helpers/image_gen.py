@@ -1,16 +1,19 @@
-from itertools import chain
 import logging
 import math
-import requests
-import json
-import csv
 import os
-from io import StringIO
 from sqlalchemy import desc
 
-from PIL import Image, ImageDraw, ImageColor, ImageFont
+from PIL import Image, ImageDraw, ImageColor
 
-from models import db, CSVData, DotaHero, DotaItem, DotaProPlayer, DotaProTeam, DotaStatTounamentHero, DotaStatTounamentTeamHero, DotaStatTournament, DotaStatTounamentTeam
+from helpers.image_assets import asset_cache
+from helpers.image_compositing import Compositor, alpha_composite_at, masked_layer
+from helpers.image_encoding import is_encoding
+from helpers.image_graph import AdvantageGraph
+from helpers.render_cache import RenderCache
+from helpers.image_templates import TemplateEngine
+from helpers.match_store import get_match_store
+from helpers.reference_data import get_reference_data
+from models import db, CSVData, DotaStatTounamentHero, DotaStatTounamentTeamHero, DotaStatTournament, DotaStatTounamentTeam
 
 class ImageGenerator:
     """Class helper to generate stats images.
@@ -18,6 +21,10 @@ class ImageGenerator:
     Attributes:
         app: Flask application.
         colors: Colors used in multiple points of the application.
+        templates: `TemplateEngine` of the declarative images.
+        render_cache: `RenderCache` of the generated images.
+        generators: Dict key -> function generating the images of a key from a payload.
+        bulk_generators: Dict key -> (payload field, function preparing the template data of many images).
     """
     app = None
     colors = {
@@ -47,223 +54,237 @@ class ImageGenerator:
 
     def __init__(self, app):
         self.app = app
+        asset_cache.max_bytes = app.config.get('IMG_ASSET_CACHE_BYTES', asset_cache.max_bytes)
+        self.templates = TemplateEngine(self.colors)
+        self.render_cache = RenderCache(app.config.get('IMG_RENDER_CACHE_PATH', None) or
+                                        os.path.join(app.config['IMG_GENERATE_PATH'], 'render_cache'),
+                                        app.config.get('IMG_RENDER_VERSION', ''),
+                                        app.config.get('IMG_RENDER_CACHE_SIZE', 2048))
+        self.generators = {
+            'preti8_teams': lambda payload: self.generate_csv_preti8_teams(payload['team_id'],
+                                                                           payload.get('encoding', None)),
+            'preti8_players': lambda payload: self.generate_csv_preti8_players(payload['player_id'],
+                                                                               payload.get('encoding', None)),
+            'ti8_groups': lambda payload: self.generate_csv_ti8_groups(payload.get('encoding', None)),
+            'post_game': lambda payload: self.generate_post_game(payload['match_id'], payload.get('encoding', None)),
+            'tournament_global': lambda payload: self.generate_tournament_global(payload['tournament_id'],
+                                                                                 payload.get('encoding', None)),
+            'team_faceoff': lambda payload: self.generate_team_faceoff(payload['tournament_id'],
+                                                                       payload['team_id'],
+                                                                       payload['team_id_2'],
+                                                                       payload.get('encoding', None)),
+        }
+        self.bulk_generators = {
+            'preti8_teams': ('team_id', self.prepare_csv_preti8_teams),
+            'preti8_players': ('player_id', self.prepare_csv_preti8_players),
+        }
+
+    def warm_up(self):
+        """Load the assets shared by most generations, to avoid decoding them during the first ones."""
+        images = [('img', 'post_game-background.png'), ('img', 'item_rectangle', 'empty.png')]
+        for icon in ['sword', 'skull', 'laurels', 'chick_kill', 'roshan_kill', 'tower_kill', 'shrine_kill', 'rax_kill']:
+            images.append(('img', 'icon', icon + '.png'))
+        fonts = []
+        for font, size in [('fort_foundry_rift_bold.otf', 32), ('fort_foundry_rift_bold.otf', 50),
+                           ('fort_foundry_rift_bold.otf', 72), ('fort_foundry_rift_regular.otf', 26),
+                           ('fort_foundry_rift_regular.otf', 32), ('fort_foundry_rift_regular.otf', 72),
+                           ('fort_foundry_rift_bold_italic.otf', 46)]:
+            fonts.append((('fonts', 'rift', font), size))
+        asset_cache.warm_up(images, fonts)
+        logging.info('Image assets warmed up: {0}'.format(asset_cache.stats()))
 
     def generate_image(self, key, payload):
         """Generate images of a target CSV key.
 
+        Keys without a dedicated generator are rendered from their template, if it declares its `fields`. Only
+        these fields of the payload are bound in the template.
+
         Args:
             key: CSV key to generate.
             payload: Payload information for image generation
         """
-        if key == "preti8_teams":
-            return self.generate_csv_preti8_teams(payload['team_id'])
-        elif key == "preti8_players":
-            return self.generate_csv_preti8_players(payload['player_id'])
-        elif key == "ti8_groups":
-            return self.generate_csv_ti8_groups()
-        elif key == "post_game":
-            return self.generate_post_game(payload['match_id'])
-        elif key == "tournament_global":
-            return self.generate_tournament_global(payload['tournament_id'])
-        elif key == "team_faceoff":
-            return self.generate_team_faceoff(payload['tournament_id'], payload['team_id'], payload['team_id_2'])
-
-    def generate_csv_preti8_teams(self, team_id = None):
-        csv_data = db.session.query(CSVData).filter(CSVData.key=='preti8_teams').one_or_none()
-        if csv_data is None: return;
-
-        csv_reader = csv.reader(StringIO(csv_data.value), delimiter=',')
-        header = next(csv_reader)
-        header = {k: v for v, k in enumerate(header)}
-        for row in csv_reader:
-            if team_id is not None and team_id != row[header['teamid']]:
-                continue
+        generator = self.generators.get(key, None)
+        if generator is not None:
+            return generator(payload)
+        if not self.templates.has(key):
+            return None
+        plan = self.templates.get(key)
+        if plan.fields is None:
+            return None
+        data = {field: payload[field] for field in plan.fields if field in payload}
+        data['encoding'] = payload.get('encoding', None)
+        return self.generate_template(key, data)
 
-            # Delete previous image
-            image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'preti8_teams-' + row[header['teamid']] + '.png')
-            if os.path.isfile(image_path): os.remove(image_path)
-
-            # Generate image
-            composition = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'preti8_teams-background.png')).convert('RGBA')
-
-            logo_array = {
-                '5': { 'position': [400, 650], 'size': [None, 700], 'suffix': ''},
-                '15': { 'position': [300, 650], 'size': [None, 700], 'suffix': '' },
-                '39': { 'position': [400, 650], 'size': [None, 600], 'suffix': '' },
-                '67': { 'position': [400, 650], 'size': [None, 600], 'suffix': '' },
-                '2163': { 'position': [400, 650], 'size': [None, 600], 'suffix': '' },
-                '350190': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '543897': { 'position': [400, 700], 'size': [None, 700], 'suffix': '' },
-                '726228': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '1375614': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '1838315': { 'position': [400, 650], 'size': [None, 500], 'suffix': '' },
-                '1883502': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '2108395': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '2586976': { 'position': [350, 650], 'size': [None, 700], 'suffix': '' },
-                '5026801': { 'position': [375, 630], 'size': [None, 700], 'suffix': '-white' },
-                '5027210': { 'position': [400, 700], 'size': [None, 700], 'suffix': '-white' },
-                '5066616': { 'position': [400, 700], 'size': [None, 500], 'suffix': '' },
-                '5228654': { 'position': [350, 650], 'size': [None, 700], 'suffix': '-white' },
-                '5229127': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-            }
-            composition = self.draw_team_logo(composition,
-                                              row[header['teamid']] + logo_array[row[header['teamid']]]['suffix'],
-                                              logo_array[row[header['teamid']]]['position'],
-                                              logo_array[row[header['teamid']]]['size'],
-                                              0.7)
-            image_draw = ImageDraw.Draw(composition)
+    def get_encoding(self, key, encoding=None, default=None):
+        """Choose the output preset of an image.
+
+        Args:
+            key: Key of the image.
+            encoding: Preset asked by the payload, used if valid.
+            default: Preset of the template of the image.
+        Returns:
+            Name of the preset, see `helpers.image_encoding`.
+        """
+        if is_encoding(encoding):
+            return encoding
+        if default is not None:
+            return default
+        return self.app.config.get('IMG_ENCODINGS', {}).get(key, self.app.config.get('IMG_ENCODING', 'png'))
+
+    def is_bulk(self, key, payload):
+        """Check if a payload asks for many images of a key, with "*" or a list of ids."""
+        if key not in self.bulk_generators:
+            return False
+        ids = payload.get(self.bulk_generators[key][0], None)
+        return ids == '*' or isinstance(ids, list)
+
+    def prepare_bulk(self, key, payload):
+        """Prepare the template data of all the images of a bulk payload, to render them in parallel.
+
+        Args:
+            key: CSV key to generate.
+            payload: Payload information for image generation, see `is_bulk`.
+        Returns:
+            List of tuples (id, template key, template data), empty if there is no data.
+        """
+        field, prepare = self.bulk_generators[key]
+        return prepare(payload.get(field, None), payload.get('encoding', None)) or []
+
+    def payload_for_rows(self, key, upserted, deleted):
+        """Payload generating only the images depending on changed rows of a CSV.
+
+        Rows of the bulk keys are keyed by the ids of their images, see CSV_KEY_COLUMNS.
 
-            rift_bold_title = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 150)
-            rift_bold_sub = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 58)
-            rift_player_nickname = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_regular_italic.otf'), 72)
-            self.draw_text_outlined(image_draw, [85, 51], row[header['team']], font=rift_bold_title, fill=self.colors['ti_green'], outline_fill=self.colors['black'], outline_width=5)
-
-            row_1_x = 800
-            row_1_y = 350
-            row_1_line = 65
-            row_1_inc = 225
-            row_2_x = row_1_x + 40
-            row_2_y = 330
-            row_2_inc = 225
-            row_3_x = 1400
-            row_4_x = row_3_x + 40
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y], 'Classement', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + row_1_line], 'DPC', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + row_1_inc], 'Points DPC', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + row_1_inc + row_1_line], 'Obtenus', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + 2*row_1_inc], 'Games', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + 2*row_1_inc + row_1_line], '4 Mois -', rift_bold_sub, self.colors['white'])
-            self.draw_text_outlined(image_draw, [row_2_x, row_2_y-5], row[header['classement_dpc']], font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-            self.draw_text_outlined(image_draw, [row_2_x, row_2_y + row_2_inc-5], row[header['total_dpc']], font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-            self.draw_text_outlined(image_draw, [row_2_x, row_2_y + 2*row_2_inc-5], row[header['nombre_games']], font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-
-            self.draw_text_left_align(image_draw, [row_3_x, row_1_y], 'Winrate', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_3_x, row_1_y + row_1_line], '4 mois -', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_3_x, row_1_y + row_1_inc], 'Gains', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_3_x, row_1_y + row_1_inc + row_1_line], 'saison -', rift_bold_sub, self.colors['white'])
-            self.draw_text_outlined(image_draw, [row_4_x, row_2_y-5], row[header['wr']] + ' %', font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-            self.draw_text_outlined(image_draw, [row_4_x, row_2_y + row_2_inc-5], '$ ' + row[header['gains']], font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-
-            players = db.session.query(DotaProPlayer).filter(DotaProPlayer.team == int(row[header['teamid']])).all()
+        Args:
+            key: CSV key of the rows.
+            upserted: Keys of the inserted or updated rows.
+            deleted: Keys of the deleted rows.
+        Returns:
+            Payload for `generate_image`, None if there is nothing to generate.
+        """
+        if key in self.bulk_generators:
+            if len(upserted) == 0:
+                return None
+            return {self.bulk_generators[key][0]: list(upserted)}
+        if key in self.generators and len(upserted) + len(deleted) > 0:
+            return {}
+        return None
+
+    def generate_template(self, key, data):
+        """Generate an image from a template.
+
+        Args:
+            key: Key of the template.
+            data: Dict of the values bound in the template.
+        Returns:
+            True once the image is saved.
+        """
+        plan = self.templates.get(key)
+        image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], plan.name(data) + '.png')
+        encoding = self.get_encoding(key, data.get('encoding', None), plan.encoding)
+        digest = self.render_cache.digest(key, [plan.version, data])
+        if self.render_cache.publish(image_path, digest, encoding):
+            return True
+
+        _, composition = plan.render(data)
+        self.render_cache.store(composition, image_path, digest, encoding)
+        return True
+
+    @staticmethod
+    def select_ids(ids):
+        """Normalize the ids of a payload.
+
+        Args:
+            ids: None or "*" for all the ids, a single id, or a list of ids.
+        Returns:
+            Set of ids as strings, None for all the ids.
+        """
+        if ids is None or ids == '*':
+            return None
+        if isinstance(ids, list):
+            return set(str(i) for i in ids)
+        return {str(ids)}
+
+    def prepare_csv_preti8_teams(self, team_id = None, encoding = None):
+        """Prepare the data of the preti8_teams images.
+
+        Args:
+            team_id: Team to generate, "*" or None for all, or a list of teams.
+            encoding: Optional output preset of the images.
+        Returns:
+            List of tuples (team id, template key, template data), None if there is no CSV.
+        """
+        rows = CSVData.rows('preti8_teams', 'teamid', self.select_ids(team_id))
+        if rows is None: return None
+
+        reference = get_reference_data()
+        tasks = []
+        for row in rows:
+            data = dict(row)
             player_string = ''
-            for i in range(0, 5):
-                player_string += '     {0}'.format(players[i].nickname)
+            for player in reference.players_of_team(row['teamid'])[0:5]:
+                player_string += '     {0}'.format(player.nickname)
             player_string += '   '
-            self.draw_text_center_align(image_draw, [960, 230], text=player_string, font=rift_player_nickname, fill=self.colors['white'])
+            data['players'] = player_string
+            data['encoding'] = encoding
+            tasks.append((row['teamid'], 'preti8_teams', data))
+        return tasks
 
-            composition.save(image_path)
-        return True
+    def prepare_csv_preti8_players(self, player_id = None, encoding = None):
+        """Prepare the data of the preti8_players images.
 
-    def generate_csv_preti8_players(self, player_id = None):
-        csv_data = db.session.query(CSVData).filter(CSVData.key == 'preti8_players').one_or_none()
-        if csv_data is None: return;
+        Args:
+            player_id: Player to generate, "*" or None for all, or a list of players.
+            encoding: Optional output preset of the images.
+        Returns:
+            List of tuples (player id, template key, template data), None if there is no CSV.
+        """
+        rows = CSVData.rows('preti8_players', 'playerid', self.select_ids(player_id))
+        if rows is None: return None
 
-        csv_reader = csv.reader(StringIO(csv_data.value), delimiter=',')
-        header = next(csv_reader)
-        header = {k: v for v, k in enumerate(header)}
-        for row in csv_reader:
-            if (len(row[header['playerid']]) == 0 or (not row[header['playerid']].isdigit()) or
-                    (player_id is not None and player_id != row[header['playerid']])):
+        tasks = []
+        for row in rows:
+            if len(row['playerid']) == 0 or (not row['playerid'].isdigit()):
                 continue
+            data = dict(row)
+            data['hero_privilegie'] = row['hero_privilegie'].replace('_', ' ')
+            data['encoding'] = encoding
+            tasks.append((row['playerid'], 'preti8_players', data))
+        return tasks
+
+    def generate_csv_preti8_teams(self, team_id = None, encoding = None):
+        tasks = self.prepare_csv_preti8_teams(team_id, encoding)
+        if tasks is None: return;
+
+        for _, template, data in tasks:
+            self.generate_template(template, data)
+        return True
 
-            # Delete previous image
-            image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'preti8_players-' + row[header['playerid']] + '.png')
-            if os.path.isfile(image_path): os.remove(image_path)
-
-            # Generate image
-            composition = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'preti8_players-background.png')).convert('RGBA')
-            logo_array = {
-                '5': { 'position': [400, 650], 'size': [None, 700], 'suffix': ''},
-                '15': { 'position': [300, 650], 'size': [None, 700], 'suffix': '' },
-                '39': { 'position': [400, 650], 'size': [None, 600], 'suffix': '' },
-                '67': { 'position': [400, 650], 'size': [None, 600], 'suffix': '' },
-                '2163': { 'position': [400, 650], 'size': [None, 600], 'suffix': '' },
-                '350190': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '543897': { 'position': [400, 700], 'size': [None, 700], 'suffix': '' },
-                '726228': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '1375614': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '1838315': { 'position': [400, 650], 'size': [None, 500], 'suffix': '' },
-                '1883502': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '2108395': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-                '2586976': { 'position': [350, 650], 'size': [None, 700], 'suffix': '' },
-                '5026801': { 'position': [375, 630], 'size': [None, 700], 'suffix': '-white' },
-                '5027210': { 'position': [400, 700], 'size': [None, 700], 'suffix': '-white' },
-                '5066616': { 'position': [400, 700], 'size': [None, 500], 'suffix': '' },
-                '5228654': { 'position': [350, 650], 'size': [None, 700], 'suffix': '-white' },
-                '5229127': { 'position': [400, 650], 'size': [None, 700], 'suffix': '' },
-            }
-            composition = self.draw_team_logo(composition,
-                                              row[header['teamid']] + logo_array[row[header['teamid']]]['suffix'],
-                                              logo_array[row[header['teamid']]]['position'],
-                                              logo_array[row[header['teamid']]]['size'],
-                                              0.7)
-            composition = self.draw_player_portrait(composition, row[header['playerid']], position=[400, 780], size=[None, 600])
-            image_draw = ImageDraw.Draw(composition)
+    def generate_csv_preti8_players(self, player_id = None, encoding = None):
+        tasks = self.prepare_csv_preti8_players(player_id, encoding)
+        if tasks is None: return;
 
-            rift_bold_title = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 150)
-            rift_bold_sub = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 58)
-
-            self.draw_text_outlined(image_draw, [85, 51], row[header['pseudo']], font=rift_bold_title, fill=self.colors['ti_green'], outline_fill=self.colors['black'], outline_width=5)
-            image_draw.text([85, 215], row[header['team']], font=rift_bold_sub, fill=self.colors['white'])
-
-            row_1_x = 950
-            row_1_y = 350
-            row_1_line = 65
-            row_1_inc = 225
-            row_2_x = row_1_x + 40
-            row_2_y = 330
-            row_2_inc = 225
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y], 'Héros du', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + row_1_line], 'Moment', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + row_1_inc], 'Networth', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + row_1_inc + row_1_line], "Dans l'équipe", rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + 2*row_1_inc], 'Nombre de', rift_bold_sub, self.colors['white'])
-            self.draw_text_left_align(image_draw, [row_1_x, row_1_y + 2*row_1_inc + row_1_line], 'héros joués', rift_bold_sub, self.colors['white'])
-            self.draw_text_outlined(image_draw, [row_2_x, row_2_y-5], row[header['hero_privilegie']].replace('_', ' '), font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-            self.draw_text_outlined(image_draw, [row_2_x, row_2_y + row_2_inc-5], row[header['networth']] + ' %', font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-            self.draw_text_outlined(image_draw, [row_2_x, row_2_y + 2*row_2_inc-5], row[header['nombre_heros']], font=rift_bold_title, fill=self.colors['ti_green'],
-                                    outline_fill=self.colors['black'], outline_width=5)
-
-            composition = self.draw_minimap_hero(composition, row[header['hero_signature_1']], [1450, 130], [None, 150])
-            composition = self.draw_minimap_hero(composition, row[header['hero_signature_2']], [1600, 130], [None, 150])
-            composition = self.draw_minimap_hero(composition, row[header['hero_signature_3']], [1750, 130], [None, 150])
-
-            composition.save(image_path)
+        for _, template, data in tasks:
+            self.generate_template(template, data)
         return True
 
-    def generate_csv_ti8_groups(self):
-        csv_data = db.session.query(CSVData).filter(CSVData.key == 'ti8_groups').one_or_none()
-        if csv_data is None: return;
+    def generate_csv_ti8_groups(self, encoding = None):
+        rows = CSVData.rows('ti8_groups')
+        if rows is None: return;
 
-        # Manage data
-        csv_reader = csv.reader(StringIO(csv_data.value), delimiter=',')
-        header = next(csv_reader)
-        header = {k: v for v, k in enumerate(header)}
-
-        # Delete previous image
         image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'ti8_groups.png')
-        if os.path.isfile(image_path): os.remove(image_path)
+        encoding = self.get_encoding('ti8_groups', encoding)
+        digest = self.render_cache.digest('ti8_groups', rows)
+        if self.render_cache.publish(image_path, digest, encoding):
+            return True
 
         # Generate image
-        composition = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'ti8_group-background.png')).convert('RGBA')
+        composition = asset_cache.image(('img', 'ti8_group-background.png')).copy()
         image_draw = ImageDraw.Draw(composition)
 
-        rift_bold_title = ImageFont.truetype(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'),
-            120)
-        rift_regular_sub = ImageFont.truetype(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_regular.otf'),
-            58)
-        rift_bold_sub = ImageFont.truetype(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'),
-            58)
+        rift_bold_title = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 120)
+        rift_regular_sub = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_regular.otf'), 58)
+        rift_bold_sub = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 58)
 
         status_colors = { 'red': self.colors['light_red'], 'green': self.colors['ti_green'], 'blue': self.colors['light_blue'], 'grey': self.colors['light_grey'] }
         logo_array = {
@@ -303,8 +324,8 @@ class ImageGenerator:
         win_offset = [615, 10]
         loses_offset = [705, 10]
 
-        for row in csv_reader:
-            if row[header['group']] == 'a':
+        for row in rows:
+            if row['group'] == 'a':
                 current_team_x_start = rectangle_group_x_start[0]
                 current_team_x_end = rectangle_group_x_end[0]
                 current_team_y = group_a_y
@@ -318,43 +339,45 @@ class ImageGenerator:
                                                      current_team_y + rectangle_padding,
                                                      current_team_x_end,
                                                      current_team_y + rectangle_height - rectangle_padding],
-                                                    fill=status_colors[row[header['color']]],
+                                                    fill=status_colors[row['color']],
                                                     alpha=0.5)
             image_draw = ImageDraw.Draw(composition)
 
-            image_draw.text([current_team_x_start + team_offset[0], current_team_y + team_offset[1]], row[header['team']], font=rift_regular_sub, fill=self.colors['white'])
-            self.draw_text_center_align(image_draw, [current_team_x_start + win_offset[0], current_team_y + win_offset[1]], row[header['wins']], font=rift_bold_sub, fill=self.colors['white'])
-            self.draw_text_center_align(image_draw, [current_team_x_start + loses_offset[0], current_team_y + loses_offset[1]], row[header['loses']], font=rift_bold_sub, fill=self.colors['white'])
+            image_draw.text([current_team_x_start + team_offset[0], current_team_y + team_offset[1]], row['team'], font=rift_regular_sub, fill=self.colors['white'])
+            self.draw_text_center_align(image_draw, [current_team_x_start + win_offset[0], current_team_y + win_offset[1]], row['wins'], font=rift_bold_sub, fill=self.colors['white'])
+            self.draw_text_center_align(image_draw, [current_team_x_start + loses_offset[0], current_team_y + loses_offset[1]], row['loses'], font=rift_bold_sub, fill=self.colors['white'])
             composition = self.draw_team_logo(composition,
-                                              row[header['teamid']] + logo_array[row[header['teamid']]]['suffix'],
-                                              [current_team_x_start + logo_array[row[header['teamid']]]['offset'][0], current_team_y + logo_array[row[header['teamid']]]['offset'][1]],
-                                              logo_array[row[header['teamid']]]['size'], 1)
+                                              row['teamid'] + logo_array[row['teamid']]['suffix'],
+                                              [current_team_x_start + logo_array[row['teamid']]['offset'][0], current_team_y + logo_array[row['teamid']]['offset'][1]],
+                                              logo_array[row['teamid']]['size'], 1)
 
-            if row[header['group']] == 'a':
+            if row['group'] == 'a':
                 group_a_y += rectangle_height
             else:
                 group_b_y += rectangle_height
 
-        composition.save(image_path)
+        self.render_cache.store(composition, image_path, digest, encoding)
 
         return True
 
-    def generate_post_game(self, match_id):
-        json = self.download_opendata_if_necessary(self.app.config['JSON_CACHE_PATH'], match_id)
-        if json is None or json['version'] is None:
+    def generate_post_game(self, match_id, encoding = None):
+        json = get_match_store(self.app).get(match_id)
+        if json is None:
             return False
-        heroes = db.session.query(DotaHero).all()
-        items = db.session.query(DotaItem).all()
-        players = db.session.query(DotaProPlayer).all()
-        teams = db.session.query(DotaProTeam).all()
+        reference = get_reference_data()
 
-        # Delete previous image
         image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'post_game-{0}.png'.format(match_id))
-        if os.path.isfile(image_path): os.remove(image_path)
+        encoding = self.get_encoding('post_game', encoding)
+        digest = self.render_cache.digest('post_game', {
+            'match': json,
+            'players': [reference.player(player['account_id']) for player in json['players']],
+            'teams': [reference.team(json['radiant_team_id']), reference.team(json['dire_team_id'])]
+        })
+        if self.render_cache.publish(image_path, digest, encoding):
+            return True
 
         # Generate image
-        composition = Image.open(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'post_game-background.png')).convert('RGBA')
+        composition = asset_cache.image(('img', 'post_game-background.png')).copy()
 
         hero_x = 350
         hero_y_side_padding = 30
@@ -391,53 +414,46 @@ class ImageGenerator:
         hero_color_width = 10
 
         # Draw Heroes & Items
+        compositor = Compositor(composition)
         for player in json['players']:
-            hero = next((hero for hero in heroes if hero.id == player['hero_id']), None)
+            hero = reference.hero(player['hero_id'])
             if hero is None:
                 short_name = 'error'
             else:
                 short_name = hero.short_name
-            hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                'hero_rectangle', short_name + '.png')).convert('RGBA')
+            hero_image = asset_cache.image(('img', 'hero_rectangle', short_name + '.png'))
             self.draw_image(composition, hero_image, [hero_x, hero_y[player['player_slot']]], [None, hero_height])
             for j in range(0, 2):
                 for i in range(0, 3):
                     key = 'item_{0}'.format(j*3 + i)
                     if player[key] != 0:
-                        item = next((item for item in items if item.id == player[key]), None)
+                        item = reference.item(player[key])
                         if item is None:
                             short_name = 'error'
                         else:
                             short_name = item.short_name
-                        item_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                             'item_rectangle', short_name + '.png')).convert('RGBA')
+                        item_image = asset_cache.image(('img', 'item_rectangle', short_name + '.png'))
                     else:
-                        item_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                             'item_rectangle', 'empty.png')).convert('RGBA')
+                        item_image = asset_cache.image(('img', 'item_rectangle', 'empty.png'))
                     self.draw_image(composition,
                                     item_image,
                                     [hero_x + hero_width + (i+1)*item_padding + i*item_width,
                                      hero_y[player['player_slot']] + j*(item_height+item_padding)],
                                         [None, item_height])
             # Draw damage sword
-            sword_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'icon', 'sword.png')).convert('RGBA')
-            sword_image = sword_image.resize([int(item_height/2), int(item_height/2)], Image.LANCZOS)
-            in_place_sword = Image.new('RGBA', (composition.size[0], composition.size[1]))
-            in_place_sword.paste(sword_image,
-                                box=[hero_x + hero_width + 3*(item_width + item_padding + kda_padding_x),
-                                     hero_y[player['player_slot']] + item_height + 15],
-                                mask=sword_image)
-            composition = Image.alpha_composite(composition, in_place_sword)
+            sword_image = asset_cache.image(('img', 'icon', 'sword.png'))
+            sword_image = asset_cache.resize(sword_image, [int(item_height/2), int(item_height/2)])
+            compositor.add(sword_image,
+                           [hero_x + hero_width + 3*(item_width + item_padding + kda_padding_x),
+                            hero_y[player['player_slot']] + item_height + 15])
 
             # Draw kda skull
-            skull_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'icon', 'skull.png')).convert('RGBA')
-            skull_image = skull_image.resize([int(item_height/2), int(item_height/2)], Image.LANCZOS)
-            in_place_skull = Image.new('RGBA', (composition.size[0], composition.size[1]))
-            in_place_skull.paste(skull_image,
-                                box=[hero_x + hero_width + 3*(item_width + item_padding + kda_padding_x),
-                                     hero_y[player['player_slot']] + 12],
-                                mask=skull_image)
-            composition = Image.alpha_composite(composition, in_place_skull)
+            skull_image = asset_cache.image(('img', 'icon', 'skull.png'))
+            skull_image = asset_cache.resize(skull_image, [int(item_height/2), int(item_height/2)])
+            compositor.add(skull_image,
+                           [hero_x + hero_width + 3*(item_width + item_padding + kda_padding_x),
+                            hero_y[player['player_slot']] + 12])
+        compositor.render()
 
         # Draw colors
         image_draw = ImageDraw.Draw(composition)
@@ -449,16 +465,12 @@ class ImageGenerator:
                                  fill=hero_color[player['player_slot']])
 
         # Draw player names & pseudo
-        rift_player_nickname = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources',
-                                              'fonts', 'rift', 'fort_foundry_rift_bold_italic.otf'), 46)
-        rift_player_name = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources',
-                                              'fonts', 'rift', 'fort_foundry_rift_regular.otf'), 26)
-        rift_kda = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources',
-                                              'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 32)
-        rift_dmg = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources',
-                                              'fonts', 'rift', 'fort_foundry_rift_regular.otf'), 32)
+        rift_player_nickname = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold_italic.otf'), 46)
+        rift_player_name = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_regular.otf'), 26)
+        rift_kda = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 32)
+        rift_dmg = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_regular.otf'), 32)
         for player in json['players']:
-            pro_player = next((pro_player for pro_player in players if pro_player.id == player['account_id']), None)
+            pro_player = reference.player(player['account_id'])
             if pro_player is None:
                 name = '-'
                 nickname = '-'
@@ -489,46 +501,22 @@ class ImageGenerator:
         graph_width = 4
         graph_graduation_x = 10
 
-        gold_xp_max = 0
-        for item in chain(radiant_gold_adv, radiant_xp_adv):
-            if abs(item) > gold_xp_max: gold_xp_max = abs(item)
-        gold_xp_max = int((gold_xp_max - gold_xp_max % 1000)/1000 + 1)
-        duration = math.ceil(json['duration'] / 60)
-        graph_x_step = math.floor((graph_end_x-graph_start_x)/duration)
-        graph_y_step = math.floor(graph_y/gold_xp_max)
+        graph = AdvantageGraph([radiant_gold_adv, radiant_xp_adv], json['duration'],
+                               graph_start_x, graph_end_x, 540, graph_y)
+        graph_x_step = graph.x_step
 
         image_draw.line([graph_start_x, 540 - int(graph_width/2), graph_end_x, 540 - int(graph_width/2)], fill=self.colors['white'], width=graph_width)
         image_draw.line([graph_start_x - int(graph_width/2), 540-graph_y, graph_start_x - int(graph_width/2), 540+graph_y], fill=self.colors['white'], width=graph_width)
-        i = 5
-        while i < gold_xp_max:
-            image_draw.line([graph_start_x,
-                             540 + graph_y_step*i,
-                             graph_end_x,
-                             540 + graph_y_step*i],
-                            fill=self.colors['grey'], width=1)
-            image_draw.line([graph_start_x,
-                             540 - graph_y_step*i,
-                             graph_end_x,
-                             540 - graph_y_step*i],
-                            fill=self.colors['grey'], width=1)
-            i += 5
-        i = 5
-        while i < duration:
-            image_draw.line([graph_start_x + i * graph_x_step,
-                             540 - graph_graduation_x-2,
-                             graph_start_x + i * graph_x_step,
-                             540 + graph_graduation_x-1],
+        graduations_y, graduations_x = graph.graduations()
+        for offset_y in graduations_y.tolist():
+            image_draw.line([graph_start_x, 540 + offset_y, graph_end_x, 540 + offset_y], fill=self.colors['grey'], width=1)
+            image_draw.line([graph_start_x, 540 - offset_y, graph_end_x, 540 - offset_y], fill=self.colors['grey'], width=1)
+        for x in graduations_x.tolist():
+            image_draw.line([x, 540 - graph_graduation_x-2, x, 540 + graph_graduation_x-1],
                             fill=self.colors['white'], width=graph_width)
-            i += 5
-        for i in range(1, duration):
-            image_draw.line([graph_start_x + (i-1)*graph_x_step,
-                             540 - int(graph_y_step*(radiant_xp_adv[i-1]/1000)),
-                             graph_start_x + i*graph_x_step,
-                             540 - int(graph_y_step*(radiant_xp_adv[i]/1000))], fill=self.colors['blue'], width=6)
-            image_draw.line([graph_start_x + (i-1)*graph_x_step,
-                             540 - int(graph_y_step*(radiant_gold_adv[i-1]/1000)),
-                             graph_start_x + i*graph_x_step,
-                             540 - int(graph_y_step*(radiant_gold_adv[i]/1000))], fill=self.colors['yellow'], width=6)
+        supersampling = self.app.config.get('IMG_GRAPH_SUPERSAMPLING', 1)
+        graph.draw(composition, radiant_xp_adv, self.colors['blue'], 6, supersampling)
+        graph.draw(composition, radiant_gold_adv, self.colors['yellow'], 6, supersampling)
 
         for objectif in json['objectives']:
             objectif_x = 0
@@ -562,8 +550,9 @@ class ImageGenerator:
             if image == 'error':
                 continue
 
-            image_icon = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'icon', image + '.png')).convert('RGBA')
-            composition = self.draw_image_centered(composition, image_icon, [objectif_x, objectif_y], [35, 35])
+            image_icon = asset_cache.image(('img', 'icon', image + '.png'))
+            compositor.add_centered(asset_cache.resize(image_icon, self.size_for_height(image_icon, 35)),
+                                    [objectif_x, objectif_y])
         for player in json['players']:
             for item_purchase in player['purchase_log']:
                 if item_purchase['key'] in ['black_king_bar', 'blink', 'sheepstick', 'silver_edge', 'refresher', 'orchid']:
@@ -573,23 +562,25 @@ class ImageGenerator:
                         item_y = 540 - graph_y
                     item_x = graph_start_x + int(graph_x_step * item_purchase['time'] / 60)
 
-                    image_icon = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'icon', 'item_' + item_purchase['key'] + '.png')).convert('RGBA')
-                    composition = self.draw_image_centered(composition, image_icon, [item_x, item_y], [35, 35])
+                    image_icon = asset_cache.image(('img', 'icon', 'item_' + item_purchase['key'] + '.png'))
+                    compositor.add_centered(asset_cache.resize(image_icon, self.size_for_height(image_icon, 35)),
+                                            [item_x, item_y])
+        compositor.render()
 
         image_draw = ImageDraw.Draw(composition)
         radiant_team = '?'
         dire_team = '?'
-        radiant_team_info = next((team for team in teams if team.id == json['radiant_team_id']), None)
+        radiant_team_info = reference.team(json['radiant_team_id'])
         if radiant_team_info is not None:
             radiant_team = radiant_team_info.name
-        dire_team_info = next((team for team in teams if team.id == json['dire_team_id']), None)
+        dire_team_info = reference.team(json['dire_team_id'])
         if dire_team_info is not None:
             dire_team = dire_team_info.name
 
-        rift_team = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 50)
+        rift_team = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 50)
         radiant_color = self.colors['ti_green']
         dire_color = self.colors['ti_green']
-        laurels_icon = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'icon', 'laurels.png')).convert('RGBA')
+        laurels_icon = asset_cache.image(('img', 'icon', 'laurels.png'))
         if json['radiant_win']:
             laurels_x =[int((graph_start_x + graph_end_x - image_draw.textsize(radiant_team, rift_team)[0])/2) - 40,
                         int((graph_start_x + graph_end_x + image_draw.textsize(radiant_team, rift_team)[0])/2) + 40]
@@ -603,53 +594,16 @@ class ImageGenerator:
         self.draw_text_outlined_center_align(image_draw, [int((graph_start_x + graph_end_x)/2), 15], radiant_team, font=rift_team, fill=radiant_color, outline_fill=self.colors['black'], outline_width=4)
         self.draw_text_outlined_center_align(image_draw, [int((graph_start_x + graph_end_x)/2), 1005], dire_team, font=rift_team, fill=dire_color, outline_fill=self.colors['black'], outline_width=4)
 
-        composition = self.draw_image_centered(composition, laurels_icon, [laurels_x[0], laurels_y], [40, 40])
-        composition = self.draw_image_centered(composition, laurels_icon, [laurels_x[1], laurels_y], [40, 40])
+        laurels_icon = asset_cache.resize(laurels_icon, self.size_for_height(laurels_icon, 40))
+        compositor.add_centered(laurels_icon, [laurels_x[0], laurels_y])
+        compositor.add_centered(laurels_icon, [laurels_x[1], laurels_y])
+        compositor.render()
 
-        composition.save(image_path)
+        self.render_cache.store(composition, image_path, digest, encoding)
         return True
 
-    @staticmethod
-    def download_opendata_if_necessary(cache_path, match_id):
-        # Delete previous image
-        json_path = os.path.join(cache_path, 'post_game-{0}.json'.format(match_id))
-        if os.path.isfile(json_path):
-            with open(json_path, 'r') as json_file:
-                json_content = json.loads(json_file.read())
-            if json_content['version'] is None:
-                os.remove(json_path)
-            else:
-                return json_content
-
-        # Download json to file
-        r = requests.get("https://api.opendota.com/api/matches/{0}".format(match_id))
-        if r.status_code != 200:
-            return None
-
-        json_content = r.json()
-        if json_content['version'] is None:
-            return None
-        with open(json_path, "w") as json_file:
-            json_file.write(json.dumps(json_content))
-
-        return json_content
-
-    def generate_tournament_global(self, tournament_id):
-        heroes = db.session.query(DotaHero).all()
-
-        # Delete previous image
-        image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'tournament_global-{0}.png'.format(tournament_id))
-        if os.path.isfile(image_path): os.remove(image_path)
-
-        # Generate image
-        composition = Image.open(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'preti8_teams-background.png')).convert('RGBA')
-
-        image_draw = ImageDraw.Draw(composition)
-        rift_title = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 72)
-        rift_text = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_regular.otf'), 72)
-        rift_subtitle = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 72)
-        self.draw_text_outlined_center_align(image_draw, [960, 35], 'The International 8', rift_title, fill=self.colors['ti_green'], outline_fill=self.colors['black'], outline_width=4)
+    def generate_tournament_global(self, tournament_id, encoding = None):
+        reference = get_reference_data()
 
         # Most successful
         successful = []
@@ -659,7 +613,7 @@ class ImageGenerator:
                 .order_by(desc(DotaStatTounamentHero.mean_is_win))\
                 .limit(8)\
                 .all():
-            hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+            hero = reference.hero(hero_stat.hero_id)
             if hero is not None:
                 successful.append(hero)
                 successful_stat.append(hero_stat)
@@ -682,7 +636,7 @@ class ImageGenerator:
         # Remaining heroes
         not_picked_heroes = []
         for hero_stat in db.session.query(DotaStatTounamentHero).filter(DotaStatTounamentHero.id_tn==tournament_id, DotaStatTounamentHero.nb_pick==0).all():
-            hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+            hero = reference.hero(hero_stat.hero_id)
             if hero is not None:
                 not_picked_heroes.append(hero)
 
@@ -692,16 +646,37 @@ class ImageGenerator:
         bans = []
         bans_stat = []
         for hero_stat in db.session.query(DotaStatTounamentHero).filter(DotaStatTounamentHero.id_tn==tournament_id).order_by(desc(DotaStatTounamentHero.nb_pick)).limit(4).all():
-            hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+            hero = reference.hero(hero_stat.hero_id)
             if hero is not None:
                 picks.append(hero)
                 picks_stat.append(hero_stat)
         for hero_stat in db.session.query(DotaStatTounamentHero).filter(DotaStatTounamentHero.id_tn==tournament_id).order_by(desc(DotaStatTounamentHero.nb_ban)).limit(3).all():
-            hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+            hero = reference.hero(hero_stat.hero_id)
             if hero is not None:
                 bans.append(hero)
                 bans_stat.append(hero_stat)
 
+        image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'tournament_global-{0}.png'.format(tournament_id))
+        encoding = self.get_encoding('tournament_global', encoding)
+        digest = self.render_cache.digest('tournament_global', {
+            'tournament': self.stat_values(stat_tn),
+            'successful': [successful, [self.stat_values(stat) for stat in successful_stat]],
+            'not_picked': not_picked_heroes,
+            'picks': [picks, [self.stat_values(stat) for stat in picks_stat]],
+            'bans': [bans, [self.stat_values(stat) for stat in bans_stat]]
+        })
+        if self.render_cache.publish(image_path, digest, encoding):
+            return True
+
+        # Generate image
+        composition = asset_cache.image(('img', 'preti8_teams-background.png')).copy()
+
+        image_draw = ImageDraw.Draw(composition)
+        rift_title = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 72)
+        rift_text = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_regular.otf'), 72)
+        rift_subtitle = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 72)
+        self.draw_text_outlined_center_align(image_draw, [960, 35], 'The International 8', rift_title, fill=self.colors['ti_green'], outline_fill=self.colors['black'], outline_width=4)
+
         # Draw everything
         hero_height = 90
         hero_width = int(256*hero_height/144)
@@ -722,23 +697,19 @@ class ImageGenerator:
                    1: hero_y_bans_padding + hero_y_side_padding + 4 * (hero_height + hero_y_padding),
                    2: hero_y_bans_padding + hero_y_side_padding + 5 * (hero_height + hero_y_padding)}]
         for i in range(0, len(picks)):
-            hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                'hero_rectangle', picks[i].short_name + '.png')).convert('RGBA')
+            hero_image = asset_cache.image(('img', 'hero_rectangle', picks[i].short_name + '.png'))
             self.draw_image(composition, hero_image, [hero_x, hero_y[0][i]], [None, hero_height])
         for i in range(0, len(bans)):
-            hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                'hero_rectangle', bans[i].short_name + '.png')).convert('RGBA')
+            hero_image = asset_cache.image(('img', 'hero_rectangle', bans[i].short_name + '.png'))
             self.draw_image(composition, hero_image, [hero_x, hero_y[1][i]], [None, hero_height])
         for i in range(0, len(successful)):
-            hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                'hero_rectangle', successful[i].short_name + '.png')).convert('RGBA')
+            hero_image = asset_cache.image(('img', 'hero_rectangle', successful[i].short_name + '.png'))
             self.draw_image(composition, hero_image, [hero_x- successful_x_padding, hero_y[0][i]], [None, hero_height])
 
         i = 0
         j = 0
         while i + 4*j < min(len(not_picked_heroes), 12):
-            hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                'hero_rectangle', not_picked_heroes[i + 4*j].short_name + '.png')).convert('RGBA')
+            hero_image = asset_cache.image(('img', 'hero_rectangle', not_picked_heroes[i + 4*j].short_name + '.png'))
             if i+4*j == 11:
                 if len(not_picked_heroes) == 12:
                     self.draw_image(composition, hero_image, [75 + i*(hero_width + hero_y_padding), hero_y[0][5+j]], [None, hero_height])
@@ -777,16 +748,14 @@ class ImageGenerator:
         self.draw_text_center_align(image_draw, [637, hero_y[0][3]], text='{0:02}:{1:02}'.format(mean_duration_min, mean_duration_sec), font=rift_text, fill=self.colors['white'])
         self.draw_text_center_align(image_draw, [425, hero_y[1][0] - 100], 'Never Picked', font=rift_subtitle, fill=self.colors['white'])
 
-        composition.save(image_path)
+        self.render_cache.store(composition, image_path, digest, encoding)
         return True
 
-    def generate_team_faceoff(self, tournament_id, team_id_1, team_id_2):
+    def generate_team_faceoff(self, tournament_id, team_id_1, team_id_2, encoding = None):
 
         # Get Data
-        teams = [
-            db.session.query(DotaProTeam).filter(DotaProTeam.id == int(team_id_1)).one_or_none(),
-            db.session.query(DotaProTeam).filter(DotaProTeam.id == int(team_id_2)).one_or_none()
-        ]
+        reference = get_reference_data()
+        teams = [reference.team(team_id_1), reference.team(team_id_2)]
         if teams[0] is None or teams[1] is None:
             return
         team_stats = [
@@ -795,7 +764,6 @@ class ImageGenerator:
             db.session.query(DotaStatTounamentTeam).filter(DotaStatTounamentTeam.tn_id == tournament_id,
                                                            DotaStatTounamentTeam.team_id == teams[1].id).one_or_none()
         ]
-        heroes = db.session.query(DotaHero).all()
 
         # Top Picks & Success
         picks = [[], []]
@@ -810,7 +778,7 @@ class ImageGenerator:
                                                DotaStatTounamentTeamHero.team_id == teams[i].id)\
                                        .order_by(desc(DotaStatTounamentTeamHero.nb_pick))\
                                        .limit(5).all():
-                hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+                hero = reference.hero(hero_stat.hero_id)
                 if hero is not None:
                     picks[i].append(hero)
                     picks_stat[i].append(hero_stat)
@@ -820,7 +788,7 @@ class ImageGenerator:
                                                DotaStatTounamentTeamHero.nb_pick >= 4)\
                                        .order_by(desc(DotaStatTounamentTeamHero.mean_is_win))\
                                        .limit(5).all():
-                hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+                hero = reference.hero(hero_stat.hero_id)
                 if hero is not None:
                     successful[i].append(hero)
                     successful_stat[i].append(hero_stat)
@@ -829,22 +797,29 @@ class ImageGenerator:
                                                DotaStatTounamentTeamHero.team_id == teams[i].id)\
                                        .order_by(desc(DotaStatTounamentTeamHero.nb_ban_against))\
                                        .limit(3).all():
-                hero = next((hero for hero in heroes if hero.id == int(hero_stat.hero_id)), None)
+                hero = reference.hero(hero_stat.hero_id)
                 if hero is not None:
                     bans[i].append(hero)
                     bans_stat[i].append(hero_stat)
 
-        # Delete previous image
         image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'team_faceoff-{0}-{1}.png'.format(team_id_1, team_id_2))
-        if os.path.isfile(image_path): os.remove(image_path)
+        encoding = self.get_encoding('team_faceoff', encoding)
+        digest = self.render_cache.digest('team_faceoff', {
+            'teams': teams,
+            'team_stats': [self.stat_values(stat) for stat in team_stats],
+            'picks': [picks, [[self.stat_values(stat) for stat in stats] for stats in picks_stat]],
+            'successful': [successful, [[self.stat_values(stat) for stat in stats] for stats in successful_stat]],
+            'bans': [bans, [[self.stat_values(stat) for stat in stats] for stats in bans_stat]]
+        })
+        if self.render_cache.publish(image_path, digest, encoding):
+            return True
 
         # Image variables
-        composition = Image.open(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'faceoff-background.png')).convert('RGBA')
+        composition = asset_cache.image(('img', 'faceoff-background.png')).copy()
         image_draw = ImageDraw.Draw(composition)
-        rift_title = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 72)
-        rift_middle = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_bold.otf'), 48)
-        rift_text = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'rift', 'fort_foundry_rift_regular.otf'), 50)
+        rift_title = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 72)
+        rift_middle = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_bold.otf'), 48)
+        rift_text = asset_cache.font(('fonts', 'rift', 'fort_foundry_rift_regular.otf'), 50)
 
         hero_height = 90
         hero_width = int(256 * hero_height / 144)
@@ -875,18 +850,15 @@ class ImageGenerator:
         # Left is reverse
         for i in range(0, 2):
             for j in range(0, len(picks[i])):
-                hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                     'hero_rectangle', picks[i][j].short_name + '.png')).convert('RGBA')
+                hero_image = asset_cache.image(('img', 'hero_rectangle', picks[i][j].short_name + '.png'))
                 self.draw_image(composition, hero_image, [hero_x_picks[i] + (1-i)*(len(picks[i])-j-1)*(hero_width + hero_padding) + i*j*(hero_width + hero_padding),
                                                           rows[0]], [None, hero_height])
             for j in range(0, len(successful[i])):
-                hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                     'hero_rectangle', successful[i][j].short_name + '.png')).convert('RGBA')
+                hero_image = asset_cache.image(('img', 'hero_rectangle', successful[i][j].short_name + '.png'))
                 self.draw_image(composition, hero_image, [hero_x_picks[i] + (1-i)*(len(successful[i])-j-1)*(hero_width + hero_padding) + i*j*(hero_width + hero_padding),
                                                           rows[1]], [None, hero_height])
             for j in range(0, len(bans[i])):
-                hero_image = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img',
-                                                     'hero_rectangle', bans[i][j].short_name + '.png')).convert('RGBA')
+                hero_image = asset_cache.image(('img', 'hero_rectangle', bans[i][j].short_name + '.png'))
                 self.draw_image(composition, hero_image, [hero_x_bans[i] + (1-i)*(len(bans[i])-j-1)*(hero_width + hero_padding) + i*j*(hero_width + hero_padding),
                                                           rows[2]], [None, hero_height])
 
@@ -963,20 +935,21 @@ class ImageGenerator:
                                             font=rift_text,
                                             fill=self.colors['white'])
 
-        composition.save(image_path)
+        self.render_cache.store(composition, image_path, digest, encoding)
         return True
 
     def generate_froggedtv_calendar(self, image_name, calendar_data):
-        # Delete previous image
         image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'calendar_froggedtv_{0}.png'.format(image_name))
-        if os.path.isfile(image_path): os.remove(image_path)
+        encoding = self.get_encoding('calendar_froggedtv')
+        digest = self.render_cache.digest('calendar_froggedtv', calendar_data)
+        if self.render_cache.publish(image_path, digest, encoding):
+            return
 
         # Generate image
-        composition = Image.open(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'calendar-background_froggedtv_10h2h.png')).convert('RGBA')
+        composition = asset_cache.image(('img', 'calendar-background_froggedtv_10h2h.png')).copy()
 
         image_draw = ImageDraw.Draw(composition)
-        rift_title = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'futura', 'futurastd_condensed.otf'), 48)
+        rift_title = asset_cache.font(('fonts', 'futura', 'futurastd_condensed.otf'), 48)
 
         first_day_x = 122
         day_offset_x = 240
@@ -1046,7 +1019,7 @@ class ImageGenerator:
                 self.draw_text_center_vertical_align(image_draw, [center_x, center_y], streamer, rift_title, ImageColor.getrgb('#000000'))
             else:
                 # Add frog background
-                frog = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'calendar-grenouille.png'))
+                frog = asset_cache.image(('img', 'calendar-grenouille.png'))
                 rectangle_height = (y1 - border_width - y0 - border_width)
                 if frog.size[1] > rectangle_height:
                     diff = frog.size[1] - rectangle_height
@@ -1058,23 +1031,24 @@ class ImageGenerator:
                 show = event['title'].lower().replace(' ', '_').replace("'", '_').replace('+', 'plus')
                 url = os.path.join(os.path.dirname(__file__),  '..', 'ressources', 'img', 'shows', '{}.png'.format(show))
                 if os.path.exists(url):
-                    show_image = Image.open(url)
+                    show_image = asset_cache.image(('img', 'shows', '{}.png'.format(show)))
                     composition.paste(show_image,
                                       [center_x - int(show_image.size[0] / 2), center_y - int(show_image.size[1] / 2)],
                                       show_image)
-        composition.save(image_path)
+        self.render_cache.store(composition, image_path, digest, encoding)
 
     def generate_artifact_fr_calendar(self, image_name, calendar_data):
-        # Delete previous image
         image_path = os.path.join(self.app.config['IMG_GENERATE_PATH'], 'calendar_artifact_fr_{0}.png'.format(image_name))
-        if os.path.isfile(image_path): os.remove(image_path)
+        encoding = self.get_encoding('calendar_artifact_fr')
+        digest = self.render_cache.digest('calendar_artifact_fr', calendar_data)
+        if self.render_cache.publish(image_path, digest, encoding):
+            return
 
         # Generate image
-        composition = Image.open(
-            os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'calendar-background_artifact_fr_10h2h.png')).convert('RGBA')
+        composition = asset_cache.image(('img', 'calendar-background_artifact_fr_10h2h.png')).copy()
 
         image_draw = ImageDraw.Draw(composition)
-        rift_title = ImageFont.truetype(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'fonts', 'hypatia', 'hypatiasanspro_regular.otf'), 48)
+        rift_title = asset_cache.font(('fonts', 'hypatia', 'hypatiasanspro_regular.otf'), 48)
 
         first_day_x = 122
         day_offset_x = 240
@@ -1144,10 +1118,10 @@ class ImageGenerator:
             y0 = y0 + 4
             if 'Artifact avec' in event['title']:
                 # Add artifact background
-                artifact = Image.open(os.path.join(os.path.dirname(__file__), '..', 'ressources', 'img', 'calendar-artifact.png'))
+                artifact = asset_cache.image(('img', 'calendar-artifact.png'))
                 rectangle_width = (x1 - border_width - x0 - border_width)
                 rectangle_height = (y1 - border_width - y0 - border_width)
-                resized_image = artifact.resize([rectangle_width, rectangle_height], Image.LANCZOS)
+                resized_image = asset_cache.resize(artifact, [rectangle_width, rectangle_height])
                 composition.paste(resized_image, box=[x0+border_width, y0+border_width])
 
                 # Add streamer name
@@ -1160,26 +1134,43 @@ class ImageGenerator:
                 show = event['title'].lower().replace(' ', '_').replace("'", '_').replace('+', 'plus')
                 url = os.path.join(os.path.dirname(__file__),  '..', 'ressources', 'img', 'shows', '{}.png'.format(show))
                 if os.path.exists(url):
-                    show_image = Image.open(url)
+                    show_image = asset_cache.image(('img', 'shows', '{}.png'.format(show)))
                     composition.paste(show_image,
                                       [center_x - int(show_image.size[0] / 2), center_y - int(show_image.size[1] / 2)],
                                       show_image)
-        composition.save(image_path)
+        self.render_cache.store(composition, image_path, digest, encoding)
 
 
 
+    @staticmethod
+    def stat_values(stat):
+        """Values of the columns of a stat row, to hash the inputs of an image.
+
+        Args:
+            stat: Stat model object, or None.
+        Returns:
+            List of the column values, None if there is no row.
+        """
+        if stat is None:
+            return None
+        return [getattr(stat, column.name) for column in stat.__table__.columns]
+
     @staticmethod
     def duration_to_string(duration):
         duration_sec = math.ceil(duration) % 60
         duration_min = int(math.ceil(duration - duration_sec) / 60)
         return '{0:02}:{1:02}'.format(duration_min, duration_sec)
 
+    @staticmethod
+    def size_for_height(image, height):
+        return [int(image.size[0] * height / image.size[1]), height]
+
     @staticmethod
     def draw_image(composition, image, position, size):
         new_width = int(image.size[0] * size[1] / image.size[1])
         new_height = size[1]
 
-        resized_image = image.resize([new_width, new_height], Image.LANCZOS)
+        resized_image = asset_cache.resize(image, [new_width, new_height])
         composition.paste(resized_image, box=position)
 
     @staticmethod
@@ -1187,69 +1178,47 @@ class ImageGenerator:
         new_width = int(image.size[0] * size[1] / image.size[1])
         new_height = size[1]
 
-        resized_image = image.resize([new_width, new_height], Image.LANCZOS)
-        in_plate_image = Image.new('RGBA', (composition.size[0], composition.size[1]))
-        in_plate_image.paste(resized_image,
-                            box=[position[0] - int(resized_image.size[0] / 2),
-                                 position[1] - int(resized_image.size[1] / 2)],
-                            mask=resized_image)
-        return Image.alpha_composite(composition, in_plate_image)
+        resized_image = asset_cache.resize(image, [new_width, new_height])
+        return alpha_composite_at(composition, masked_layer(resized_image),
+                                  [position[0] - int(resized_image.size[0] / 2),
+                                   position[1] - int(resized_image.size[1] / 2)])
 
     @staticmethod
     def draw_team_logo(composition, team_id, position, size, alpha):
-        team_logo = Image.open(os.path.join(os.path.dirname(__file__),
-                                             '..', 'ressources', 'img',
-                                            'team_logos',
-                                            '{0}.png'.format(team_id))).convert('RGBA')
+        team_logo = asset_cache.image(('img', 'team_logos', '{0}.png'.format(team_id)))
 
         new_width = int(team_logo.size[0] * size[1] / team_logo.size[1])
         new_height = size[1]
 
-        team_logo = team_logo.resize([new_width, new_height], Image.LANCZOS)
-        in_place_logo = Image.new('RGBA', (composition.size[0], composition.size[1]))
-        in_place_logo.paste(team_logo,
-                            box=[position[0] - int(team_logo.size[0] / 2),
-                                 position[1] - int(team_logo.size[1] / 2)],
-                            mask=team_logo)
-        in_place_logo = Image.blend(Image.new('RGBA', (composition.size[0], composition.size[1])), in_place_logo, alpha)
-        return Image.alpha_composite(composition, in_place_logo)
+        team_logo = asset_cache.resize(team_logo, [new_width, new_height])
+        return alpha_composite_at(composition, masked_layer(team_logo, alpha),
+                                  [position[0] - int(team_logo.size[0] / 2),
+                                   position[1] - int(team_logo.size[1] / 2)])
 
     @staticmethod
     def draw_minimap_hero(composition, hero, position, size):
-        team_logo = Image.open(os.path.join(os.path.dirname(__file__),
-                                             '..', 'ressources', 'img',
-                                            'hero_minimap',
-                                            hero + '.png')).convert('RGBA')
+        team_logo = asset_cache.image(('img', 'hero_minimap', hero + '.png'))
 
         new_width = int(team_logo.size[0] * size[1] / team_logo.size[1])
         new_height = size[1]
 
-        team_logo = team_logo.resize([new_width, new_height], Image.LANCZOS)
-        in_place_logo = Image.new('RGBA', (composition.size[0], composition.size[1]))
-        in_place_logo.paste(team_logo,
-                            box=[position[0] - int(team_logo.size[0] / 2),
-                                 position[1] - int(team_logo.size[1] / 2)],
-                            mask=team_logo)
-        return Image.alpha_composite(composition, in_place_logo)
+        team_logo = asset_cache.resize(team_logo, [new_width, new_height])
+        return alpha_composite_at(composition, masked_layer(team_logo),
+                                  [position[0] - int(team_logo.size[0] / 2),
+                                   position[1] - int(team_logo.size[1] / 2)])
 
 
     @staticmethod
     def draw_player_portrait(composition, player_id, position, size):
-        player_portrait = Image.open(os.path.join(os.path.dirname(__file__),
-                                                   '..', 'ressources', 'img',
-                                                  'player_portrait',
-                                                  player_id + '.png')).convert('RGBA')
+        player_portrait = asset_cache.image(('img', 'player_portrait', player_id + '.png'))
 
         new_width = int(player_portrait.size[0] * size[1] / player_portrait.size[1])
         new_height = size[1]
 
-        player_portrait = player_portrait.resize([new_width, new_height], Image.LANCZOS)
-        in_place_portrait = Image.new('RGBA', (composition.size[0], composition.size[1]))
-        in_place_portrait.paste(player_portrait,
-                                box=[position[0] - int(player_portrait.size[0] / 2),
-                                     position[1] - int(player_portrait.size[1] / 2)],
-                                mask=player_portrait)
-        return Image.alpha_composite(composition, in_place_portrait)
+        player_portrait = asset_cache.resize(player_portrait, [new_width, new_height])
+        return alpha_composite_at(composition, masked_layer(player_portrait),
+                                  [position[0] - int(player_portrait.size[0] / 2),
+                                   position[1] - int(player_portrait.size[1] / 2)])
 
     @staticmethod
     def draw_text_outlined(draw, position, text, font, fill, outline_fill, outline_width):
@@ -1292,8 +1261,8 @@ class ImageGenerator:
 
     @staticmethod
     def draw_alpha_rectangle(composition, positions, fill, alpha):
-        in_place_rectangle = Image.new('RGBA', (composition.size[0], composition.size[1]))
-        image_draw = ImageDraw.Draw(in_place_rectangle)
-        image_draw.rectangle(xy=positions, fill=fill)
-        in_place_rectangle = Image.blend(Image.new('RGBA', (composition.size[0], composition.size[1])), in_place_rectangle, alpha)
-        return Image.alpha_composite(composition, in_place_rectangle)
+        rectangle = Image.new('RGBA', (positions[2] - positions[0] + 1, positions[3] - positions[1] + 1))
+        image_draw = ImageDraw.Draw(rectangle)
+        image_draw.rectangle(xy=[0, 0, rectangle.size[0] - 1, rectangle.size[1] - 1], fill=fill)
+        rectangle = Image.blend(Image.new('RGBA', rectangle.size), rectangle, alpha)
+        return alpha_composite_at(composition, rectangle, positions[0:2])
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from helpers.image_compositing import alpha_composite_at
+
+
+class AdvantageGraph:
+    """Scale of the gold and experience advantage graph of a match.
+
+    Values are in thousands of gold/xp vertically and in minutes horizontally, both rounded like the graduations.
+    Series are sampled every minute by OpenDota, denser series (per second) are placed by their sampling interval.
+
+    Attributes:
+        start_x: Abscissa of the start of the game.
+        center_y: Ordinate of the zero advantage line.
+        minutes: Duration of the game, in started minutes.
+        thousands: Maximum advantage of all the series, in started thousands.
+        x_step: Pixels per minute.
+        y_step: Pixels per thousand.
+    """
+
+    def __init__(self, series, duration, start_x, end_x, center_y, height):
+        self.start_x = start_x
+        self.center_y = center_y
+        self.duration = duration
+        maximum = max([np.abs(np.asarray(values, dtype=np.float64)).max() for values in series if len(values) > 0],
+                      default=0)
+        self.minutes = math.ceil(duration / 60)
+        self.thousands = int(maximum // 1000 + 1)
+        self.x_step = math.floor((end_x - start_x) / self.minutes)
+        self.y_step = math.floor(height / self.thousands)
+
+    def points(self, values):
+        """Scale a series to the graph.
+
+        Args:
+            values: Advantages sampled every minute, or at a regular denser interval over the game.
+        Returns:
+            Integer array of shape (n, 2) of the points of the series.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        interval = 1 if len(values) <= self.minutes + 1 else self.duration / 60 / (len(values) - 1)
+        times = np.arange(len(values)) * interval
+        keep = times < self.minutes
+        points = np.empty((int(keep.sum()), 2), dtype=np.int64)
+        points[:, 0] = self.start_x + np.rint(times[keep] * self.x_step).astype(np.int64)
+        # Truncated toward zero, like the graduations.
+        points[:, 1] = self.center_y - (self.y_step * (values[keep] / 1000)).astype(np.int64)
+        return points
+
+    def graduations(self, every=5):
+        """Graduations of the graph.
+
+        Returns:
+            Tuple (horizontal offsets in pixels from the zero line, abscissas of the minutes).
+        """
+        return (np.arange(every, self.thousands, every) * self.y_step,
+                self.start_x + np.arange(every, self.minutes, every) * self.x_step)
+
+    def draw(self, composition, values, fill, width, supersampling=1):
+        """Draw a series as a single polyline.
+
+        Args:
+            composition: RGBA `Image` to draw on.
+            values: Advantages of the series, see `points`.
+            fill: RGB color of the line.
+            width: Width of the line in pixels.
+            supersampling: Draw at this scale then downsample to anti-alias the line, 1 to disable.
+        Returns:
+            The composition.
+        """
+        points = self.points(values)
+        if len(points) < 2:
+            return composition
+        if supersampling <= 1:
+            ImageDraw.Draw(composition).line(points.ravel().tolist(), fill=fill, width=width)
+            return composition
+
+        origin = points.min(axis=0) - width
+        size = points.max(axis=0) + width - origin + 1
+        # Transparent pixels keep the line color, so downsampling does not darken the edges.
+        layer = Image.new('RGBA', tuple(int(s) * supersampling for s in size), tuple(fill[0:3]) + (0,))
+        ImageDraw.Draw(layer).line(((points - origin) * supersampling).ravel().tolist(),
+                                   fill=tuple(fill[0:3]) + (255,), width=width * supersampling)
+        layer = layer.resize((int(size[0]), int(size[1])), Image.LANCZOS)
+        return alpha_composite_at(composition, layer, [int(origin[0]), int(origin[1])])
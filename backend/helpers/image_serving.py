@@ -0,0 +1,88 @@
+import os
+from datetime import datetime
+
+from flask import request, Response
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified, unquote_etag
+from werkzeug.wsgi import wrap_file
+
+
+def image_etag(stat, version=''):
+    """Strong ETag of an image file.
+
+    Generated images are written once to a new file and published as hard links of the render cache, so the
+    inode changes with the content. The modification time is not used, publishing touches the cached file.
+
+    Args:
+        stat: `os.stat_result` of the image.
+        version: Render version, see IMG_RENDER_VERSION.
+    Returns:
+        ETag, without quotes.
+    """
+    return '{0}-{1:x}-{2:x}'.format(version, stat.st_ino, stat.st_size)
+
+
+def send_image(path, mimetype, cache_control, version='', sendfile=None, sendfile_path=None):
+    """Serve an image with conditional and ranged requests.
+
+    Args:
+        path: Path of the image.
+        mimetype: Mimetype of the image.
+        cache_control: Value of the Cache-Control header.
+        version: Render version, part of the ETag.
+        sendfile: None to send the bytes, 'x-accel-redirect' (nginx) or 'x-sendfile' to let the proxy send them.
+        sendfile_path: URI of the image for X-Accel-Redirect.
+    Returns:
+        `Response` with a status 200, 206, 304 or 416.
+    Raises:
+        OSError: If the image can't be read.
+    """
+    stat = os.stat(path)
+    etag = image_etag(stat, version)
+    last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    elif sendfile == 'x-accel-redirect':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = sendfile_path
+    elif sendfile == 'x-sendfile':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+    else:
+        response = _send_range(path, mimetype, stat.st_size, etag)
+        if response is None:
+            response = Response(wrap_file(request.environ, open(path, 'rb')), mimetype=mimetype,
+                                direct_passthrough=True)
+            response.content_length = stat.st_size
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _send_range(path, mimetype, size, etag):
+    """Serve the single byte range of the request, None to serve the whole image."""
+    byte_range = request.range
+    if byte_range is None or len(byte_range.ranges) != 1:
+        return None
+    # A range of another version of the image is useless to the client
+    if_range = request.headers.get('If-Range', None)
+    if if_range is not None and unquote_etag(if_range)[0] != etag:
+        return None
+
+    bounds = byte_range.range_for_length(size)
+    if bounds is None:
+        response = Response(status=416)
+        response.headers['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+
+    start, stop = bounds
+    with open(path, 'rb') as image_file:
+        image_file.seek(start)
+        data = image_file.read(stop - start)
+    response = Response(data, status=206, mimetype=mimetype)
+    response.headers['Content-Range'] = ContentRange('bytes', start, stop, size).to_header()
+    return response
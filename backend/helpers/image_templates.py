@@ -0,0 +1,370 @@
+from collections import namedtuple
+from string import Formatter
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from PIL import Image, ImageChops, ImageColor, ImageDraw
+
+from helpers.image_assets import asset_cache, RESSOURCES_PATH
+from helpers.image_compositing import alpha_composite_at, masked_layer
+from helpers.image_encoding import is_encoding
+
+TEMPLATES_PATH = os.path.join(RESSOURCES_PATH, 'templates')
+
+# draw(composition, spec, colors) -> composition. Static layers do not depend on the data.
+# Drawable layers only use ImageDraw, so they can be pre-rasterized in a premultiplied overlay.
+CompiledLayer = namedtuple('CompiledLayer', ['draw', 'spec', 'static', 'drawable'])
+
+
+class TemplateError(Exception):
+    """Raised when a template is invalid or can't be rendered with the given data."""
+    pass
+
+
+def is_bound(value):
+    """Check if a template value depends on the data, ie. contains a `{field}`."""
+    if isinstance(value, str):
+        return any(field is not None for _, field, _, _ in Formatter().parse(value))
+    if isinstance(value, (list, tuple)):
+        return any(is_bound(item) for item in value)
+    if isinstance(value, dict):
+        return any(is_bound(item) for item in value.values())
+    return False
+
+
+def bind(value, data):
+    """Replace the `{field}` of a template value by the data."""
+    if isinstance(value, str):
+        try:
+            return value.format(**data)
+        except (KeyError, IndexError) as e:
+            raise TemplateError('Missing data {0} for "{1}".'.format(e, value))
+    if isinstance(value, (list, tuple)):
+        return [bind(item, data) for item in value]
+    if isinstance(value, dict):
+        return {key: bind(item, data) for key, item in value.items()}
+    return value
+
+
+def check_path_part(part):
+    """Check that a bound path component stays in its directory.
+
+    Args:
+        part: Path component or file name, after binding the data.
+    Returns:
+        The path component.
+    Raises:
+        TemplateError: If the component is empty, contains a separator or `..`.
+    """
+    part = str(part)
+    if len(part) == 0 or '..' in part or '/' in part or os.sep in part or \
+            (os.altsep is not None and os.altsep in part) or '\0' in part:
+        raise TemplateError('Invalid path component "{0}".'.format(part))
+    return part
+
+
+def get_color(colors, name):
+    if isinstance(name, (list, tuple)):
+        return tuple(name)
+    if name in colors:
+        return colors[name]
+    return ImageColor.getrgb(name)
+
+
+def draw_text_layer(composition, spec, colors):
+    image_draw = ImageDraw.Draw(composition)
+    font = asset_cache.font(spec['font'], spec['size'])
+    text = str(spec['text'])
+    x, y = spec['position']
+    align = spec.get('align', 'left')
+    if align != 'left':
+        w, h = image_draw.textsize(text=text, font=font)
+        if align == 'right':
+            x = x - w
+        else:
+            x = x - int(w / 2)
+        if align == 'middle':
+            y = y - int(h / 2)
+
+    outline = spec.get('outline', None)
+    if outline is not None:
+        width = outline['width']
+        fill = get_color(colors, outline['fill'])
+        for dx, dy in [(-width, -width), (width, -width), (-width, width), (width, width)]:
+            image_draw.text((x + dx, y + dy), text, font=font, fill=fill)
+    image_draw.text([x, y], text, font=font, fill=get_color(colors, spec['fill']))
+    return composition
+
+
+def draw_image_layer(composition, spec, colors):
+    image = asset_cache.image([check_path_part(part) for part in spec['image']])
+    if 'height' in spec:
+        image = asset_cache.resize(image, [int(image.size[0] * spec['height'] / image.size[1]), spec['height']])
+    x, y = spec['position']
+    if spec.get('anchor', 'center') == 'center':
+        x = x - int(image.size[0] / 2)
+        y = y - int(image.size[1] / 2)
+    return alpha_composite_at(composition, masked_layer(image, spec.get('alpha', None)), [x, y])
+
+
+def draw_rectangle_layer(composition, spec, colors):
+    xy = spec['xy']
+    fill = get_color(colors, spec['fill'])
+    alpha = spec.get('alpha', None)
+    if alpha is None:
+        ImageDraw.Draw(composition).rectangle(xy=xy, fill=fill)
+        return composition
+    rectangle = Image.new('RGBA', (xy[2] - xy[0] + 1, xy[3] - xy[1] + 1))
+    ImageDraw.Draw(rectangle).rectangle(xy=[0, 0, rectangle.size[0] - 1, rectangle.size[1] - 1], fill=fill)
+    rectangle = Image.blend(Image.new('RGBA', rectangle.size), rectangle, alpha)
+    return alpha_composite_at(composition, rectangle, xy[0:2])
+
+
+def compile_text_layer(spec):
+    for field in ['text', 'position', 'font', 'size', 'fill']:
+        if field not in spec:
+            raise TemplateError('Text layer without {0}.'.format(field))
+    if spec.get('align', 'left') not in ['left', 'right', 'center', 'middle']:
+        raise TemplateError('Unknown text align {0}.'.format(spec['align']))
+    return draw_text_layer, True
+
+
+def compile_image_layer(spec):
+    for field in ['image', 'position']:
+        if field not in spec:
+            raise TemplateError('Image layer without {0}.'.format(field))
+    if spec.get('anchor', 'center') not in ['center', 'topleft']:
+        raise TemplateError('Unknown image anchor {0}.'.format(spec['anchor']))
+    return draw_image_layer, False
+
+
+def compile_rectangle_layer(spec):
+    for field in ['xy', 'fill']:
+        if field not in spec:
+            raise TemplateError('Rectangle layer without {0}.'.format(field))
+    return draw_rectangle_layer, spec.get('alpha', None) is None
+
+
+LAYER_COMPILERS = {
+    'text': compile_text_layer,
+    'image': compile_image_layer,
+    'rectangle': compile_rectangle_layer,
+}
+
+
+def compile_layer(spec):
+    """Compile the spec of a layer.
+
+    Args:
+        spec: Dict describing the layer, its `type` is one of `LAYER_COMPILERS`.
+    Returns:
+        `CompiledLayer` of the spec.
+    """
+    compiler = LAYER_COMPILERS.get(spec.get('type', None), None)
+    if compiler is None:
+        raise TemplateError('Unknown layer type {0}.'.format(spec.get('type', None)))
+    draw, drawable = compiler(spec)
+    static = not is_bound(spec) and 'variants' not in spec
+    return CompiledLayer(draw, spec, static, drawable)
+
+
+def resolve_layer(spec, data):
+    """Apply the variant of a layer matching the data, then bind the data."""
+    variants = spec.get('variants', None)
+    if variants is not None:
+        key = bind('{' + variants['bind'] + '}', data)
+        spec = dict(spec, **variants['values'].get(key, {}))
+        del spec['variants']
+    return bind(spec, data)
+
+
+class Overlay:
+    """Consecutive static layers pre-rasterized on a transparent image.
+
+    ImageDraw blends every channel with the coverage of the shapes, so drawing on a transparent image gives
+    the premultiplied result of the layers. Blending it on an opaque composition is then
+    `composition * (1 - alpha) + overlay`, equal to drawing the layers directly on the composition.
+
+    Attributes:
+        layers: List of `CompiledLayer` drawn in the overlay.
+        box: Bounding box of the overlay in the composition, None if empty.
+        image: Premultiplied RGBA `Image` of the overlay, cropped to its box.
+        mask: Alpha of the overlay, cropped to its box.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+        self.box = None
+        self.image = None
+        self.mask = None
+
+    def rasterize(self, size, colors):
+        overlay = Image.new('RGBA', size)
+        for layer in self.layers:
+            layer.draw(overlay, layer.spec, colors)
+        self.box = overlay.getbbox()
+        if self.box is not None:
+            self.image = overlay.crop(self.box)
+            self.mask = self.image.getchannel('A')
+
+    def draw(self, composition):
+        if self.box is None:
+            return composition
+        region = composition.crop(self.box)
+        region = Image.composite(Image.new('RGBA', region.size), region, self.mask)
+        composition.paste(ImageChops.add(region, self.image), self.box[0:2])
+        return composition
+
+
+class RenderPlan:
+    """Compiled template, ready to render images.
+
+    The background and the static layers before the first layer bound to the data are rasterized once
+    in a base image. Following static layers are grouped in pre-rasterized overlays when possible.
+    Rendering copies the base image and only draws the bound layers and the overlays on it.
+
+    Attributes:
+        key: Key of the template.
+        version: Hash of the template file, part of the render cache key of the images.
+        output: Format of the name of the generated images.
+        fields: Fields of the data given by a payload, None if the template is only rendered by a generator.
+        encoding: Name of the output preset of the images, None for the default one.
+        background: Path components of the background image.
+        base_layers: Static layers drawn in the base image.
+        steps: List of `CompiledLayer` or `Overlay` drawn at each render.
+        base: Cached base image, rasterized on the first render.
+    """
+
+    def __init__(self, key, template, colors, version=''):
+        self.key = key
+        self.version = version
+        self.colors = colors
+        self.output = template.get('output', key)
+        self.fields = template.get('fields', None)
+        if self.fields is not None and (not isinstance(self.fields, list) or
+                                        any(not isinstance(field, str) for field in self.fields)):
+            raise TemplateError('Fields of template {0} are not a list of names.'.format(key))
+        self.encoding = template.get('encoding', None)
+        if self.encoding is not None and not is_encoding(self.encoding):
+            raise TemplateError('Unknown encoding {0} in template {1}.'.format(self.encoding, key))
+        self.background = template.get('background', None)
+        if self.background is None:
+            raise TemplateError('Template {0} without background.'.format(key))
+        self.base_layers = []
+        self.steps = []
+        self.base = None
+        self.lock = threading.Lock()
+
+        overlay = None
+        for spec in template.get('layers', []):
+            layer = compile_layer(spec)
+            if len(self.steps) == 0 and layer.static:
+                self.base_layers.append(layer)
+            elif layer.static and layer.drawable:
+                if overlay is None:
+                    overlay = Overlay([])
+                    self.steps.append(overlay)
+                overlay.layers.append(layer)
+            else:
+                overlay = None
+                self.steps.append(layer)
+
+    def prepare(self):
+        """Rasterize the base image and the overlays, only done once."""
+        with self.lock:
+            if self.base is not None:
+                return
+            base = asset_cache.image(self.background).copy()
+            for layer in self.base_layers:
+                base = layer.draw(base, layer.spec, self.colors)
+            for step in self.steps:
+                if isinstance(step, Overlay):
+                    step.rasterize(base.size, self.colors)
+            self.base = base
+
+    def name(self, data):
+        """Name of the image generated with the data, without separators so it stays in the output directory."""
+        return check_path_part(bind(self.output, data))
+
+    def render(self, data):
+        """Render an image of the template.
+
+        Args:
+            data: Dict of the values bound in the template.
+        Returns:
+            Tuple (name, RGBA `Image`) of the generated image.
+        """
+        self.prepare()
+        composition = self.base.copy()
+        for step in self.steps:
+            if isinstance(step, Overlay):
+                composition = step.draw(composition)
+            else:
+                composition = step.draw(composition, resolve_layer(step.spec, data), self.colors)
+        return self.name(data), composition
+
+
+class TemplateEngine:
+    """Load the JSON templates of the stats images and keep their render plans.
+
+    A template is reloaded and compiled again when its file changes.
+
+    Attributes:
+        directory: Directory of the `<key>.json` templates.
+        colors: Named colors usable in the templates.
+        plans: Dict key -> (file modification time, `RenderPlan`).
+    """
+
+    def __init__(self, colors, directory=TEMPLATES_PATH):
+        self.directory = directory
+        self.colors = colors
+        self.plans = {}
+        self.lock = threading.Lock()
+
+    def has(self, key):
+        return os.path.basename(key) == key and os.path.isfile(self._path(key))
+
+    def keys(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def get(self, key):
+        """Get the render plan of a template.
+
+        Args:
+            key: Key of the template.
+        Returns:
+            `RenderPlan` of the template.
+        """
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            raise TemplateError('Template {0} does not exist.'.format(key))
+        with self.lock:
+            cached = self.plans.get(key, None)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(path, 'rb') as template_file:
+                content = template_file.read()
+            try:
+                template = json.loads(content.decode('utf-8'))
+            except ValueError as e:
+                raise TemplateError('Template {0} is not a valid JSON: {1}'.format(key, e))
+            plan = RenderPlan(key, template, self.colors, hashlib.sha1(content).hexdigest())
+            self.plans[key] = (mtime, plan)
+            logging.info('Image template {0} compiled: {1} static layers, {2} steps.'.format(
+                key, len(plan.base_layers), len(plan.steps)))
+            return plan
+
+    def render(self, key, data):
+        return self.get(key).render(data)
+
+    def _path(self, key):
+        if os.path.basename(key) != key:
+            raise TemplateError('Invalid template key {0}.'.format(key))
+        return os.path.join(self.directory, key + '.json')
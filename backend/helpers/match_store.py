@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import fcntl
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+
+import requests
+
+OPENDOTA_MATCH_URL = 'https://api.opendota.com/api/matches/{0}'
+
+# Fields of the OpenDota matches used by the renderers, the others are dropped before storing.
+MATCH_FIELDS = ['match_id', 'version', 'duration', 'radiant_win', 'radiant_team_id', 'dire_team_id',
+                'radiant_gold_adv', 'radiant_xp_adv', 'objectives', 'players']
+PLAYER_FIELDS = ['player_slot', 'account_id', 'hero_id', 'kills', 'deaths', 'assists', 'hero_damage',
+                 'item_0', 'item_1', 'item_2', 'item_3', 'item_4', 'item_5', 'purchase_log']
+OBJECTIVE_FIELDS = ['type', 'key', 'team', 'time', 'slot']
+PURCHASE_FIELDS = ['key', 'time']
+
+# Byte ranges of the shared lock file, matches hashed to the same range are fetched one after the other.
+LOCK_SLOTS = 65536
+
+
+def trim_match(match):
+    """Keep only the fields of an OpenDota match used by the renderers.
+
+    Args:
+        match: Match JSON from OpenDota.
+    Returns:
+        Trimmed match JSON.
+    """
+    def pick(values, fields):
+        return {field: values[field] for field in fields if field in values}
+
+    trimmed = pick(match, MATCH_FIELDS)
+    trimmed['objectives'] = [pick(objective, OBJECTIVE_FIELDS) for objective in match.get('objectives', None) or []]
+    trimmed['players'] = []
+    for player in match.get('players', []):
+        trimmed_player = pick(player, PLAYER_FIELDS)
+        trimmed_player['purchase_log'] = [pick(purchase, PURCHASE_FIELDS)
+                                          for purchase in player.get('purchase_log', None) or []]
+        trimmed['players'].append(trimmed_player)
+    return trimmed
+
+
+class MatchStore:
+    """Store of the parsed OpenDota matches, shared by all the processes.
+
+    Matches are downloaded once, even by concurrent requests: a lock per match id serializes the threads
+    of a process and a byte range lock per match id, in a single lock file, serializes the processes.
+    They are stored trimmed and gzipped, written atomically, and the most recently used ones are kept
+    parsed in memory.
+
+    Attributes:
+        directory: Directory of the stored matches.
+        size: Number of parsed matches kept in memory.
+        timeout: Seconds to wait for OpenDota.
+        matches: LRU dict match id -> trimmed match JSON.
+    """
+
+    def __init__(self, directory, size=32, timeout=10):
+        self.directory = directory
+        self.size = size
+        self.timeout = timeout
+        self.matches = OrderedDict()
+        self.fetching = {}
+        self.lock = threading.Lock()
+        self.lock_file = None
+        self.lock_file_pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, match_id):
+        """Get a parsed match, downloading it from OpenDota if needed.
+
+        Args:
+            match_id: Id of the match.
+        Returns:
+            Trimmed match JSON, None if the match is not available or not parsed yet by OpenDota.
+        """
+        match_id = str(match_id)
+        match = self._get_memory(match_id)
+        if match is not None:
+            return match
+
+        # Single flight per match id inside the process.
+        with self.lock:
+            match_lock = self.fetching.setdefault(match_id, threading.Lock())
+        with match_lock:
+            match = self._get_memory(match_id)
+            if match is None:
+                match = self._load_or_fetch(match_id)
+                if match is not None:
+                    self._set_memory(match_id, match)
+        with self.lock:
+            self.fetching.pop(match_id, None)
+        return match
+
+    def path(self, match_id):
+        return os.path.join(self.directory, 'post_game-{0}.json.gz'.format(match_id))
+
+    def _load_or_fetch(self, match_id):
+        # Single flight per match id between the processes.
+        lock_file = self._get_lock_file()
+        slot = zlib.crc32(match_id.encode('utf-8')) % LOCK_SLOTS
+        fcntl.lockf(lock_file, fcntl.LOCK_EX, 1, slot)
+        try:
+            match = self._load(match_id)
+            if match is not None:
+                return match
+
+            match = self._fetch(match_id)
+            if match is not None:
+                self._write(match_id, match)
+            return match
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN, 1, slot)
+
+    def _get_lock_file(self):
+        """Open the lock file once per process, closing a descriptor releases all the locks of the process."""
+        with self.lock:
+            if self.lock_file is None or self.lock_file_pid != os.getpid():
+                self.lock_file = open(os.path.join(self.directory, 'post_game.lock'), 'a')
+                self.lock_file_pid = os.getpid()
+            return self.lock_file
+
+    def _load(self, match_id):
+        try:
+            with gzip.open(self.path(match_id), 'rt', encoding='utf-8') as match_file:
+                return json.load(match_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning('Stored match {0} is corrupted: {1}'.format(match_id, e))
+            return None
+
+        # Matches stored by the previous versions, uncompressed and untrimmed.
+        legacy_path = os.path.join(self.directory, 'post_game-{0}.json'.format(match_id))
+        if not os.path.isfile(legacy_path):
+            return None
+        try:
+            with open(legacy_path, 'r') as match_file:
+                match = json.load(match_file)
+        except ValueError:
+            match = None
+        os.remove(legacy_path)
+        if match is None or match.get('version', None) is None:
+            return None
+        match = trim_match(match)
+        self._write(match_id, match)
+        return match
+
+    def _fetch(self, match_id):
+        try:
+            r = requests.get(OPENDOTA_MATCH_URL.format(match_id), timeout=self.timeout)
+        except requests.RequestException as e:
+            logging.warning('OpenDota match {0} download failed: {1}'.format(match_id, e))
+            return None
+        if r.status_code != 200:
+            return None
+
+        try:
+            match = r.json()
+        except ValueError as e:
+            logging.warning('OpenDota match {0} is not a valid JSON: {1}'.format(match_id, e))
+            return None
+        if not isinstance(match, dict) or match.get('version', None) is None:
+            return None
+        return trim_match(match)
+
+    def _write(self, match_id, match):
+        path = self.path(match_id)
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as match_file:
+            json.dump(match, match_file, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def _get_memory(self, match_id):
+        with self.lock:
+            match = self.matches.get(match_id, None)
+            if match is not None:
+                self.matches.move_to_end(match_id)
+            return match
+
+    def _set_memory(self, match_id, match):
+        with self.lock:
+            self.matches[match_id] = match
+            self.matches.move_to_end(match_id)
+            while len(self.matches) > self.size:
+                self.matches.popitem(last=False)
+
+
+def get_match_store(app):
+    """Get the OpenDota match store of the Flask app, created on first use.
+
+    Args:
+        app: Flask app to access config where the JSON_CACHE_PATH is stored.
+    Returns:
+        `MatchStore` of the app.
+    """
+    store = app.extensions.get('match_store', None)
+    if store is None:
+        store = MatchStore(app.config['JSON_CACHE_PATH'], app.config.get('OPENDOTA_MATCH_CACHE_SIZE', 32))
+        app.extensions['match_store'] = store
+    return store
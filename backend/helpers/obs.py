@@ -1,5 +1,407 @@
 import websocket
+import itertools
 import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+OBS_WEBSOCKET_URL = 'ws://127.0.0.1:4444'
+
+
+class OBSError(Exception):
+    """Raised when OBS can't be reached or does not answer a request."""
+    pass
+
+
+class OBSPendingRequest:
+    """A request sent to OBS and waiting for its answer.
+
+    Attributes:
+        message_id: Unique id of the request on the connection.
+        result: JSON answer from OBS once received.
+        error: Exception to raise to the caller if the request failed.
+        discard: Callable taking the message id, called when the caller gives up waiting.
+    """
+
+    def __init__(self, message_id, discard=None):
+        self.message_id = message_id
+        self.result = None
+        self.error = None
+        self.discard = discard
+        self.event = threading.Event()
+
+    def resolve(self, result):
+        self.result = result
+        self.event.set()
+
+    def fail(self, error):
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout):
+        """Block until the answer is received.
+
+        Args:
+            timeout: Seconds to wait before giving up.
+        Returns:
+            JSON Answer from the WebSocket.
+        """
+        if not self.event.wait(timeout):
+            if self.discard is not None:
+                self.discard(self.message_id)
+            raise OBSError('No answer from OBS to request {0}.'.format(self.message_id))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class OBSClient:
+    """Long lived connection to the OBS WebSocket, shared by every caller of a process.
+
+    Each request is tagged with a unique message id. A reader thread dispatches the answers
+    to the waiting callers, so several requests can be in flight on the same socket.
+    The socket is opened on the first request, and opened again on the next request after a failure.
+    Events pushed by OBS are given to the registered listeners, from the reader thread.
+
+    Attributes:
+        url: WebSocket url of OBS.
+        timeout: Seconds to wait for the connection or an answer.
+        generation: Number of connections opened so far, to detect reconnections.
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.ws = None
+        self.generation = 0
+        self.pending = {}
+        self.listeners = []
+        self.message_ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.send_lock = threading.Lock()
+
+    def connect(self):
+        """Open the WebSocket if it is not already opened and start the reader thread.
+
+        Requests still pending from a previous connection will never be answered, they are failed.
+        """
+        with self.lock:
+            if self.ws is not None:
+                return
+            stale = self.pending
+            self.pending = {}
+            for request in stale.values():
+                request.fail(OBSError('Connection to OBS reopened before the answer.'))
+            ws = websocket.WebSocket()
+            ws.connect(self.url, timeout=self.timeout)
+            ws.settimeout(None)
+            self.ws = ws
+            self.generation += 1
+            reader = threading.Thread(target=self._read, args=(ws,), name='obs-reader')
+            reader.daemon = True
+            reader.start()
+
+    @property
+    def connected(self):
+        return self.ws is not None
+
+    def add_listener(self, listener):
+        """Register a callback receiving every event sent by OBS.
+
+        The callback is run in the reader thread, it must not wait for an OBS answer.
+
+        Args:
+            listener: Function taking the JSON event as its only argument.
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+    def close(self):
+        """Close the WebSocket, failing all the requests still waiting for an answer."""
+        with self.lock:
+            ws = self.ws
+        if ws is not None:
+            self._connection_lost(ws, OBSError('Connection to OBS closed.'))
+
+    def send_request(self, command, options):
+        """Send a request to OBS and wait for its answer.
+
+        Args:
+            command: String command to send to OBS.
+            options: JSON options added to the command.
+        Returns:
+            JSON Answer from the WebSocket.
+        """
+        return self.send_request_async(command, options).wait(self.timeout)
+
+    def send_request_async(self, command, options):
+        """Send a request to OBS without waiting for its answer.
+
+        The request is sent again on a fresh connection if the current one is broken.
+
+        Args:
+            command: String command to send to OBS.
+            options: JSON options added to the command.
+        Returns:
+            `OBSPendingRequest` to wait on.
+        """
+        message_id = str(next(self.message_ids))
+        payload = dict(options)
+        payload['message-id'] = message_id
+        payload['request-type'] = command
+        message = json.dumps(payload)
+
+        pending = OBSPendingRequest(message_id, self._discard)
+        for attempt in range(0, 2):
+            try:
+                self.connect()
+            except Exception as e:
+                raise OBSError('Impossible to connect to OBS: {0}'.format(e))
+            with self.lock:
+                ws = self.ws
+                self.pending[message_id] = pending
+            try:
+                with self.send_lock:
+                    ws.send(message)
+                return pending
+            except Exception as e:
+                with self.lock:
+                    self.pending.pop(message_id, None)
+                self._connection_lost(ws, OBSError('Connection to OBS lost: {0}'.format(e)))
+        raise OBSError('Impossible to send request {0} to OBS.'.format(command))
+
+    def _discard(self, message_id):
+        """Forget a request the caller stopped waiting for."""
+        with self.lock:
+            self.pending.pop(message_id, None)
+
+    def _read(self, ws):
+        """Reader thread loop, dispatching answers to the pending requests.
+
+        Args:
+            ws: WebSocket to read from.
+        """
+        while True:
+            try:
+                message = ws.recv()
+            except Exception as e:
+                self._connection_lost(ws, OBSError('Connection to OBS lost: {0}'.format(e)))
+                return
+            if not message:
+                continue
+            try:
+                data = json.loads(message)
+            except ValueError:
+                logging.error('Invalid message from OBS: %s', message)
+                continue
+            self._dispatch(data)
+
+    def _dispatch(self, data):
+        """Give a message received from OBS to the request waiting for it.
+
+        Args:
+            data: JSON message from OBS.
+        """
+        message_id = data.get('message-id', None)
+        if message_id is None:
+            if 'update-type' in data:
+                for listener in list(self.listeners):
+                    try:
+                        listener(data)
+                    except Exception as e:
+                        logging.error('OBS event listener failed: %s', e)
+            return
+        with self.lock:
+            pending = self.pending.pop(message_id, None)
+        if pending is not None:
+            pending.resolve(data)
+
+    def _connection_lost(self, ws, error):
+        """Forget a broken WebSocket and fail the requests sent on it.
+
+        Args:
+            ws: WebSocket that is broken.
+            error: Exception given to the waiting callers.
+        """
+        with self.lock:
+            if self.ws is not ws:
+                return
+            self.ws = None
+            pending = self.pending
+            self.pending = {}
+        try:
+            ws.close(timeout=0)
+        except Exception:
+            pass
+        for request in pending.values():
+            request.fail(error)
+
+
+class OBSStateMirror:
+    """In memory copy of the OBS state, kept up to date with the events sent by OBS.
+
+    A watchdog thread keeps the connection opened and runs a full resync after each (re)connection,
+    or when an event can't be applied to the snapshot. Readers get the snapshot without any OBS query.
+
+    Attributes:
+        client: `OBSClient` to mirror.
+        playlist_source: Name of the OBS source holding the replay playlist.
+        interval: Seconds between two checks of the watchdog.
+    """
+
+    def __init__(self, client, playlist_source, interval=1):
+        self.client = client
+        self.playlist_source = playlist_source
+        self.interval = interval
+        self.state = {}
+        self.updated_at = None
+        self.synced_generation = None
+        self.lock = threading.Lock()
+        self.watchdog = None
+
+    def start(self):
+        """Subscribe to the OBS events and start the watchdog thread."""
+        with self.lock:
+            if self.watchdog is not None:
+                return
+            self.client.add_listener(self._on_event)
+            self.watchdog = threading.Thread(target=self._watch, name='obs-mirror')
+            self.watchdog.daemon = True
+            self.watchdog.start()
+
+    @property
+    def synced(self):
+        return self.client.connected and self.synced_generation == self.client.generation
+
+    def snapshot(self):
+        """Get a copy of the mirrored state.
+
+        Returns:
+            Dict of the OBS state with a `updated_at` ISO timestamp, None if the mirror is not synced.
+        """
+        with self.lock:
+            if not self.synced:
+                return None
+            snapshot = dict(self.state)
+            snapshot['updated_at'] = self.updated_at.isoformat() + 'Z'
+            return snapshot
+
+    def update(self, **values):
+        """Apply a change already known to be done in OBS, like a successful write request."""
+        with self.lock:
+            self.state.update(values)
+            self.updated_at = datetime.utcnow()
+
+    def resync(self):
+        """Query the full state from OBS and replace the snapshot."""
+        generation = self.client.generation
+        status, scenes, playlist = send_batch_to_obs([
+            ('GetStreamingStatus', {}),
+            ('GetSceneList', {}),
+            ('GetSourceSettings', {'sourceName': self.playlist_source})
+        ])
+        state = {
+            'streaming': status['streaming'],
+            'recording': status['recording'],
+            'scenes': [scene['name'] for scene in scenes['scenes']],
+            'active_scene': scenes['current-scene'],
+            'playlist': None
+        }
+        if playlist.get('status', None) != 'error':
+            state['playlist'] = playlist['sourceSettings'].get('playlist', None)
+        with self.lock:
+            self.state = state
+            self.updated_at = datetime.utcnow()
+            if self.client.generation == generation:
+                self.synced_generation = generation
+
+    def invalidate(self):
+        """Force a full resync on the next watchdog check."""
+        with self.lock:
+            self.synced_generation = None
+
+    def _watch(self):
+        """Watchdog thread loop, (re)connecting to OBS and resyncing the snapshot when needed."""
+        while True:
+            if not self.synced:
+                try:
+                    self.client.connect()
+                    self.resync()
+                except Exception as e:
+                    logging.debug('OBS mirror resync failed: %s', e)
+            time.sleep(self.interval)
+
+    def _on_event(self, data):
+        """Apply an event from OBS to the snapshot.
+
+        Args:
+            data: JSON event from OBS.
+        """
+        event = data['update-type']
+        if event == 'SwitchScenes':
+            self.update(active_scene=data['scene-name'])
+        elif event == 'StreamStarted':
+            self.update(streaming=True)
+        elif event == 'StreamStopped':
+            self.update(streaming=False)
+        elif event == 'RecordingStarted':
+            self.update(recording=True)
+        elif event == 'RecordingStopped':
+            self.update(recording=False)
+        elif event == 'SourceSettingsChanged':
+            if data.get('sourceName', None) != self.playlist_source:
+                return
+            if 'playlist' in data.get('sourceSettings', {}):
+                self.update(playlist=data['sourceSettings']['playlist'])
+            else:
+                self.invalidate()
+        elif event in ['ScenesChanged', 'SceneCollectionChanged']:
+            self.invalidate()
+
+
+_obs_client = None
+_obs_client_pid = None
+_obs_client_lock = threading.Lock()
+_obs_mirror = None
+_obs_mirror_pid = None
+
+
+def get_obs_client():
+    """Get the OBS client of the current process.
+
+    The web server forks workers after the routes are built, so the client is bound to a pid
+    and a new one is created in each worker.
+
+    Returns:
+        `OBSClient` of the process.
+    """
+    global _obs_client, _obs_client_pid
+    with _obs_client_lock:
+        if _obs_client is None or _obs_client_pid != os.getpid():
+            _obs_client = OBSClient(OBS_WEBSOCKET_URL)
+            _obs_client_pid = os.getpid()
+        return _obs_client
+
+
+def get_obs_mirror(playlist_source):
+    """Get the OBS state mirror of the current process, starting it on first use.
+
+    Args:
+        playlist_source: Name of the OBS source holding the replay playlist.
+    Returns:
+        `OBSStateMirror` of the process.
+    """
+    global _obs_mirror, _obs_mirror_pid
+    client = get_obs_client()
+    with _obs_client_lock:
+        if _obs_mirror is None or _obs_mirror_pid != os.getpid():
+            _obs_mirror = OBSStateMirror(client, playlist_source)
+            _obs_mirror_pid = os.getpid()
+    _obs_mirror.start()
+    return _obs_mirror
+
 
 def send_command_to_obs(command, options):
     """Send a command to obs through the WebSocket.
@@ -10,15 +412,32 @@ def send_command_to_obs(command, options):
     Returns:
         JSON Answer from the WebSocket.
     """
-    ws = websocket.WebSocket()
-    ws.connect("ws://{}:{}".format('127.0.0.1', '4444'))
+    return get_obs_client().send_request(command, options)
+
 
-    payload = options
-    payload['message-id'] = 1
-    payload['request-type'] = command
+def send_batch_to_obs(requests, abort_on_error=False):
+    """Send an ordered list of commands to obs through the WebSocket.
 
-    ws.send(json.dumps(payload))
-    result = json.loads(ws.recv())
-    ws.close()
+    All the commands are pipelined on the connection before waiting for the answers.
+    With `abort_on_error`, each command waits for the answer of the previous one instead,
+    and the remaining commands are not sent after the first OBS error.
+
+    Args:
+        requests: List of (command, options) tuples to send in order.
+        abort_on_error: Stop at the first command answered with an error.
+    Returns:
+        List of JSON Answers from the WebSocket, in the same order as the commands.
+        The list is shorter than the commands if the batch was aborted.
+    """
+    client = get_obs_client()
+    if not abort_on_error:
+        pending = [client.send_request_async(command, options) for command, options in requests]
+        return [request.wait(client.timeout) for request in pending]
 
-    return result
+    results = []
+    for command, options in requests:
+        result = client.send_request(command, options)
+        results.append(result)
+        if result.get('status', None) == 'error':
+            break
+    return results
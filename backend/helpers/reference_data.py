@@ -0,0 +1,102 @@
+from collections import namedtuple
+import logging
+import threading
+import time
+
+from models import db, DynamicConfiguration, DotaHero, DotaItem, DotaProPlayer, DotaProTeam, REFERENCE_DATA_VERSION
+
+Hero = namedtuple('Hero', ['id', 'name', 'short_name', 'localized_name'])
+Item = namedtuple('Item', ['id', 'name', 'short_name', 'localized_name'])
+ProPlayer = namedtuple('ProPlayer', ['id', 'name', 'nickname', 'team'])
+ProTeam = namedtuple('ProTeam', ['id', 'name'])
+
+
+class ReferenceData:
+    """Id indexed heroes, items, pro players and pro teams, loaded once per process.
+
+    Tables are loaded again when the reference data version, incremented by their upserts, changes.
+    The version is checked at most every `check_interval` seconds.
+
+    Attributes:
+        version: Reference data version of the loaded tables, None if not loaded.
+        heroes: Dict id -> `Hero`.
+        items: Dict id -> `Item`.
+        players: Dict account id -> `ProPlayer`.
+        teams: Dict id -> `ProTeam`.
+        team_players: Dict team id -> list of `ProPlayer` ordered by id.
+        check_interval: Minimum seconds between two checks of the version.
+    """
+
+    def __init__(self, check_interval=5):
+        self.version = None
+        self.heroes = {}
+        self.items = {}
+        self.players = {}
+        self.teams = {}
+        self.team_players = {}
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Load the tables if they changed since the last load. Needs an application context."""
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return self
+            self.checked_at = now
+            version = DynamicConfiguration.get(REFERENCE_DATA_VERSION, '0')
+            if version == self.version:
+                return self
+
+            self.heroes = {hero.id: Hero(hero.id, hero.name, hero.short_name, hero.localized_name)
+                           for hero in db.session.query(DotaHero)}
+            self.items = {item.id: Item(item.id, item.name, item.short_name, item.localized_name)
+                          for item in db.session.query(DotaItem)}
+            self.players = {}
+            self.team_players = {}
+            for player in db.session.query(DotaProPlayer).order_by(DotaProPlayer.id):
+                pro_player = ProPlayer(player.id, player.name, player.nickname, player.team)
+                self.players[player.id] = pro_player
+                self.team_players.setdefault(player.team, []).append(pro_player)
+            self.teams = {team.id: ProTeam(team.id, team.name) for team in db.session.query(DotaProTeam)}
+            self.version = version
+            logging.info('Reference data version {0} loaded: {1} heroes, {2} items, {3} players, {4} teams.'.format(
+                version, len(self.heroes), len(self.items), len(self.players), len(self.teams)))
+            return self
+
+    def hero(self, hero_id):
+        """Get a hero by id, None if unknown."""
+        return self.heroes.get(self._id(hero_id), None)
+
+    def item(self, item_id):
+        """Get an item by id, None if unknown."""
+        return self.items.get(self._id(item_id), None)
+
+    def player(self, account_id):
+        """Get a pro player by account id, None if unknown."""
+        return self.players.get(self._id(account_id), None)
+
+    def team(self, team_id):
+        """Get a pro team by id, None if unknown."""
+        return self.teams.get(self._id(team_id), None)
+
+    def players_of_team(self, team_id):
+        """Get the pro players of a team, ordered by id."""
+        return self.team_players.get(self._id(team_id), [])
+
+    @staticmethod
+    def _id(value):
+        # Ids come from JSON, CSV or Numeric columns, the tables are indexed by int.
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+
+reference_data = ReferenceData()
+
+
+def get_reference_data():
+    """Get the up to date reference data of the process. Needs an application context."""
+    return reference_data.refresh()
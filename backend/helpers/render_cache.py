@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from helpers.image_encoding import DEFAULT_ENCODING, encode_image, encoded_paths
+
+
+def link_file(source, path):
+    """Atomically make a path point to the content of source, with a hard link or a copy."""
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, path)
+
+
+class RenderCache:
+    """Content addressed cache of the generated images.
+
+    Images are stored under the hash of their inputs and their encoding, and the published files are hard links
+    to the cached ones. Generating an image whose inputs did not change only publishes the cached files again.
+
+    Attributes:
+        directory: Directory of the cached images.
+        version: Version of the rendering, change it to invalidate all the images (new assets, new layouts).
+        max_files: Maximum number of cached images, the least recently used are removed first.
+    """
+
+    def __init__(self, directory, version='', max_files=2048):
+        self.directory = directory
+        self.version = version
+        self.max_files = max_files
+        self.stores = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def digest(self, key, data):
+        """Hash the inputs of an image.
+
+        Args:
+            key: Kind of image, with the version of its layout.
+            data: JSON serializable inputs, dates and other objects are converted to strings.
+        Returns:
+            Hexadecimal digest of the inputs.
+        """
+        canonical = json.dumps([self.version, key, data], sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def path(self, digest, encoding, published_path):
+        return os.path.join(self.directory, '{0}-{1}{2}'.format(digest, encoding,
+                                                                os.path.splitext(published_path)[1]))
+
+    def publish(self, image_path, digest, encoding=DEFAULT_ENCODING):
+        """Publish the cached image of a digest, if it exists.
+
+        Args:
+            image_path: Path where the PNG image is published.
+            digest: Digest of the inputs of the image.
+            encoding: Name of the output preset, see `helpers.image_encoding`.
+        Returns:
+            True if the image was cached and is published.
+        """
+        files = [(self.path(digest, preset, path), path) for path, preset in encoded_paths(image_path, encoding)]
+        try:
+            for cached_path, path in files:
+                if not (os.path.isfile(path) and os.path.samefile(cached_path, path)):
+                    link_file(cached_path, path)
+                os.utime(cached_path)
+        except OSError:
+            return False
+        return True
+
+    def store(self, image, image_path, digest, encoding=DEFAULT_ENCODING):
+        """Cache a generated image and publish it.
+
+        Args:
+            image: Generated `Image`.
+            image_path: Path where the PNG image is published.
+            digest: Digest of the inputs of the image.
+            encoding: Name of the output preset, see `helpers.image_encoding`.
+        """
+        for path, preset in encoded_paths(image_path, encoding):
+            cached_path = self.path(digest, preset, path)
+            encode_image(image, cached_path, preset)
+            link_file(cached_path, path)
+        self.stores += 1
+        if self.stores % 64 == 0:
+            self.prune()
+
+    def prune(self):
+        """Remove the least recently used images above the maximum number of files."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.png') or name.endswith('.webp'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except OSError:
+                    pass
+        if len(entries) <= self.max_files:
+            return
+        entries.sort()
+        for _, name in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        logging.info('Render cache pruned {0} images.'.format(len(entries) - self.max_files))
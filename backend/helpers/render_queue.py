@@ -0,0 +1,354 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import fcntl
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_PENDING_STATES = [JOB_QUEUED, JOB_RUNNING]
+
+# Per process state of the render workers, set before the pool forks them.
+_worker_app = None
+_worker_pid = None
+_worker_generator = None
+_inherited_pools = []
+
+
+def render_job_id(key, payload):
+    """Deterministic id of a render job, identical for the same key and payload.
+
+    Args:
+        key: Key of the images to generate.
+        payload: Payload information for image generation.
+    Returns:
+        Hexadecimal id of the job.
+    """
+    canonical = json.dumps([key, payload], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _timestamp():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def _write_status(directory, job_id, status):
+    path = os.path.join(directory, job_id + '.json')
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'w') as status_file:
+        json.dump(status, status_file)
+    os.replace(temp_path, path)
+
+
+def _read_status(directory, job_id):
+    try:
+        with open(os.path.join(directory, job_id + '.json')) as status_file:
+            return json.load(status_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _get_worker_generator():
+    global _worker_pid, _worker_generator
+    from models import db
+    from helpers.image_gen import ImageGenerator
+
+    if _worker_pid != os.getpid():
+        # Connections inherited from the parent process can't be shared with it. Closing them (dispose) would
+        # terminate the sessions of the parent, so the worker gets a new pool and the inherited one is kept
+        # referenced, its connections are never closed nor collected in the worker.
+        with _worker_app.app_context():
+            _inherited_pools.append(db.engine.pool)
+            db.engine.pool = db.engine.pool.recreate()
+        _worker_pid = os.getpid()
+        _worker_generator = ImageGenerator(_worker_app)
+    return _worker_generator
+
+
+def run_render_job(directory, job_id, key, payload):
+    """Generate the images of a job, inside a render worker process.
+
+    The status file of the job is updated when the generation starts and ends.
+
+    Args:
+        directory: Directory of the job status files.
+        job_id: Id of the job.
+        key: Key of the images to generate.
+        payload: Payload information for image generation.
+    Returns:
+        Final status of the job.
+    """
+    from models import db
+
+    generator = _get_worker_generator()
+    status = _read_status(directory, job_id) or {'id': job_id, 'key': key, 'queued_at': _timestamp(),
+                                                 'queued_time': time.time()}
+    status['state'] = JOB_RUNNING
+    status['started_at'] = _timestamp()
+    status['started_time'] = time.time()
+    _write_status(directory, job_id, status)
+
+    try:
+        with _worker_app.app_context():
+            result = generator.generate_image(key, payload)
+            db.session.remove()
+        if result:
+            status['state'] = JOB_DONE
+            status['error'] = ''
+        else:
+            status['state'] = JOB_FAILED
+            status['error'] = 'OpenDotaNotReady' if key == 'post_game' else 'GenerationFailed'
+    except Exception as e:
+        logging.exception('Render job {0} of {1} failed.'.format(job_id, key))
+        status['state'] = JOB_FAILED
+        status['error'] = '{0}: {1}'.format(type(e).__name__, e)
+
+    status['finished_at'] = _timestamp()
+    status['finished_time'] = time.time()
+    _write_status(directory, job_id, status)
+    return status
+
+
+def run_template_task(template, data):
+    """Render one image of a bulk job from its template, inside a render worker process.
+
+    Args:
+        template: Key of the template.
+        data: Dict of the values bound in the template.
+    Returns:
+        Tuple (started time, finished time) of the render.
+    """
+    started_time = time.time()
+    _get_worker_generator().generate_template(template, data)
+    return started_time, time.time()
+
+
+class RenderQueue:
+    """Queue generating the stats images in a pool of worker processes.
+
+    Jobs are identified by their key and payload, submitting a job identical to a pending one returns
+    the pending job. The status of the jobs are stored in files, so all the server processes share them.
+
+    Attributes:
+        app: Flask application.
+        directory: Directory of the job status files.
+        workers: Number of render processes.
+        timeout: Seconds after which a pending job is considered lost and can be submitted again.
+        retention: Seconds the status of a finished job is kept.
+        executor: `ProcessPoolExecutor` running the jobs, created on first use by each process.
+    """
+
+    def __init__(self, app, directory, workers=2, timeout=300, retention=3600):
+        self.app = app
+        self.directory = directory
+        self.workers = workers
+        self.timeout = timeout
+        self.retention = retention
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_executor(self):
+        global _worker_app
+        if self.executor is None or self.pid != os.getpid():
+            _worker_app = self.app
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('fork'))
+            self.pid = os.getpid()
+        return self.executor
+
+    def submit(self, key, payload):
+        """Submit a render job, unless an identical job is already pending.
+
+        Args:
+            key: Key of the images to generate.
+            payload: Payload information for image generation.
+        Returns:
+            Status of the job.
+        """
+        job_id = render_job_id(key, payload)
+        status, pending = self._create(job_id, key)
+        if pending:
+            return status
+
+        future = self.get_executor().submit(run_render_job, self.directory, job_id, key, payload)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return self._describe(status)
+
+    def submit_bulk(self, key, payload, prepare):
+        """Submit a job rendering many images in parallel, unless an identical job is already pending.
+
+        The data of the images is prepared once by the calling process, then each image is rendered
+        from its template by the first free worker. The status of the job reports the result of each image.
+
+        Args:
+            key: Key of the images to generate.
+            payload: Payload information for image generation.
+            prepare: Function returning the list of (id, template key, template data) to render.
+        Returns:
+            Status of the job.
+        """
+        job_id = render_job_id(key, payload)
+        status, pending = self._create(job_id, key)
+        if pending:
+            return status
+
+        try:
+            tasks = prepare()
+        except Exception as e:
+            logging.exception('Render job {0} of {1} failed to prepare.'.format(job_id, key))
+            tasks = []
+            status['error'] = '{0}: {1}'.format(type(e).__name__, e)
+
+        status['results'] = {name: {'state': JOB_QUEUED, 'error': '', 'render_time': None}
+                             for name, _, _ in tasks}
+        if len(tasks) == 0:
+            status['state'] = JOB_FAILED if status['error'] else JOB_DONE
+            status['finished_at'] = _timestamp()
+            status['finished_time'] = time.time()
+        _write_status(self.directory, job_id, status)
+
+        executor = self.get_executor()
+        for name, template, data in tasks:
+            future = executor.submit(run_template_task, template, data)
+            future.add_done_callback(lambda f, name=name: self._on_task_done(job_id, name, f))
+        return self._describe(status)
+
+    def status(self, job_id):
+        """Get the status of a job.
+
+        Pending jobs older than the timeout are reported as failed.
+
+        Args:
+            job_id: Id of the job.
+        Returns:
+            Dict with the id, key, state, error and timings of the job, None if unknown.
+        """
+        status = _read_status(self.directory, job_id)
+        if status is None:
+            return None
+        if status['state'] in JOB_PENDING_STATES and time.time() - status['queued_time'] > self.timeout:
+            status['state'] = JOB_FAILED
+            status['error'] = 'Timeout'
+        return self._describe(status)
+
+    def _create(self, job_id, key):
+        # Returns the status of the new job, or the status of the identical pending job.
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            status = self.status(job_id)
+            if status is not None and status['state'] in JOB_PENDING_STATES:
+                return status, True
+
+            status = {'id': job_id,
+                      'key': key,
+                      'state': JOB_QUEUED,
+                      'error': '',
+                      'queued_at': _timestamp(),
+                      'queued_time': time.time()}
+            _write_status(self.directory, job_id, status)
+        self.cleanup()
+        return status, False
+
+    def cleanup(self):
+        """Remove the status of the jobs finished since longer than the retention."""
+        limit = time.time() - self.retention
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _on_done(self, job_id, future):
+        # The job function reports its own errors, only a crash of the worker reaches this point.
+        error = future.exception()
+        if error is None:
+            return
+        logging.error('Render worker of job {0} crashed: {1}'.format(job_id, error))
+        status = _read_status(self.directory, job_id) or {'id': job_id, 'queued_time': time.time()}
+        status['state'] = JOB_FAILED
+        status['error'] = '{0}: {1}'.format(type(error).__name__, error)
+        status['finished_at'] = _timestamp()
+        status['finished_time'] = time.time()
+        _write_status(self.directory, job_id, status)
+
+    def _on_task_done(self, job_id, name, future):
+        # Only the process which submitted a bulk job updates its status, the lock serializes the callbacks.
+        with self.lock:
+            status = _read_status(self.directory, job_id)
+            if status is None:
+                return
+            result = status['results'][name]
+            error = future.exception()
+            if error is None:
+                started_time, finished_time = future.result()
+                result['state'] = JOB_DONE
+                result['render_time'] = round(finished_time - started_time, 3)
+                status['started_time'] = min(status.get('started_time', started_time), started_time)
+            else:
+                logging.error('Render of {0} in job {1} failed: {2}'.format(name, job_id, error))
+                result['state'] = JOB_FAILED
+                result['error'] = '{0}: {1}'.format(type(error).__name__, error)
+
+            if 'started_at' not in status:
+                status['started_at'] = _timestamp()
+            if status['state'] == JOB_QUEUED:
+                status['state'] = JOB_RUNNING
+            results = status['results'].values()
+            if all(result['state'] not in JOB_PENDING_STATES for result in results):
+                failed = len([result for result in results if result['state'] == JOB_FAILED])
+                status['state'] = JOB_FAILED if failed == len(results) else JOB_DONE
+                status['error'] = '' if failed == 0 else '{0}/{1} images failed'.format(failed, len(results))
+                status['finished_at'] = _timestamp()
+                status['finished_time'] = time.time()
+            _write_status(self.directory, job_id, status)
+
+    @staticmethod
+    def _describe(status):
+        description = {'id': status['id'],
+                       'key': status.get('key', ''),
+                       'state': status['state'],
+                       'error': status.get('error', ''),
+                       'queued_at': status.get('queued_at', None),
+                       'started_at': status.get('started_at', None),
+                       'finished_at': status.get('finished_at', None),
+                       'wait_time': None,
+                       'render_time': None}
+        if 'started_time' in status:
+            description['wait_time'] = round(status['started_time'] - status['queued_time'], 3)
+            if 'finished_time' in status:
+                description['render_time'] = round(status['finished_time'] - status['started_time'], 3)
+        if 'results' in status:
+            description['results'] = status['results']
+        return description
+
+
+def get_render_queue(app):
+    """Get the render queue of the Flask app, created on first use.
+
+    Args:
+        app: Flask app to access config where the IMG_RENDER_* settings are stored.
+    Returns:
+        `RenderQueue` of the app.
+    """
+    queue = app.extensions.get('render_queue', None)
+    if queue is None:
+        directory = app.config.get('IMG_RENDER_JOBS_PATH', None) or \
+                    os.path.join(app.config['IMG_GENERATE_PATH'], 'render_jobs')
+        queue = RenderQueue(app, directory,
+                            app.config.get('IMG_RENDER_WORKERS', 2),
+                            app.config.get('IMG_RENDER_JOB_TIMEOUT', 300))
+        app.extensions['render_queue'] = queue
+    return queue
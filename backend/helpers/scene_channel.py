@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from select import select
+
+from helpers.dynamic_config import dynamic_config, get_dynamic_config
+from models import db
+
+
+class SceneChannel:
+    """In memory state of the public stat scene, broadcast to the connected overlays on each change.
+
+    A watcher thread per process keeps the state up to date with the changes made by the other processes.
+    With Postgres it listens to the `stats_scene` channel, notified by a trigger when a scene key of the
+    dynamic configuration changes, and reloads the state on each notification or every `reload_interval`
+    seconds. Other databases are polled every `interval` seconds, once per process whatever the number of
+    overlays. The image modification time is checked every `interval` seconds.
+
+    Attributes:
+        app: Flask app of the database and the IMG_GENERATE_PATH.
+        interval: Seconds between two checks of the watcher.
+        reload_interval: Seconds between two full reloads when listening to Postgres.
+        pid: Process owning the watcher thread.
+        state: Dict payload of the scene, None if not loaded yet.
+        etag: Hash of the state, identical in all the processes for the same state.
+        listeners: Callables called with (etag, state) on each change, from any thread.
+    """
+
+    def __init__(self, app, interval=1, reload_interval=60):
+        self.app = app
+        self.interval = interval
+        self.reload_interval = reload_interval
+        self.pid = os.getpid()
+        self.state = None
+        self.etag = None
+        self.listeners = []
+        self.connection = None
+        self.lock = threading.Lock()
+        self.watcher = None
+
+    def start(self):
+        """Start the watcher thread."""
+        with self.lock:
+            if self.watcher is not None:
+                return
+            self.watcher = threading.Thread(target=self._watch, name='stats-scene')
+            self.watcher.daemon = True
+            self.watcher.start()
+
+    def snapshot(self):
+        """Get the current state, loaded from the database on first use. Needs an application context.
+
+        Returns:
+            Tuple (etag, dict payload of the scene).
+        """
+        if self.state is None:
+            self.reload()
+        self.start()
+        with self.lock:
+            return self.etag, self.state
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def update(self, **values):
+        """Apply a change already committed to the database by this process, without reloading."""
+        with self.lock:
+            state = dict(self.state) if self.state is not None else None
+        if state is None:
+            self.reload()
+            return
+        state.update(values)
+        self._set(state)
+
+    def reload(self, changed=False):
+        """Load the state from the dynamic configuration. Needs an application context.
+
+        Args:
+            changed: True if the database notified a change, the dynamic configuration is checked immediately.
+        """
+        if changed:
+            dynamic_config.invalidate()
+        config = get_dynamic_config()
+        img = config.get('stats_scene', 'empty')
+        self._set({'continue': config.get_bool('stats_scene_status'),
+                   'img': img,
+                   'last_modified': self._last_modified(img)})
+
+    def refresh_image(self):
+        """Check the modification time of the scene image, after a new generation."""
+        with self.lock:
+            state = dict(self.state) if self.state is not None else None
+        if state is None:
+            return
+        last_modified = self._last_modified(state['img'])
+        if last_modified != state['last_modified']:
+            state['last_modified'] = last_modified
+            self._set(state)
+
+    def _last_modified(self, img):
+        path_file = os.path.join(self.app.config['IMG_GENERATE_PATH'], img + '.png')
+        try:
+            return os.path.getmtime(path_file)
+        except OSError:
+            return ''
+
+    def _set(self, state):
+        with self.lock:
+            if state == self.state:
+                return
+            canonical = json.dumps(state, sort_keys=True, separators=(',', ':'))
+            self.state = state
+            self.etag = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+            etag = self.etag
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(etag, state)
+            except Exception as e:
+                logging.error('Stats scene listener failed: {0}'.format(e))
+
+    def _watch(self):
+        """Watcher thread loop, reloading the state on the changes of the other processes."""
+        waited = 0
+        while True:
+            try:
+                changed = self._wait()
+            except Exception as e:
+                logging.error('Stats scene LISTEN connection failed: {0}'.format(e))
+                self._close()
+                time.sleep(self.interval)
+                changed = True
+            waited = 0 if changed else waited + self.interval
+            try:
+                with self.app.app_context():
+                    if changed or waited >= self.reload_interval:
+                        waited = 0
+                        self.reload(changed)
+                    else:
+                        self.refresh_image()
+            except Exception as e:
+                logging.error('Stats scene reload failed: {0}'.format(e))
+
+    def _wait(self):
+        """Wait for the next check.
+
+        Returns:
+            True if the dynamic configuration may have changed and the state must be reloaded.
+        """
+        if self.connection is None:
+            with self.app.app_context():
+                if db.engine.dialect.name != 'postgresql':
+                    time.sleep(self.interval)
+                    return True
+                raw = db.engine.raw_connection()
+            raw.detach()
+            connection = raw.connection
+            connection.autocommit = True
+            # Only notified for the scene keys of the dynamic configuration.
+            connection.cursor().execute('LISTEN stats_scene;')
+            self.connection = connection
+            # Changes made before listening are unknown.
+            return True
+
+        readable, _, _ = select([self.connection], [], [], self.interval)
+        if len(readable) == 0:
+            return False
+        self.connection.poll()
+        changed = len(self.connection.notifies) > 0
+        del self.connection.notifies[:]
+        return changed
+
+    def _close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+def get_scene_channel(app):
+    """Get the stat scene channel of the Flask app for the current process, created on first use.
+
+    The web server forks workers after the routes are built, so the channel is bound to a pid.
+
+    Args:
+        app: Flask app to access config where the STATS_SCENE_* settings are stored.
+    Returns:
+        `SceneChannel` of the process.
+    """
+    channel = app.extensions.get('scene_channel', None)
+    if channel is None or channel.pid != os.getpid():
+        channel = SceneChannel(app,
+                               app.config.get('STATS_SCENE_POLL_INTERVAL', 1),
+                               app.config.get('STATS_SCENE_RELOAD_INTERVAL', 60))
+        app.extensions['scene_channel'] = channel
+    return channel
@@ -0,0 +1,53 @@
+"""10/ Notify the stat scene on scene changes
+
+Revision ID: 3d9b6f1e0c27
+Revises: 5a0c8e4d9f12
+Create Date: 2018-08-30 19:42:08.517364
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d9b6f1e0c27'
+down_revision = '5a0c8e4d9f12'
+
+from alembic import op
+import sqlalchemy as sa
+
+SCENE_KEYS = ['stats_scene', 'stats_scene_status']
+
+
+def upgrade():
+    # LISTEN/NOTIFY only exists with Postgres, other databases use polling.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_stats_scene() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('stats_scene', OLD.key);
+            ELSE
+                PERFORM pg_notify('stats_scene', NEW.key);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    keys = ', '.join("'{0}'".format(key) for key in SCENE_KEYS)
+    op.execute("""
+        CREATE TRIGGER dynamic_configuration_notify_stats_scene_write
+        AFTER INSERT OR UPDATE ON dynamic_configuration
+        FOR EACH ROW WHEN (NEW.key IN ({0})) EXECUTE PROCEDURE notify_stats_scene();
+    """.format(keys))
+    op.execute("""
+        CREATE TRIGGER dynamic_configuration_notify_stats_scene_delete
+        AFTER DELETE ON dynamic_configuration
+        FOR EACH ROW WHEN (OLD.key IN ({0})) EXECUTE PROCEDURE notify_stats_scene();
+    """.format(keys))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP TRIGGER IF EXISTS dynamic_configuration_notify_stats_scene_write ON dynamic_configuration;')
+    op.execute('DROP TRIGGER IF EXISTS dynamic_configuration_notify_stats_scene_delete ON dynamic_configuration;')
+    op.execute('DROP FUNCTION IF EXISTS notify_stats_scene();')
@@ -0,0 +1,44 @@
+"""6/ Notify the bot manager on game changes
+
+Revision ID: 8c1e5d2b7a43
+Revises: 617868c21f72
+Create Date: 2018-08-20 21:12:40.318204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5d2b7a43'
+down_revision = '617868c21f72'
+
+from alembic import op
+import sqlalchemy as sa
+
+NOTIFIED_TABLES = ['game', 'game_vip', 'dynamic_configuration']
+
+
+def upgrade():
+    # LISTEN/NOTIFY only exists with Postgres, other databases use polling.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_bot_manager() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('bot_manager', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in NOTIFIED_TABLES:
+        op.execute("""
+            CREATE TRIGGER {0}_notify_bot_manager
+            AFTER INSERT OR UPDATE OR DELETE ON {0}
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_bot_manager();
+        """.format(table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in NOTIFIED_TABLES:
+        op.execute('DROP TRIGGER IF EXISTS {0}_notify_bot_manager ON {0};'.format(table))
+    op.execute('DROP FUNCTION IF EXISTS notify_bot_manager();')
@@ -0,0 +1,94 @@
+"""8/ Store CSV data as indexed rows
+
+Revision ID: e7f3c2a18b90
+Revises: b4d27a9e5c16
+Create Date: 2018-08-27 20:14:51.203816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7f3c2a18b90'
+down_revision = 'b4d27a9e5c16'
+
+from alembic import op
+import sqlalchemy as sa
+import csv
+from io import StringIO
+
+# Same defaults as the CSV_KEY_COLUMNS configuration, other CSVs are keyed by their first column.
+KEY_COLUMNS = {'preti8_teams': 'teamid', 'preti8_players': 'playerid', 'ti8_groups': 'teamid'}
+
+csv_data = sa.table('csv_data',
+                    sa.column('key', sa.String()),
+                    sa.column('value', sa.Text()),
+                    sa.column('header', sa.JSON()),
+                    sa.column('key_column', sa.String()))
+csv_row = sa.table('csv_row',
+                   sa.column('key', sa.String()),
+                   sa.column('row_key', sa.String()),
+                   sa.column('position', sa.Integer()),
+                   sa.column('values', sa.JSON()))
+
+
+def upgrade():
+    op.create_table('csv_row',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('row_key', sa.String(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('values', sa.JSON(), nullable=False),
+    sa.ForeignKeyConstraint(['key'], ['csv_data.key'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('key', 'row_key')
+    )
+    op.add_column('csv_data', sa.Column('header', sa.JSON(), nullable=True))
+    op.add_column('csv_data', sa.Column('key_column', sa.String(), nullable=True))
+
+    # Parse the stored CSVs into rows
+    connection = op.get_bind()
+    for key, value in connection.execute(sa.select([csv_data.c.key, csv_data.c.value])).fetchall():
+        rows = [row for row in csv.reader(StringIO(value), delimiter=',') if len(row) > 0]
+        header = rows[0] if len(rows) > 0 else ['']
+        key_column = KEY_COLUMNS.get(key, header[0])
+        if key_column not in header:
+            key_column = header[0]
+        key_index = header.index(key_column)
+
+        row_keys = set()
+        values = []
+        for position, row in enumerate(rows[1:]):
+            row_key = row[key_index] if key_index < len(row) and len(row[key_index]) > 0 else ''
+            # Rows stored before the validation of the keys are kept, under their position
+            if len(row_key) == 0 or row_key in row_keys:
+                row_key = '#{0}'.format(position)
+            row_keys.add(row_key)
+            values.append({'key': key, 'row_key': row_key, 'position': position,
+                           'values': (row + [''] * len(header))[0:len(header)]})
+        connection.execute(csv_data.update().where(csv_data.c.key == key)
+                                            .values(header=header, key_column=key_column))
+        if len(values) > 0:
+            op.bulk_insert(csv_row, values)
+
+    with op.batch_alter_table('csv_data') as batch_op:
+        batch_op.alter_column('header', nullable=False)
+        batch_op.alter_column('key_column', nullable=False)
+        batch_op.drop_column('value')
+
+
+def downgrade():
+    op.add_column('csv_data', sa.Column('value', sa.Text(), nullable=True))
+
+    # Write the rows back to CSVs
+    connection = op.get_bind()
+    for key, header in connection.execute(sa.select([csv_data.c.key, csv_data.c.header])).fetchall():
+        output = StringIO()
+        writer = csv.writer(output, delimiter=',', lineterminator='\n')
+        writer.writerow(header)
+        for values, in connection.execute(sa.select([csv_row.c['values']]).where(csv_row.c.key == key)
+                                                                            .order_by(csv_row.c.position)):
+            writer.writerow(values)
+        connection.execute(csv_data.update().where(csv_data.c.key == key).values(value=output.getvalue()))
+
+    with op.batch_alter_table('csv_data') as batch_op:
+        batch_op.alter_column('value', nullable=False)
+        batch_op.drop_column('key_column')
+        batch_op.drop_column('header')
+    op.drop_table('csv_row')
@@ -1,10 +1,25 @@
 import enum
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy_utils import ScalarListType
 
 db = SQLAlchemy()
 
+
+def aggregate_strings(column):
+    """Aggregate a string column of grouped rows, with the best function of the database dialect.
+
+    Args:
+        column: Column to aggregate.
+    Returns:
+        Tuple (SQL expression, function converting the aggregated value into a list of strings).
+    """
+    if db.session().bind.dialect.name == 'postgresql':
+        return func.array_agg(column), lambda value: [x for x in (value or []) if x is not None]
+    return func.group_concat(column, ','), lambda value: value.split(',') if value else []
+
 #########################
 # User, APIKeys, Scopes #
 #########################
@@ -41,6 +56,52 @@ class User(db.Model):
         """
         return User.query.filter_by(id=id).one_or_none()
 
+    @staticmethod
+    def get_with_scopes(id):
+        """Returns the refresh token and the scopes of a user in a single query.
+
+        Args:
+            id: Steam unique identifier.
+        Returns:
+            Tuple (refresh_token, list of scopes) or None if there is no User with this identifier.
+        """
+        rows = db.session().query(User.refresh_token, UserScope.scope)\
+                           .outerjoin(UserScope, UserScope.id == User.id)\
+                           .filter(User.id == id)\
+                           .all()
+        if len(rows) == 0:
+            return None
+        return rows[0][0], [scope for _, scope in rows if scope is not None]
+
+    @staticmethod
+    def get_page_with_scopes(limit, offset=0, after=None):
+        """Returns a page of users with their scopes, and the total number of users, in a single query.
+
+        Users are ordered by descending id.
+
+        Args:
+            limit: Maximum number of users to return.
+            offset: Number of users to skip.
+            after: Optional user id, only users with a lower id are returned.
+        Returns:
+            Tuple (total, list of tuples (id, list of scopes)).
+        """
+        page = db.session().query(User.id).order_by(User.id.desc())
+        if after is not None:
+            page = page.filter(User.id < after)
+        page = page.limit(limit).offset(offset).subquery()
+
+        scopes, parse_scopes = aggregate_strings(UserScope.scope)
+        total = db.session().query(func.count(User.id)).as_scalar()
+        rows = db.session().query(page.c.id, scopes, total)\
+                           .outerjoin(UserScope, UserScope.id == page.c.id)\
+                           .group_by(page.c.id)\
+                           .order_by(page.c.id.desc())\
+                           .all()
+        if len(rows) == 0:
+            return db.session().query(func.count(User.id)).scalar(), []
+        return rows[0][2], [(id, parse_scopes(value)) for id, value, _ in rows]
+
 class APIKey(db.Model):
     """An API Key used in the system
 
@@ -70,6 +131,53 @@ class APIKey(db.Model):
         """
         return APIKey.query.filter_by(key_hash=key_hash).one_or_none()
 
+    @staticmethod
+    def get_with_scopes(key_hash):
+        """Returns the refresh token and the scopes of an APIKey in a single query.
+
+        Args:
+            key_hash: sha1 hash of the key to find data about.
+        Returns:
+            Tuple (refresh_token, list of scopes) or None if the APIKey doesn't exist.
+        """
+        rows = db.session().query(APIKey.refresh_token, APIKeyScope.scope)\
+                           .outerjoin(APIKeyScope, APIKeyScope.key_hash == APIKey.key_hash)\
+                           .filter(APIKey.key_hash == key_hash)\
+                           .all()
+        if len(rows) == 0:
+            return None
+        return rows[0][0], [scope for _, scope in rows if scope is not None]
+
+    @staticmethod
+    def get_page_with_scopes(limit, offset=0, after=None):
+        """Returns a page of APIKeys with their scopes, and the total number of APIKeys, in a single query.
+
+        APIKeys are ordered by descending hash.
+
+        Args:
+            limit: Maximum number of APIKeys to return.
+            offset: Number of APIKeys to skip.
+            after: Optional hash, only APIKeys with a lower hash are returned.
+        Returns:
+            Tuple (total, list of tuples (key_hash, description, list of scopes)).
+        """
+        page = db.session().query(APIKey.key_hash, APIKey.description).order_by(APIKey.key_hash.desc())
+        if after is not None:
+            page = page.filter(APIKey.key_hash < after)
+        page = page.limit(limit).offset(offset).subquery()
+
+        scopes, parse_scopes = aggregate_strings(APIKeyScope.scope)
+        total = db.session().query(func.count(APIKey.key_hash)).as_scalar()
+        rows = db.session().query(page.c.key_hash, page.c.description, scopes, total)\
+                           .outerjoin(APIKeyScope, APIKeyScope.key_hash == page.c.key_hash)\
+                           .group_by(page.c.key_hash, page.c.description)\
+                           .order_by(page.c.key_hash.desc())\
+                           .all()
+        if len(rows) == 0:
+            return db.session().query(func.count(APIKey.key_hash)).scalar(), []
+        return rows[0][3], [(key_hash, description, parse_scopes(value))
+                            for key_hash, description, value, _ in rows]
+
 class Scope(enum.Enum):
     API_KEY_SCOPE = 'api_key_scope'           # Management of the API_KEYs
     USER_SCOPE = 'user_scope'                 # Management of the user rights
@@ -257,6 +365,43 @@ class Game(db.Model):
         self.valve_id = None
         self.winner = None
 
+class BotCredentialLease(db.Model):
+    """Lease of a Steam bot account by a bot manager process, in sharded mode.
+
+    Attributes:
+        login: Steam login of the bot account.
+        worker: Identifier of the bot manager holding the account, None if free.
+        expiration: Time after which the lease is considered abandoned if not renewed.
+    """
+    __tablename__ = 'bot_credential_lease'
+
+    login = db.Column(db.String(), primary_key=True)
+    worker = db.Column(db.String(), nullable=True)
+    expiration = db.Column(db.DateTime(), nullable=True)
+
+    def __init__(self, login):
+        self.login = login
+        self.worker = None
+        self.expiration = None
+
+    @staticmethod
+    def register(logins):
+        """Make sure a lease row exists for each bot account.
+
+        Args:
+            logins: List of Steam logins.
+        """
+        existing = set(login for login, in db.session().query(BotCredentialLease.login)
+                                                        .filter(BotCredentialLease.login.in_(logins)).all())
+        for login in logins:
+            if login not in existing:
+                db.session().add(BotCredentialLease(login))
+        try:
+            db.session().commit()
+        except IntegrityError:
+            # Another manager registered the same accounts at the same time
+            db.session().rollback()
+
 class GameVIPType(enum.Enum):
     CASTER = 'CASTER'
     ADMIN = 'ADMIN'
@@ -333,27 +478,103 @@ class DynamicConfiguration(db.Model):
             dc = DynamicConfiguration(key, value)
             db.session().add(dc)
         dc.value = value
+        DynamicConfiguration.increment(DYNAMIC_CONFIGURATION_VERSION)
         db.session().commit()
         return dc
 
+    @staticmethod
+    def increment(key):
+        """Increment a counter configuration key in the current transaction, without committing.
+
+        Args:
+            key: key of the counter, starts at 0 if not present in database.
+        Returns:
+            The new value of the counter.
+        """
+        dc = db.session().query(DynamicConfiguration).filter(DynamicConfiguration.key==key)\
+                         .with_for_update().one_or_none()
+        if dc is None:
+            dc = DynamicConfiguration(key, '0')
+            db.session().add(dc)
+        dc.value = str(int(dc.value) + 1)
+        return int(dc.value)
+
+# Incremented with each write of the dynamic configuration, see `helpers.dynamic_config`.
+DYNAMIC_CONFIGURATION_VERSION = 'dynamic_configuration_version'
+REFERENCE_DATA_VERSION = 'reference_data_version'
+
+def touch_reference_data(instance):
+    """Increment the reference data version if a hero, item, pro player or team is new or modified.
+
+    Called before the commit of the upsert, so the new version is committed with the change.
+    """
+    if instance in db.session.new or db.session.is_modified(instance):
+        DynamicConfiguration.increment(REFERENCE_DATA_VERSION)
+
 class CSVData(db.Model):
-    """CSV Holders"""
+    """CSV Holders, the rows are stored in `CSVRow`.
+
+    Attributes:
+        key: CSV key.
+        header: List of the column names.
+        key_column: Column identifying the rows, its values are the row keys.
+        version: Incremented with each upload or patch of the rows, for optimistic locking.
+    """
     __tablename__= 'csv_data'
 
     key = db.Column(db.String(), primary_key=True)
-    value = db.Column(db.Text(), nullable=False)
+    header = db.Column(db.JSON(), nullable=False)
+    key_column = db.Column(db.String(), nullable=False)
+    version = db.Column(db.Integer(), nullable=False, default=0)
 
     def __init__(self, key):
         self.key = key
+        self.version = 0
 
     @staticmethod
-    def upsert(key, value):
-        data = db.session.query(CSVData).filter(CSVData.key==key).one_or_none()
-        if data is None:
-            data = CSVData(key)
-            db.session.add(data)
-        data.value = value
-        db.session.commit()
+    def rows(key, column=None, values=None):
+        """Get the rows of a CSV as dicts column -> value, in the CSV order.
+
+        Args:
+            key: CSV key.
+            column: Optional column to filter the rows on, with an indexed lookup if it is the key column.
+            values: Set of accepted values of the column, None for all the rows.
+        Returns:
+            List of rows, None if there is no CSV for the key.
+        """
+        csv_data = db.session.query(CSVData).filter(CSVData.key==key).one_or_none()
+        if csv_data is None:
+            return None
+
+        query = db.session.query(CSVRow.values).filter(CSVRow.key==key)
+        if values is not None and column == csv_data.key_column:
+            query = query.filter(CSVRow.row_key.in_(list(values)))
+        rows = [dict(zip(csv_data.header, row_values)) for row_values, in query.order_by(CSVRow.position)]
+        if values is not None and column != csv_data.key_column:
+            rows = [row for row in rows if row.get(column, None) in values]
+        return rows
+
+class CSVRow(db.Model):
+    """Row of a CSV.
+
+    Attributes:
+        key: CSV key.
+        row_key: Value of the key column of the CSV, `#<position>` if empty.
+        position: Index of the row in the CSV, header excluded.
+        values: List of the values, in the order of the header.
+    """
+    __tablename__= 'csv_row'
+
+    key = db.Column(db.String(), db.ForeignKey('csv_data.key', ondelete='CASCADE'), primary_key=True)
+    row_key = db.Column(db.String(), primary_key=True)
+    position = db.Column(db.Integer(), nullable=False)
+    values = db.Column(db.JSON(), nullable=False)
+
+    def __init__(self, key, row_key, position, values):
+        self.key = key
+        self.row_key = row_key
+        self.position = position
+        self.values = values
 
 class DotaHero(db.Model):
     """Dota heroes"""
@@ -380,6 +601,7 @@ class DotaHero(db.Model):
         hero.name = name
         hero.short_name = short_name
         hero.localized_name = localized_name
+        touch_reference_data(hero)
         db.session.commit()
 
 class DotaItem(db.Model):
@@ -407,6 +629,7 @@ class DotaItem(db.Model):
         item.name = name
         item.short_name = short_name
         item.localized_name = localized_name
+        touch_reference_data(item)
         db.session.commit()
 
 class DotaProPlayer(db.Model):
@@ -434,6 +657,7 @@ class DotaProPlayer(db.Model):
         player.name = name
         player.nickname = nickname
         player.team = team
+        touch_reference_data(player)
         db.session.commit()
 
 class DotaProTeam(db.Model):
@@ -455,6 +679,7 @@ class DotaProTeam(db.Model):
             db.session.add(team)
         team.id = id
         team.name = name
+        touch_reference_data(team)
         db.session.commit()
 
 class DotaStatTounamentHero(db.Model):
@@ -2,7 +2,7 @@ import logging
 import re
 import json
 import jwt
-import hashlib
+import time
 
 from datetime import datetime, timedelta
 from steam import SteamID
@@ -10,11 +10,44 @@ from steam import SteamID
 from flask import jsonify, redirect, request
 from helpers.general import safe_json_loads
 from helpers.endpoint import secure
-from models import db, User, APIKey, UserScope, APIKeyScope, Scope
+from helpers.cache import TTLCache
+from helpers.api_key import get_api_key_hasher
+from helpers.dynamic_config import dynamic_config, get_dynamic_config
+from models import db, User, APIKey, UserScope, APIKeyScope, Scope, DynamicConfiguration, \
+    DYNAMIC_CONFIGURATION_VERSION
+
+# Incremented with each change of the refresh token or the scopes of a client, see `build_api_auth`.
+AUTH_CLIENTS_VERSION = 'auth_clients_version'
 
 def build_api_auth(app, oid):
     """Factory to setup the routes for the auth api."""
 
+    # Refresh token and scopes of the clients, by ('user', steamid) or ('key', key_hash).
+    # Each process has its own cache, it is cleared when another process changes a client.
+    clients_cache = TTLCache(app.config.get('AUTH_CLIENT_CACHE_TTL', 10))
+    clients_version = {'value': None}
+
+    def invalidate_client(cache_key):
+        """Forget a client after a committed change, in all the processes.
+
+        The other processes see the new clients version with their next check of the dynamic configuration.
+
+        Args:
+            cache_key: ('user', steamid) or ('key', key_hash) of the client.
+        """
+        clients_cache.invalidate(cache_key)
+        DynamicConfiguration.increment(AUTH_CLIENTS_VERSION)
+        DynamicConfiguration.increment(DYNAMIC_CONFIGURATION_VERSION)
+        db.session.commit()
+        dynamic_config.invalidate()
+
+    def check_clients_version():
+        """Clear the cached clients if a client was changed since the last check."""
+        version = get_dynamic_config().get(AUTH_CLIENTS_VERSION, '0')
+        if version != clients_version['value']:
+            clients_cache.clear()
+            clients_version['value'] = version
+
     @app.route('/api/auth/login/steam', methods=['GET'])
     @oid.loginhandler
     def login_steam():
@@ -61,6 +94,7 @@ def build_api_auth(app, oid):
             db.session.add(user)
         user.refresh_token = token.decode('utf-8')
         db.session.commit()
+        invalidate_client(('user', str(steam_id.as_64)))
 
         url = '{0}?token={1}'.format(app.config['FRONTEND_LOGIN_REDIRECT'],
                                      user.refresh_token)
@@ -74,6 +108,7 @@ def build_api_auth(app, oid):
         @apiName RefreshTokenGetWithKey
         @apiGroup Authentication
         @apiDescription Get a refresh token using a API Key.
+        A refresh token delivered recently to the same key is returned again instead of a new one.
 
         @apiHeader {String} API_KEY API_KEY necessary to call the endpoint.
         @apiError (Errors){String} ApiKeyMissing Missing API_KEY header.
@@ -93,32 +128,54 @@ def build_api_auth(app, oid):
                             'payload': {}
                             }), 200
 
-        salt = app.config['API_KEY_SALT']
-        hash_object = hashlib.sha1((header_key + salt).encode('utf-8'))
-        hash_key = hash_object.hexdigest()
-        key = APIKey.get(hash_key)
+        hasher = get_api_key_hasher(app)
+        verified = hasher.get_verified(hasher.hash(header_key))
+        if verified is not None:
+            return jsonify({'success': 'yes',
+                            'error': '',
+                            'payload': {'token': verified}
+                            }), 200
 
+        key = hasher.find(header_key)
         if key is None:
             return jsonify({'success': 'no',
                             'error': 'ApiKeyInvalid',
                             'payload': {}
                             }), 200
-        else:
+
+        # Reuse the refresh token delivered recently by any process
+        refresh_token = None
+        if key.refresh_token is not None:
+            try:
+                claims = jwt.decode(key.refresh_token,
+                                    app.config['SECRET_KEY'],
+                                    audience='refresh')
+                if claims.get('iat', 0) > time.time() - hasher.verified.ttl:
+                    refresh_token = key.refresh_token
+            except jwt.InvalidTokenError:
+                pass
+
+        if refresh_token is None:
             token = {
                 'aud': 'refresh',
                 'client': {
                     'type': 'key',
                     'keyid': str(key.key_hash)
                 },
+                'iat': datetime.utcnow(),
                 'exp': datetime.utcnow() + timedelta(days=60)
             }
             token = jwt.encode(token, app.config['SECRET_KEY'])
             key.refresh_token = token.decode('utf-8')
             db.session.commit()
-            return jsonify({'success': 'yes',
-                            'error': '',
-                            'payload': {'token': key.refresh_token}
-                            }), 200
+            invalidate_client(('key', key.key_hash))
+            refresh_token = key.refresh_token
+
+        hasher.set_verified(key.key_hash, refresh_token)
+        return jsonify({'success': 'yes',
+                        'error': '',
+                        'payload': {'token': refresh_token}
+                        }), 200
 
     @app.route('/api/auth/token', methods=['GET'])
     def get_auth_token():
@@ -171,28 +228,34 @@ def build_api_auth(app, oid):
             'exp': datetime.utcnow() + timedelta(minutes=15)
         }
 
+        check_clients_version()
         if refresh_token['client']['type'] == 'user':
             auth_token['client']['steamid'] = refresh_token['client']['steamid']
-            # Test revoke
-            user = User.get(refresh_token['client']['steamid'])
-            if user is None or user.refresh_token != raw_token:
-                return jsonify({'success': 'no',
-                                'error': 'RefreshTokenRevoked',
-                                'payload': {}
-                                }), 200
-            # Add scopes
-            auth_token['client']['scopes'] = UserScope.get_all(refresh_token['client']['steamid'])
+            cache_key = ('user', refresh_token['client']['steamid'])
+            client = clients_cache.get(cache_key)
+            if client is None:
+                client = User.get_with_scopes(refresh_token['client']['steamid'])
+                if client is not None:
+                    clients_cache.set(cache_key, client)
         elif refresh_token['client']['type'] == 'key':
             auth_token['client']['keyid'] = refresh_token['client']['keyid']
-            # Test revoke
-            key = APIKey.get(refresh_token['client']['keyid'])
-            if key is None or key.refresh_token != raw_token:
-                return jsonify({'success': 'no',
-                                'error': 'RefreshTokenRevoked',
-                                'payload': {}
-                                }), 200
-            # Add scopes
-            auth_token['client']['scopes'] = APIKeyScope.get_all(refresh_token['client']['keyid'])
+            cache_key = ('key', refresh_token['client']['keyid'])
+            client = clients_cache.get(cache_key)
+            if client is None:
+                client = APIKey.get_with_scopes(refresh_token['client']['keyid'])
+                if client is not None:
+                    clients_cache.set(cache_key, client)
+        else:
+            client = None
+
+        # Test revoke
+        if client is None or client[0] != raw_token:
+            return jsonify({'success': 'no',
+                            'error': 'RefreshTokenRevoked',
+                            'payload': {}
+                            }), 200
+        # Add scopes
+        auth_token['client']['scopes'] = list(client[1])
 
         auth_token = jwt.encode(auth_token, app.config['SECRET_KEY'])
         return jsonify({'success': 'yes',
@@ -258,7 +321,10 @@ def build_api_auth(app, oid):
         @apiError (Errors){String} LimitInvalid Limit is not a positive integer in waited range.
         @apiParam {Integer{0-..}} [offset=0] Optional offset for database fetch.
         @apiError (Errors){String} OffsetInvalid Offset is not a positive integer in waited range.
+        @apiParam {String} [after] Optional hash of the last key of the previous page, to fetch the next one.
+        @apiError (Errors){String} AfterInvalid After is not a valid String.
 
+        @apiSuccess {Number} total Total number of keys.
         @apiSuccess {Object[]} keys All available scopes.
         @apiSuccess {String} keys.hash Hash of the API_KEY.
         @apiSuccess {String} keys.description API Key description.
@@ -282,20 +348,23 @@ def build_api_auth(app, oid):
                             'payload': {}
                             }), 200
 
+        # after check
+        after = data.get('after', None)
+        if after is not None and (not isinstance(after, str) or len(after) == 0):
+            return jsonify({'success': 'no',
+                            'error': 'AfterInvalid',
+                            'payload': {}
+                            }), 200
+
         # Return results
+        total, page = APIKey.get_page_with_scopes(limit, offset, after)
         keys = []
-        for api_key in db.session().query(APIKey)\
-                                   .order_by(APIKey.key_hash.desc())\
-                                   .limit(limit)\
-                                   .offset(offset)\
-                                   .all():
-            scopes = []
-            for scope in db.session().query(APIKeyScope).filter(APIKeyScope.key_hash==api_key.key_hash).all():
-                scopes.append(scope.scope)
-            keys.append({ 'hash': api_key.key_hash, 'description': api_key.description, 'scopes': scopes })
+        for key_hash, description, scopes in page:
+            keys.append({ 'hash': key_hash, 'description': description, 'scopes': scopes })
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {
+                            'total': total,
                             'keys': keys
                         }
                         }), 200
@@ -354,17 +423,15 @@ def build_api_auth(app, oid):
                             }), 200
 
         # Hash
-        salt = app.config['API_KEY_SALT']
-        hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-        hash_key = hash_object.hexdigest()
-        db_key = APIKey.get(hash_key)
+        hasher = get_api_key_hasher(app)
+        db_key = hasher.find(key)
 
         if db_key is not None:
             return jsonify({'success': 'no',
                             'error': 'KeyAlreadyExists',
                             'payload': {}
                             }), 200
-        db_key = APIKey(hash_key, description)
+        db_key = APIKey(hasher.hash(key), description)
         db.session().add(db_key)
         db.session().commit()
         return jsonify({'success': 'yes',
@@ -410,18 +477,19 @@ def build_api_auth(app, oid):
                             }), 200
 
         # Hash
-        salt = app.config['API_KEY_SALT']
-        hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-        hash_key = hash_object.hexdigest()
-        db_key = APIKey.get(hash_key)
+        hasher = get_api_key_hasher(app)
+        db_key = hasher.find(key)
 
         if db_key is None:
             return jsonify({'success': 'no',
                             'error': 'KeyDoesntExists',
                             'payload': {}
                             }), 200
+        hash_key = db_key.key_hash
         db.session().delete(db_key)
         db.session().commit()
+        invalidate_client(('key', hash_key))
+        hasher.invalidate(hash_key)
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {}
@@ -481,16 +549,15 @@ def build_api_auth(app, oid):
                             }), 200
 
         # Hash
-        salt = app.config['API_KEY_SALT']
-        hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-        hash_key = hash_object.hexdigest()
-        db_key = APIKey.get(hash_key)
+        hasher = get_api_key_hasher(app)
+        db_key = hasher.find(key)
 
         if db_key is None:
             return jsonify({'success': 'no',
                             'error': 'KeyDoesntExists',
                             'payload': {}
                             }), 200
+        hash_key = db_key.key_hash
         db_key.description = description
         db.session().commit()
         return jsonify({'success': 'yes',
@@ -558,20 +625,20 @@ def build_api_auth(app, oid):
                                 'payload': {}
                                 }), 200
         # Hash
-        salt = app.config['API_KEY_SALT']
-        hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-        hash_key = hash_object.hexdigest()
-        db_key = APIKey.get(hash_key)
+        hasher = get_api_key_hasher(app)
+        db_key = hasher.find(key)
 
         if db_key is None:
             return jsonify({'success': 'no',
                             'error': 'KeyDoesntExists',
                             'payload': {}
                             }), 200
+        hash_key = db_key.key_hash
 
         # add scopes
         for scope in scopes:
             APIKeyScope.upsert(hash_key, scope)
+        invalidate_client(('key', hash_key))
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {}
@@ -637,16 +704,15 @@ def build_api_auth(app, oid):
                                 'payload': {}
                                 }), 200
         # Hash
-        salt = app.config['API_KEY_SALT']
-        hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-        hash_key = hash_object.hexdigest()
-        db_key = APIKey.get(hash_key)
+        hasher = get_api_key_hasher(app)
+        db_key = hasher.find(key)
 
         if db_key is None:
             return jsonify({'success': 'no',
                             'error': 'KeyDoesntExists',
                             'payload': {}
                             }), 200
+        hash_key = db_key.key_hash
 
         # remove scopes
         for scope in scopes:
@@ -654,6 +720,7 @@ def build_api_auth(app, oid):
             if api_scope is not None:
                 db.session.delete(api_scope)
         db.session.commit()
+        invalidate_client(('key', hash_key))
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {}
@@ -680,6 +747,8 @@ def build_api_auth(app, oid):
         @apiError (Errors){String} LimitInvalid Limit is not a positive integer in waited range.
         @apiParam {Integer{0-..}} [offset=0] Optional offset for database fetch.
         @apiError (Errors){String} OffsetInvalid Offset is not a positive integer in waited range.
+        @apiParam {String} [after] Optional id of the last user of the previous page, to fetch the next one.
+        @apiError (Errors){String} AfterInvalid After is not a valid user id.
 
         @apiSuccess {Number} total Total number of users.
         @apiSuccess {Object[]} users All available users.
@@ -704,18 +773,22 @@ def build_api_auth(app, oid):
                             'payload': {}
                             }), 200
 
+        # after check
+        after = data.get('after', None)
+        if after is not None:
+            try:
+                after = int(after)
+            except (TypeError, ValueError):
+                return jsonify({'success': 'no',
+                                'error': 'AfterInvalid',
+                                'payload': {}
+                                }), 200
+
         # Return results
-        total = db.session().query(User).count()
+        total, page = User.get_page_with_scopes(limit, offset, after)
         users = []
-        for user in db.session().query(User)\
-                                   .order_by(User.id.desc())\
-                                   .limit(limit)\
-                                   .offset(offset)\
-                                   .all():
-            scopes = []
-            for scope in db.session().query(UserScope).filter(UserScope.id==user.id).all():
-                scopes.append(scope.scope)
-            users.append({ 'id': str(user.id), 'scopes': scopes })
+        for id, scopes in page:
+            users.append({ 'id': str(id), 'scopes': scopes })
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {
@@ -797,6 +870,7 @@ def build_api_auth(app, oid):
         # add scopes
         for scope in scopes:
             UserScope.upsert(id, scope)
+        invalidate_client(('user', str(user.id)))
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {}
@@ -877,6 +951,7 @@ def build_api_auth(app, oid):
             if user_scope is not None:
                 db.session.delete(user_scope)
         db.session.commit()
+        invalidate_client(('user', str(user.id)))
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {}
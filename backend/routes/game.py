@@ -2,9 +2,10 @@ import logging
 import collections
 
 from flask import request, jsonify
-from models import db, Game, GameVIP, GameVIPType, DynamicConfiguration
+from models import db, Game, GameVIP, GameVIPType
 from helpers.general import safe_json_loads
 from helpers.endpoint import secure
+from helpers.dynamic_config import get_dynamic_config
 
 def build_api_game(app):
     """Factory to setup the routes for the Dota bots."""
@@ -531,7 +532,7 @@ def build_api_game(app):
 
         apiSuccess {String=True,False} bot_pause Pause status of the bot.
         """
-        bot_pause = db.session().query(DynamicConfiguration).filter(DynamicConfiguration.key=='bot_pause').one_or_none()
+        bot_pause = get_dynamic_config().get('bot_pause')
         if bot_pause is None:
             return jsonify({'success': 'no',
                             'error': 'BotPauseMissing',
@@ -539,7 +540,7 @@ def build_api_game(app):
                             }), 200
 
         return jsonify({'success': 'yes',
-                        'payload': {'bot_pause': bot_pause.value}
+                        'payload': {'bot_pause': bot_pause}
                         }), 200
 
     #@app.route('/api/game/bot/pause/update', methods=['POST'])
@@ -579,7 +580,7 @@ def build_api_game(app):
                             }), 200
 
         # Update
-        dc = DynamicConfiguration.update('bot_pause', bot_pause)
+        bot_pause = get_dynamic_config().set('bot_pause', bot_pause)
         return jsonify({'success': 'yes',
-                        'payload': {'bot_pause': dc.value}
+                        'payload': {'bot_pause': bot_pause}
                         }), 200
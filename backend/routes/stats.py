@@ -1,19 +1,25 @@
 import logging
-import csv
 import os
 from io import StringIO
 
-from flask import request, jsonify, send_file
-from models import db, CSVData, DynamicConfiguration
+from flask import request, jsonify, Response
 
+from helpers.csv_ingest import CSVIngestError, export_csv, ingest_csv, patch_csv, text_lines
 from helpers.general import safe_json_loads
+from helpers.dynamic_config import get_dynamic_config
 from helpers.endpoint import secure
+from helpers.image_encoding import MIMETYPES, is_encoding
+from helpers.image_serving import send_image
 from helpers.image_gen import ImageGenerator
+from helpers.render_queue import get_render_queue
+from helpers.scene_channel import get_scene_channel
 
 def build_api_stats(app):
     """Factory to setup the routes for the stats api."""
 
     ig = ImageGenerator(app)
+    ig.warm_up()
+    render_queue = get_render_queue(app)
 
     @app.route('/api/stats/csv/get', methods=['GET'])
     @secure(app, ['key', 'user'], ['stats_manage'])
@@ -37,6 +43,7 @@ def build_api_stats(app):
         @apiError (Errors){String} KeyDataDoesntExist key has no data associated.
 
         @apiSuccess {Number} csv CSVData associated to the key.
+        @apiSuccess {Number} version Version of the CSV, to base patches on.
         """
         data = safe_json_loads(request.args.get('data', '{}'))
 
@@ -48,17 +55,19 @@ def build_api_stats(app):
                             'payload': {}
                             }), 200
 
-        csv_data = db.session.query(CSVData).filter(CSVData.key==key).one_or_none()
-        if csv_data is None:
+        exported = export_csv(key)
+        if exported is None:
             return jsonify({'success': 'no',
                             'error': 'KeyDataDoesntExist',
                             'payload': {}
                             }), 200
         else:
+            csv_value, version = exported
             return jsonify({'success': 'yes',
                             'error': '',
                             'payload': {
-                                'csv': csv_data.value
+                                'csv': csv_value,
+                                'version': version
                             }
                             }), 200
 
@@ -70,7 +79,9 @@ def build_api_stats(app):
         @apiVersion 1.1.0
         @apiName StatsCSVUpdate
         @apiGroup Stats
-        @apiDescription Update CSV saved for stats.
+        @apiDescription Update CSV saved for stats. The CSV is sent either as a JSON value, as the file of a
+        multipart/form-data upload with the other parameters as form fields, or as a text/csv body with the other
+        parameters in the query string. Rows are stored by the value of their key column.
 
         @apiHeader {String} Authorization 'Bearer <Auth_Token>'
         @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
@@ -83,10 +94,26 @@ def build_api_stats(app):
         @apiError (Errors){String} KeyInvalid key is not a valid string.
 
         @apiParam {String} value CSV data.
+        @apiParam {File} [file] CSV file, instead of value in a multipart/form-data upload.
         @apiError (Errors){String} ValueInvalid value is not a valid string.
         @apiError (Errors){String} ValueCSVInvalid value CSV is not a valid same length column csv.
+        @apiParam {String} [key_column] Column identifying the rows, default from the configuration or the first column.
+        @apiError (Errors){String} KeyColumnInvalid key_column is not a column of the CSV.
+        @apiError (Errors){String} ValueRowKeyDuplicate Two rows have the same value in the key column.
+
+        @apiSuccess {Number} rows Number of rows stored.
+        @apiSuccess {Number} version New version of the CSV.
         """
-        data = request.get_json(force=True)
+        if request.mimetype == 'multipart/form-data':
+            data = request.form
+            upload = request.files.get('file', None)
+            lines = text_lines(upload.stream) if upload is not None else None
+        elif request.mimetype == 'text/csv':
+            data = request.args
+            lines = text_lines(request.stream)
+        else:
+            data = request.get_json(force=True)
+            lines = None
 
         # key check
         key = data.get('key', 10)
@@ -97,37 +124,194 @@ def build_api_stats(app):
                             }), 200
 
         # value check
-        value = data.get('value', 10)
-        if not isinstance(value, str) or len(value) <= 0:
+        if lines is None:
+            value = data.get('value', 10)
+            if not isinstance(value, str) or len(value) <= 0:
+                return jsonify({'success': 'no',
+                                'error': 'ValueInvalid',
+                                'payload': {}
+                                }), 200
+            lines = StringIO(value)
+
+        # key_column check
+        key_column = data.get('key_column', None) or app.config.get('CSV_KEY_COLUMNS', {}).get(key, None)
+        if key_column is not None and not isinstance(key_column, str):
+            return jsonify({'success': 'no',
+                            'error': 'KeyColumnInvalid',
+                            'payload': {}
+                            }), 200
+
+        try:
+            rows, version = ingest_csv(key, lines, key_column)
+        except CSVIngestError as e:
+            logging.info('CSV {0} rejected: {1}'.format(key, e))
+            return jsonify({'success': 'no',
+                            'error': e.error,
+                            'payload': {}
+                            }), 200
+
+        return jsonify({'success': 'yes',
+                        'error': '',
+                        'payload': {
+                            'rows': rows,
+                            'version': version
+                        }
+                        }), 200
+
+    @app.route('/api/stats/csv/patch', methods=['POST'])
+    @secure(app, ['key', 'user'], ['stats_manage'])
+    def post_stats_csv_patch(auth_token):
+        """
+        @api {get} /api/stats/csv/patch StatsCSVPatch
+        @apiVersion 1.1.0
+        @apiName StatsCSVPatch
+        @apiGroup Stats
+        @apiDescription Upsert and delete rows of a CSV saved for stats, by the value of their key column.
+        Deletions are applied before the upserts. Missing columns of an upserted row keep their value, or are empty
+        for a new row.
+
+        @apiHeader {String} Authorization 'Bearer <Auth_Token>'
+        @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
+        @apiError (Errors){String} AuthTokenExpired Token has expired, must be refreshed by client.
+        @apiError (Errors){String} AuthTokenInvalid Token is invalid, decode is impossible.
+        @apiError (Errors){String} ClientAccessImpossible This type of client can't access target endpoint.
+        @apiError (Errors){String} ClientAccessRefused Client has no scope access to target endpoint.
+
+        @apiParam {String} key CSV key to patch.
+        @apiError (Errors){String} KeyInvalid key is not a valid string.
+        @apiError (Errors){String} KeyDataDoesntExist key has no data associated.
+        @apiParam {Number} [version] Version the patch is based on, from StatsCSVGet or a previous patch.
+        @apiError (Errors){String} VersionInvalid version is not a valid integer.
+        @apiError (Errors){String} VersionConflict The CSV was changed since version.
+        @apiParam {Object[]} [upsert] Rows to insert or update, as objects column -> value.
+        @apiError (Errors){String} UpsertInvalid upsert is not a valid list.
+        @apiError (Errors){String} RowInvalid A row has unknown columns or invalid values.
+        @apiParam {String[]} [delete] Keys of the rows to delete.
+        @apiError (Errors){String} DeleteInvalid delete is not a valid list.
+        @apiError (Errors){String} RowKeyInvalid A row has no key or a deleted key is not a string.
+        @apiParam {Boolean} [generate=false] Start the generation of the images of the upserted rows.
+        @apiError (Errors){String} GenerateInvalid generate is not a valid boolean.
+
+        @apiSuccess {Number} version New version of the CSV.
+        @apiSuccess {String[]} upserted Keys of the upserted rows.
+        @apiSuccess {String[]} deleted Keys of the deleted rows.
+        @apiSuccess {Object} job Status of the generation job if started, see StatsImgJobGet, null otherwise.
+        """
+        data = request.get_json(force=True)
+
+        # key check
+        key = data.get('key', 10)
+        if not isinstance(key, str) or len(key) <= 0:
+            return jsonify({'success': 'no',
+                            'error': 'KeyInvalid',
+                            'payload': {}
+                            }), 200
+
+        # version check
+        version = data.get('version', None)
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
             return jsonify({'success': 'no',
-                            'error': 'ValueInvalid',
+                            'error': 'VersionInvalid',
                             'payload': {}
                             }), 200
 
-        columns = None
-        for row in csv.reader(StringIO(value), delimiter=','):
-            if columns is None:
-                columns = len(row)
+        # upsert & delete checks
+        upsert = data.get('upsert', [])
+        if not isinstance(upsert, list):
+            return jsonify({'success': 'no',
+                            'error': 'UpsertInvalid',
+                            'payload': {}
+                            }), 200
+        delete = data.get('delete', [])
+        if not isinstance(delete, list):
+            return jsonify({'success': 'no',
+                            'error': 'DeleteInvalid',
+                            'payload': {}
+                            }), 200
+
+        # generate check
+        generate = data.get('generate', False)
+        if not isinstance(generate, bool):
+            return jsonify({'success': 'no',
+                            'error': 'GenerateInvalid',
+                            'payload': {}
+                            }), 200
+
+        try:
+            version, upserted, deleted = patch_csv(key, upsert, delete, version)
+        except CSVIngestError as e:
+            logging.info('CSV {0} patch rejected: {1}'.format(key, e))
+            return jsonify({'success': 'no',
+                            'error': e.error,
+                            'payload': {}
+                            }), 200
+
+        # Generate only the images of the changed rows
+        job = None
+        payload = ig.payload_for_rows(key, upserted, deleted) if generate else None
+        if payload is not None:
+            if ig.is_bulk(key, payload):
+                job = render_queue.submit_bulk(key, payload, lambda: ig.prepare_bulk(key, payload))
             else:
-                if len(row) != columns:
-                    return jsonify({'success': 'no',
-                                    'error': 'ValueCSVInvalid',
-                                    'payload': {}
-                                    }), 200
+                job = render_queue.submit(key, payload)
 
-        CSVData.upsert(key, value)
         return jsonify({'success': 'yes',
                         'error': '',
-                        'payload': {}
+                        'payload': {
+                            'version': version,
+                            'upserted': upserted,
+                            'deleted': deleted,
+                            'job': job
+                        }
                         }), 200
 
     @app.route('/api/stats/img/<name>', methods=['GET'])
     def get_stats_img(name):
+        """
+        @api {get} /api/stats/img/:name StatsImgGet
+        @apiVersion 1.1.0
+        @apiName StatsImgGet
+        @apiGroup Stats
+        @apiDescription Get a generated image. The WebP variant of the image is served to the clients accepting
+        image/webp if it was generated with a WebP encoding, the PNG otherwise. Images are sent with an ETag,
+        answered with a 304 if unchanged, and support single byte ranges.
+
+        @apiParam {String} name Name of the image.
+        @apiParam {String} [format] Force the format, 'png' or 'webp'. The PNG is served if the image has no WebP
+        variant generated with it.
+        @apiHeader {String} [If-None-Match] ETag of the cached image.
+        @apiHeader {String} [If-Modified-Since] Last-Modified of the cached image.
+        @apiHeader {String} [Range] Single byte range of the image.
+        """
         path_file = os.path.join(app.config['IMG_GENERATE_PATH'], name + '.png')
-        if not os.path.isfile(path_file):
-            return send_file('static/img/stats_default.jpg')
+        try:
+            png_mtime = os.path.getmtime(path_file)
+        except OSError:
+            return send_image(os.path.join(app.root_path, 'static', 'img', 'stats_default.jpg'), 'image/jpeg',
+                              app.config.get('IMG_DEFAULT_CACHE_CONTROL', 'public, max-age=60'),
+                              app.config.get('IMG_RENDER_VERSION', ''))
+
+        image_format = request.args.get('format', None)
+        webp_file = os.path.splitext(path_file)[0] + '.webp'
+        try:
+            webp_fresh = os.path.getmtime(webp_file) >= png_mtime
+        except OSError:
+            webp_fresh = False
+        if image_format is None:
+            accept_webp = request.accept_mimetypes.best_match([MIMETYPES['.png'], MIMETYPES['.webp']],
+                                                              default=MIMETYPES['.png']) == MIMETYPES['.webp']
         else:
-            return send_file(path_file)
+            accept_webp = image_format == 'webp'
+
+        image_file = webp_file if accept_webp and webp_fresh else path_file
+        response = send_image(image_file, MIMETYPES[os.path.splitext(image_file)[1]],
+                              app.config.get('IMG_CACHE_CONTROL', 'no-cache'),
+                              app.config.get('IMG_RENDER_VERSION', ''),
+                              app.config.get('IMG_SENDFILE', None),
+                              app.config.get('IMG_SENDFILE_PREFIX', '/generated_img/') +
+                              os.path.relpath(image_file, app.config['IMG_GENERATE_PATH']))
+        response.vary.add('Accept')
+        return response
 
     @app.route('/api/stats/csv/img/generate', methods=['POST'])
     @secure(app, ['key', 'user'], ['stats_manage'])
@@ -137,7 +321,8 @@ def build_api_stats(app):
         @apiVersion 1.1.0
         @apiName StatsCSVGenerateIMG
         @apiGroup Stats
-        @apiDescription Start the generation of CSV image.
+        @apiDescription Start the generation of CSV image in the background. Generating again the same key and
+        payload while the previous generation is pending returns the pending job.
 
         @apiHeader {String} Authorization 'Bearer <Auth_Token>'
         @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
@@ -148,9 +333,14 @@ def build_api_stats(app):
 
         @apiParam {String} key CSV key to generate.
         @apiError (Errors){String} KeyInvalid key is not a valid string.
-        @apiParam {Number} [payload] Optional payload to refine the generation with.
-
-        @apiError (Errors){String} OpenDotaNotReady Data is not ready on OpenDota.
+        @apiParam {Number} [payload] Optional payload to refine the generation with. For preti8_teams and
+        preti8_players, team_id and player_id can be "*" or a list of ids to generate many images in parallel.
+        @apiError (Errors){String} PayloadInvalid payload is not a valid JSON object.
+        @apiParam {String} [payload.encoding] Output preset: 'png', 'png-optimized', 'png-palette', 'png-fast' for
+        live use, 'webp' or 'webp-lossless'. WebP presets also publish a WebP variant of the PNG.
+        @apiError (Errors){String} EncodingInvalid payload.encoding is not a valid preset.
+
+        @apiSuccess {Object} job Status of the generation job, see StatsImgJobGet.
         """
         data = request.get_json(force=True)
 
@@ -162,21 +352,88 @@ def build_api_stats(app):
                             'payload': {}
                             }), 200
 
+        # payload check
         payload = data.get('payload', {})
+        if not isinstance(payload, dict):
+            return jsonify({'success': 'no',
+                            'error': 'PayloadInvalid',
+                            'payload': {}
+                            }), 200
+        if 'encoding' in payload and not is_encoding(payload['encoding']):
+            return jsonify({'success': 'no',
+                            'error': 'EncodingInvalid',
+                            'payload': {}
+                            }), 200
 
         # Generate
-        result = ig.generate_image(key, payload)
-        if result:
-            return jsonify({'success': 'yes',
-                            'error': '',
+        if ig.is_bulk(key, payload):
+            job = render_queue.submit_bulk(key, payload, lambda: ig.prepare_bulk(key, payload))
+        else:
+            job = render_queue.submit(key, payload)
+        return jsonify({'success': 'yes',
+                        'error': '',
+                        'payload': {
+                            'job': job
+                        }
+                        }), 200
+
+    @app.route('/api/stats/img/job/get', methods=['GET'])
+    @secure(app, ['key', 'user'], ['stats_manage'])
+    def get_stats_img_job(auth_token):
+        """
+        @api {get} /api/stats/img/job/get StatsImgJobGet
+        @apiVersion 1.1.0
+        @apiName StatsImgJobGet
+        @apiGroup Stats
+        @apiDescription Get the status of an image generation job.
+
+        @apiHeader {String} Authorization 'Bearer <Auth_Token>'
+        @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
+        @apiError (Errors){String} AuthTokenExpired Token has expired, must be refreshed by client.
+        @apiError (Errors){String} AuthTokenInvalid Token is invalid, decode is impossible.
+        @apiError (Errors){String} ClientAccessImpossible This type of client can't access target endpoint.
+        @apiError (Errors){String} ClientAccessRefused Client has no scope access to target endpoint.
+
+        @apiParam {String} id Id of the job.
+        @apiError (Errors){String} IdInvalid id is not a valid string.
+        @apiError (Errors){String} JobDoesntExist There is no job with this id.
+
+        @apiSuccess {Object} job Status of the generation job.
+        @apiSuccess {String} job.id Id of the job.
+        @apiSuccess {String} job.key Key generated by the job.
+        @apiSuccess {String} job.state State of the job: 'queued', 'running', 'done' or 'failed'.
+        @apiSuccess {String} job.error Error of a failed job, 'OpenDotaNotReady' if data is not ready on OpenDota.
+        @apiSuccess {String} job.queued_at Time the job was queued.
+        @apiSuccess {String} job.started_at Time the job started, null if not started.
+        @apiSuccess {String} job.finished_at Time the job finished, null if not finished.
+        @apiSuccess {Number} job.wait_time Seconds the job waited in the queue, null if not started.
+        @apiSuccess {Number} job.render_time Seconds the generation took, null if not finished.
+        @apiSuccess {Object} [job.results] For bulk jobs, result of each image by id, with its state, error and render_time.
+        """
+        data = safe_json_loads(request.args.get('data', '{}'))
+
+        # id check
+        job_id = data.get('id', 10)
+        if not isinstance(job_id, str) or len(job_id) <= 0 or not job_id.isalnum():
+            return jsonify({'success': 'no',
+                            'error': 'IdInvalid',
                             'payload': {}
                             }), 200
-        else:
+
+        job = render_queue.status(job_id)
+        if job is None:
             return jsonify({'success': 'no',
-                            'error': 'OpenDotaNotReady',
+                            'error': 'JobDoesntExist',
                             'payload': {}
                             }), 200
 
+        return jsonify({'success': 'yes',
+                        'error': '',
+                        'payload': {
+                            'job': job
+                        }
+                        }), 200
+
     @app.route('/api/stats/scene/status/get', methods=['GET'])
     @secure(app, ['key', 'user'], ['stats_manage_scene'])
     def get_stats_scene_status(auth_token):
@@ -196,17 +453,12 @@ def build_api_stats(app):
 
         @apiSuccess {Boolean} activated Boolean to show if the stat scene is activated or disabled.
         """
-
-        stats_scene_status_dc = db.session.query(DynamicConfiguration).filter(DynamicConfiguration.key=='stats_scene_status').one_or_none()
-        if stats_scene_status_dc is None:
-            stats_scene_status = 'False'
-        else:
-            stats_scene_status = stats_scene_status_dc.value
+        activated = get_dynamic_config().get_bool('stats_scene_status')
 
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {
-                            'activated': stats_scene_status == 'True'
+                            'activated': activated
                         }
                         }), 200
 
@@ -243,18 +495,13 @@ def build_api_stats(app):
                             }), 200
 
         # change scene status
-        stats_scene_status_dc = db.session.query(DynamicConfiguration).filter(DynamicConfiguration.key=='stats_scene_status').one_or_none()
-        if stats_scene_status_dc is None:
-            stats_scene_status_dc = DynamicConfiguration('stats_scene_status', str(activated))
-            db.session.add(stats_scene_status_dc)
-        else:
-            stats_scene_status_dc.value = str(activated)
-        db.session.commit()
+        get_dynamic_config().set('stats_scene_status', activated)
+        get_scene_channel(app).update(**{'continue': activated})
 
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {
-                            'activated': stats_scene_status_dc.value == 'True'
+                            'activated': activated
                         }
                         }), 200
 
@@ -265,40 +512,25 @@ def build_api_stats(app):
         @apiVersion 1.1.0
         @apiName StatsSceneGet
         @apiGroup Stats
-        @apiDescription Get the stat image.
+        @apiDescription Get the stat image. Prefer the StatsSceneStream events to polling.
 
         @apiSuccess {String} img Image to use in the stat scene.
         @apiSuccess {String} last_modified Last time the file was modified.
         @apiSuccess {Boolean} continue Should the stat scene user continue.
-        """
-        stats_scene_dc = db.session.query(DynamicConfiguration).filter(DynamicConfiguration.key=='stats_scene').one_or_none()
-        if stats_scene_dc is None:
-            stats_scene = 'empty'
-        else:
-            stats_scene = stats_scene_dc.value
-        db.session.commit()
-
-        path_file = os.path.join(app.config['IMG_GENERATE_PATH'], stats_scene + '.png')
-        if not os.path.isfile(path_file):
-            last_modified = ''
-        else:
-            last_modified = os.path.getmtime(path_file)
 
-        # Give status inside
-        stats_scene_status_dc = db.session.query(DynamicConfiguration).filter(DynamicConfiguration.key=='stats_scene_status').one_or_none()
-        if stats_scene_status_dc is None:
-            stats_scene_status = 'False'
+        @apiHeader {String} [If-None-Match] ETag of the last response, answered with a 304 if nothing changed.
+        """
+        etag, scene = get_scene_channel(app).snapshot()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
         else:
-            stats_scene_status = stats_scene_status_dc.value
-
-        return jsonify({'success': 'yes',
-                        'error': '',
-                        'payload': {
-                            'continue': stats_scene_status == 'True',
-                            'img': stats_scene,
-                            'last_modified': last_modified
-                        }
-                        }), 200
+            response = jsonify({'success': 'yes',
+                                'error': '',
+                                'payload': scene
+                                })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     @app.route('/api/stats/scene/update', methods=['POST'])
     @secure(app, ['key', 'user'], ['stats_manage_scene'])
@@ -334,12 +566,6 @@ def build_api_stats(app):
                             'payload': {}
                             }), 200
 
-        # change scene
-        stats_scene_status_dc = db.session.query(DynamicConfiguration).filter(DynamicConfiguration.key=='stats_scene').one_or_none()
-        if stats_scene_status_dc is None:
-            stats_scene_status_dc = DynamicConfiguration('stats_scene', img)
-            db.session.add(stats_scene_status_dc)
-
         # File look on disk
         path_file = os.path.join(app.config['IMG_GENERATE_PATH'], img + '.png')
         if not os.path.isfile(path_file):
@@ -348,14 +574,15 @@ def build_api_stats(app):
                             'payload': {}
                             }), 200
 
+        # change scene
         last_modified = os.path.getmtime(path_file)
-        stats_scene_status_dc.value = img
-        db.session.commit()
+        get_dynamic_config().set('stats_scene', img)
+        get_scene_channel(app).update(img=img, last_modified=last_modified)
 
         return jsonify({'success': 'yes',
                         'error': '',
                         'payload': {
-                            'img': stats_scene_status_dc.value,
+                            'img': img,
                             'last_modified': last_modified
                         }
                         }), 200
@@ -0,0 +1,92 @@
+import json
+from datetime import timedelta
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue
+from tornado.web import RequestHandler
+
+from helpers.scene_channel import get_scene_channel
+
+
+class StatsSceneStreamHandler(RequestHandler):
+    """
+    @api {get} /api/stats/scene/stream StatsSceneStream
+    @apiVersion 1.1.0
+    @apiName StatsSceneStream
+    @apiGroup Stats
+    @apiDescription Server-Sent Events stream of the stat scene, replacing the polling of StatsSceneGet.
+    An event `scene` is sent on connection and on each change, with the id of the event being the ETag
+    of StatsSceneGet. Comments are sent regularly to keep the connection opened.
+
+    @apiSuccess {String} img Image to use in the stat scene.
+    @apiSuccess {String} last_modified Last time the file was modified.
+    @apiSuccess {Boolean} continue Should the stat scene user continue.
+    """
+
+    def initialize(self, app, keepalive):
+        self.app = app
+        self.keepalive = keepalive
+        self.queue = Queue()
+        self.closed = False
+
+    def set_default_headers(self):
+        self.set_header('Access-Control-Allow-Origin', '*')
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+
+    @gen.coroutine
+    def get(self):
+        channel = get_scene_channel(self.app)
+        with self.app.app_context():
+            etag, state = channel.snapshot()
+
+        # Changes are notified from other threads, the IOLoop writes them.
+        loop = IOLoop.current()
+
+        def listener(etag, state):
+            loop.add_callback(self.queue.put, (etag, state))
+
+        channel.add_listener(listener)
+        try:
+            if self.request.headers.get('Last-Event-ID', None) != etag:
+                self.write_event(etag, state)
+            else:
+                self.write('retry: 2000\n\n')
+            yield self.flush()
+            while not self.closed:
+                try:
+                    event = yield self.queue.get(timeout=timedelta(seconds=self.keepalive))
+                except gen.TimeoutError:
+                    self.write(': keepalive\n\n')
+                    yield self.flush()
+                    continue
+                if event is None:
+                    break
+                self.write_event(*event)
+                yield self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            channel.remove_listener(listener)
+
+    def write_event(self, etag, state):
+        self.write('retry: 2000\nid: {0}\nevent: scene\ndata: {1}\n\n'.format(etag, json.dumps(state)))
+
+    def on_connection_close(self):
+        self.closed = True
+        self.queue.put_nowait(None)
+
+
+def build_stream_stats(app):
+    """Factory to setup the Tornado handlers streaming the stats, Flask responses are buffered by WSGI.
+
+    Returns:
+        List of Tornado URL specs, to route before the Flask fallback.
+    """
+    keepalive = app.config.get('STATS_SCENE_KEEPALIVE', 15)
+    return [
+        (r'/api/stats/scene/stream', StatsSceneStreamHandler, {'app': app, 'keepalive': keepalive})
+    ]
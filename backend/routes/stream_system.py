@@ -4,13 +4,15 @@ import json
 import docker
 import shutil
 
+from datetime import datetime
+
 from apiclient import discovery
 from apiclient.http import MediaFileUpload
 from flask import request, jsonify
 
 from helpers.general import safe_json_loads
 from helpers.endpoint import secure
-from helpers.obs import send_command_to_obs
+from helpers.obs import send_command_to_obs, send_batch_to_obs, get_obs_mirror
 from models import User
 
 def build_api_stream_system(app):
@@ -25,6 +27,7 @@ def build_api_stream_system(app):
         @apiName OBSSceneList
         @apiGroup StreamSystem
         @apiDescription List the available scenes in OBS.
+        Answered from the OBS state mirror when it is synced, OBS is queried otherwise.
 
         @apiHeader {String} Authorization 'Bearer <Auth_Token>'
         @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
@@ -36,7 +39,18 @@ def build_api_stream_system(app):
         @apiError (Errors){String} OBSInternalError Error communicating to OBS.
         @apiSuccess {String[]} scenes All available scenes with their name as Strings.
         @apiSuccess {String} active_scene Active scene.
+        @apiSuccess {String} updated_at ISO timestamp of the last known OBS state.
         """
+        snapshot = get_obs_mirror('RediffPlaylist').snapshot()
+        if snapshot is not None:
+            return jsonify({'success': 'yes',
+                            'error': '',
+                            'payload': {
+                                'scenes': snapshot['scenes'],
+                                'active_scene': snapshot['active_scene'],
+                                'updated_at': snapshot['updated_at']
+                            }}), 200
+
         scenes = []
         try:
             result = send_command_to_obs('GetSceneList', {})
@@ -46,7 +60,8 @@ def build_api_stream_system(app):
                             'error': '',
                             'payload': {
                                 'scenes': scenes,
-                                'active_scene': result['current-scene']
+                                'active_scene': result['current-scene'],
+                                'updated_at': datetime.utcnow().isoformat() + 'Z'
                             }}), 200
         except Exception as e:
             logging.error(e)
@@ -269,6 +284,7 @@ def build_api_stream_system(app):
         @apiName OBSStatus
         @apiGroup StreamSystem
         @apiDescription Get OBS streaming and recording status.
+        Answered from the OBS state mirror when it is synced, OBS is queried otherwise.
 
         @apiHeader {String} Authorization 'Bearer <Auth_Token>'
         @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
@@ -280,14 +296,106 @@ def build_api_stream_system(app):
         @apiError (Errors){String} OBSInternalError Error communicating to OBS.
         @apiSuccess {Boolean} recording Status of the OBS record.
         @apiSuccess {Boolean} streaming Status of the OBS stream.
+        @apiSuccess {String} updated_at ISO timestamp of the last known OBS state.
         """
+        snapshot = get_obs_mirror('RediffPlaylist').snapshot()
+        if snapshot is not None:
+            return jsonify({'success': 'yes',
+                            'error': '',
+                            'payload': {
+                                'recording': snapshot['recording'],
+                                'streaming': snapshot['streaming'],
+                                'updated_at': snapshot['updated_at']
+                            }}), 200
+
         try:
             result = send_command_to_obs('GetStreamingStatus', {})
             return jsonify({'success': 'yes',
                             'error': '',
                             'payload': {
                                 'recording': result['recording'],
-                                'streaming': result['streaming']
+                                'streaming': result['streaming'],
+                                'updated_at': datetime.utcnow().isoformat() + 'Z'
+                            }}), 200
+        except Exception as e:
+            logging.error(e)
+            return jsonify({'success': 'no',
+                            'error': 'InternalOBSError',
+                            'payload': {}}), 200
+
+    @app.route('/api/obs/batch', methods=['POST'])
+    @secure(app, ['key', 'user'], ['obs_control'])
+    def post_obs_batch(auth_token):
+        """
+        @api {post} /api/obs/batch OBSBatch
+        @apiVersion 1.1.0
+        @apiName OBSBatch
+        @apiGroup StreamSystem
+        @apiDescription Send an ordered list of requests to OBS in a single call.
+        Requests are pipelined on the OBS connection and all answers are returned together.
+
+        @apiHeader {String} Authorization 'Bearer <Auth_Token>'
+        @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
+        @apiError (Errors){String} AuthTokenExpired Token has expired, must be refreshed by client.
+        @apiError (Errors){String} AuthTokenInvalid Token is invalid, decode is impossible.
+        @apiError (Errors){String} ClientAccessImpossible This type of client can't access target endpoint.
+        @apiError (Errors){String} ClientAccessRefused Client has no scope access to target endpoint.
+
+        @apiError (Errors){String} OBSInternalError Error communicating to OBS.
+
+        @apiParam {Object[]} requests Ordered list of OBS requests.
+        @apiParam {String} requests.request-type OBS request type, 'SetCurrentScene' for example.
+        @apiParam {Object} [requests.options] Optional OBS request fields, {'scene-name': 'RTMP'} for example.
+        @apiError (Errors){String} RequestsParameterMissing requests is not present in the parameters.
+        @apiError (Errors){String} RequestsParameterInvalid requests is not a list of valid OBS requests.
+        @apiParam {Boolean} [abort_on_error=false] Stop the batch at the first request answered with an error.
+        @apiError (Errors){String} AbortOnErrorParameterInvalid abort_on_error is not a valid boolean.
+
+        @apiSuccess {Object[]} results OBS answers, in the order of the requests.
+        @apiSuccess {Boolean} aborted True if some requests were not sent because of a previous error.
+        """
+        data = request.get_json(force=True)
+
+        # requests checks
+        obs_requests = data.get('requests', None)
+        if obs_requests is None:
+            return jsonify({'success': 'no',
+                            'error': 'RequestsParameterMissing',
+                            'payload': {}
+                            }), 200
+        if not isinstance(obs_requests, list) or len(obs_requests) == 0:
+            return jsonify({'success': 'no',
+                            'error': 'RequestsParameterInvalid',
+                            'payload': {}
+                            }), 200
+        batch = []
+        for obs_request in obs_requests:
+            if (not isinstance(obs_request, dict)
+                    or not isinstance(obs_request.get('request-type', None), str)
+                    or len(obs_request['request-type']) == 0
+                    or not isinstance(obs_request.get('options', {}), dict)):
+                return jsonify({'success': 'no',
+                                'error': 'RequestsParameterInvalid',
+                                'payload': {}
+                                }), 200
+            batch.append((obs_request['request-type'], obs_request.get('options', {})))
+
+        # abort_on_error checks
+        abort_on_error = data.get('abort_on_error', False)
+        if not isinstance(abort_on_error, bool):
+            return jsonify({'success': 'no',
+                            'error': 'AbortOnErrorParameterInvalid',
+                            'payload': {}
+                            }), 200
+
+        # Send commands to obs
+        try:
+            results = send_batch_to_obs(batch, abort_on_error)
+            return jsonify({'success': 'yes',
+                            'error': '',
+                            'payload': {
+                                'results': results,
+                                'aborted': len(results) < len(batch)
                             }}), 200
         except Exception as e:
             logging.error(e)
@@ -693,6 +801,7 @@ def build_api_stream_system(app):
         @apiName OBSPlaylistGet
         @apiGroup StreamSystem
         @apiDescription Get OBS playlist content for replay.
+        Answered from the OBS state mirror when it is synced, OBS is queried otherwise.
 
         @apiHeader {String} Authorization 'Bearer <Auth_Token>'
         @apiError (Errors){String} AuthorizationHeaderInvalid Authorization Header is Invalid.
@@ -704,7 +813,18 @@ def build_api_stream_system(app):
         @apiError (Errors){String} OBSInternalError Error communicating to OBS.
 
         @apiSuccess {String[]} files List of file paths inside the playlist.
+        @apiSuccess {String} updated_at ISO timestamp of the last known OBS state.
         """
+        len_path = len(app.config['OBS_PLAYLIST_PATH']) + 1
+        snapshot = get_obs_mirror('RediffPlaylist').snapshot()
+        if snapshot is not None and snapshot['playlist'] is not None:
+            return jsonify({'success': 'yes',
+                            'error': '',
+                            'payload': {
+                                'files': [file['value'][len_path:] for file in snapshot['playlist']],
+                                'updated_at': snapshot['updated_at']
+                            }}), 200
+
         try:
             files = []
             result = send_command_to_obs('GetSourceSettings', {'sourceName': 'RediffPlaylist'})
@@ -712,13 +832,13 @@ def build_api_stream_system(app):
                 return jsonify({'success': 'no',
                                 'error': 'InternalOBSError',
                                 'payload': {}}), 200
-            len_path = len(app.config['OBS_PLAYLIST_PATH']) + 1
             for file in result['sourceSettings']['playlist']:
                 files.append(file['value'][len_path:])
             return jsonify({'success': 'yes',
                             'error': '',
                             'payload': {
-                                'files': files
+                                'files': files,
+                                'updated_at': datetime.utcnow().isoformat() + 'Z'
                             }}), 200
         except Exception as e:
             logging.error(e)
@@ -785,6 +905,7 @@ def build_api_stream_system(app):
                 return jsonify({'success': 'no',
                                 'error': 'InternalOBSError',
                                 'payload': {}}), 200
+            get_obs_mirror('RediffPlaylist').update(playlist=path_files)
             return jsonify({'success': 'yes',
                             'error': '',
                             'payload': {
@@ -3,13 +3,13 @@ import json
 import time
 import os
 from datetime import datetime
-import hashlib
 
 from flask_script import Manager
 
 from app import create_app
 from models import db, APIKey, APIKeyScope, User, UserScope, Scope, Game, GameStatus, GameVIP, GameVIPType, DotaHero, DotaItem, DotaProPlayer, DotaProTeam
 from helpers.obs import send_command_to_obs
+from helpers.api_key import get_api_key_hasher
 
 app = create_app()
 manager = Manager(app)
@@ -39,15 +39,13 @@ def add_api_key(key, description):
         print('No description specified')
         return
 
-    salt = app.config['API_KEY_SALT']
-    hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-    hash_key = hash_object.hexdigest()
-    api_key = db.session().query(APIKey).filter(APIKey.key_hash == hash_key).one_or_none()
+    hasher = get_api_key_hasher(app)
+    api_key = hasher.find(key)
 
     if api_key is not None:
         print('Key already in the system')
     else:
-        key = APIKey(hash_key, description)
+        key = APIKey(hasher.hash(key), description)
         db.session().add(key)
         db.session().commit()
         print('Key added')
@@ -71,10 +69,7 @@ def add_scope_api_key(key, scope):
         print('Invalid scope')
         return
 
-    salt = app.config['API_KEY_SALT']
-    hash_object = hashlib.sha1((key + salt).encode('utf-8'))
-    hash_key = hash_object.hexdigest()
-    api_key = db.session().query(APIKey).filter(APIKey.key_hash == hash_key).one_or_none()
+    api_key = get_api_key_hasher(app).find(key)
 
     if api_key is None:
         print('Key not present!')
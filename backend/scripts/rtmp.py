@@ -1,7 +1,11 @@
 #!/usr/bin/python3
 import argparse
+import requests
+
+class RTMPScriptError(Exception):
+    """Raised when a call to the API fails."""
+    pass
 
-from grenouilleAPIClient.client import GrenouilleAPIClient
 
 class RTMPScripts:
 
@@ -16,16 +20,54 @@ class RTMPScripts:
                 function()
         except AttributeError as e:
             pass
+        except RTMPScriptError as e:
+            print('Action {0} failed: {1}'.format(action, e))
+            exit(1)
+
+    def call(self, method, path, **kwargs):
+        """Call an API endpoint.
+
+        Args:
+            method: HTTP method of the endpoint.
+            path: Path of the endpoint.
+            kwargs: Arguments of `requests.request`.
+        Returns:
+            Payload of the answer.
+        Raises:
+            RTMPScriptError: If the API can't be reached or does not answer with a success.
+        """
+        try:
+            r = requests.request(method, '{0}{1}'.format(self.host, path), timeout=30, **kwargs)
+        except requests.RequestException as e:
+            raise RTMPScriptError('{0} unreachable: {1}'.format(path, e))
+        try:
+            result = r.json()
+        except ValueError:
+            raise RTMPScriptError('{0} answered {1} without JSON.'.format(path, r.status_code))
+        if r.status_code != 200 or result.get('success', 'no') != 'yes':
+            raise RTMPScriptError('{0} answered {1}: {2}'.format(path, r.status_code, result.get('error', '')))
+        return result['payload']
+
+    def get_auth_token(self):
+        """Exchange the API Key for a short lived auth token."""
+        refresh_token = self.call('GET', '/api/auth/login/key', headers={'API_KEY': self.key})['token']
+        return self.call('GET', '/api/auth/token',
+                         headers={'Authorization': 'Bearer {0}'.format(refresh_token)})['token']
+
+    def obs_batch(self, obs_requests):
+        """Send all the OBS requests in a single call to the batch endpoint."""
+        auth_token = self.get_auth_token()
+        return self.call('POST', '/api/obs/batch',
+                         headers={'Authorization': 'Bearer {0}'.format(auth_token)},
+                         json={'requests': obs_requests})
 
     def publish_done(self):
-        client = GrenouilleAPIClient(self.host, self.key)
-        client.OBS_stop_record()
-        client.OBS_change_scene('Waiting')
+        self.obs_batch([{'request-type': 'StopRecording'},
+                        {'request-type': 'SetCurrentScene', 'options': {'scene-name': 'Waiting'}}])
 
     def publish_start(self):
-        client = GrenouilleAPIClient(self.host, self.key)
-        client.OBS_change_scene('RTMP')
-        client.OBS_start_record()
+        self.obs_batch([{'request-type': 'SetCurrentScene', 'options': {'scene-name': 'RTMP'}},
+                        {'request-type': 'StartRecording'}])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Script file to run on rtmp events.')